@@ -6,31 +6,50 @@ Search log for bugs.
 Finds occurrences of 'Received' in the log file that are not followed by an
 occurrence of 'Finished'. These are probably runs of the namechecker that
 crashed.
+
+For structured logs (`LOG_FORMAT = 'json'`), messages are matched by their
+request id. Otherwise, a 'Received' message is reported if it is followed by
+another 'Received' message before a 'Finished' message.
 """
 
 
 from __future__ import unicode_literals
 
-import os
-from mutalyzer import config
-
-
-handle = open(config.get('log'), 'r')
-
-scanning = False
-line = handle.readline()
-
-while line:
-    if not scanning:
-        if ' Received ' in line:
-            message = line
-            scanning = True
+import io
+import json
+
+from mutalyzer.config import settings
+
+
+def find_crashes_json(handle):
+    received = {}
+    for line in handle:
+        record = json.loads(line)
+        if record['message'].startswith('Received '):
+            received[record['request']] = record
+        elif record['message'].startswith('Finished '):
+            received.pop(record['request'], None)
+    for record in sorted(received.values(), key=lambda r: r['time']):
+        print '%s %s' % (record['time'], record['message'])
+
+
+def find_crashes_text(handle):
+    scanning = False
+    for line in handle:
+        if not scanning:
+            if ' Received ' in line:
+                message = line
+                scanning = True
+        else:
+            if ' Received ' in line:
+                print message,
+                scanning = False
+            if ' Finished ' in line:
+                scanning = False
+
+
+with io.open(settings.LOG_FILE, encoding='utf-8') as handle:
+    if settings.LOG_FORMAT == 'json':
+        find_crashes_json(handle)
     else:
-        if ' Received ' in line:
-            print message,
-            scanning = False
-        if ' Finished ' in line:
-            scanning = False
-    line = handle.readline()
-
-handle.close()
+        find_crashes_text(handle)
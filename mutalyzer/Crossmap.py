@@ -12,6 +12,8 @@ and stop and the orientation of a transcript.
 
 from __future__ import unicode_literals
 
+import numpy
+
 class Crossmap() :
     """
     Convert from I{g.} to I{c.} or I{n.} notation or vice versa.
@@ -39,6 +41,8 @@ class Crossmap() :
         - __minusr(a, b)            ; A protected '-' that skips 0 if
                                       a > 0 and b < 0.
         - __crossmap_splice_sites() ; Calculate the __crossmapping list.
+        - __arrays()                ; The RNA and __crossmapping lists as
+                                      numpy arrays, created on first use.
 
     Public methods:
         - int2main(a) ; Translate from __STOP to '*' notation.
@@ -51,6 +55,11 @@ class Crossmap() :
             to I{c.} notation.
         - g2c(a) ; Uses both g2x() and tuple2string() to translate a genomic
             position to __STOP notation to I{c.} notation.
+        - g2x_many(positions) ; Array version of g2x().
+        - x2g_many(mains, offsets) ; Array version of x2g().
+        - tuple2string_many(mains, offsets) ; Array version of
+            tuple2string().
+        - g2c_many(positions) ; Array version of g2c().
         - info() ; Return transcription start, transcription end and CDS stop.
         - getSpliceSite(number) ; Return the coordinate of a splice site.
         - numberOfIntrons() ; Returns the number of introns.
@@ -98,8 +107,33 @@ class Crossmap() :
 
         if not self.__STOP :
             self.__STOP = self.__trans_end
+
+        # Used by the array versions of the conversion methods, created on
+        # first use (see __arrays).
+        self.__RNA_array = None
+        self.__crossmapping_array = None
     #__init__
 
+    def __arrays(self) :
+        """
+        Return the RNA list and the crossmapping list as numpy arrays, for
+        use by the array versions of the conversion methods. They are
+        created on the first call, since most instances never use them.
+
+        Private variables (altered):
+            - __RNA_array          ; The RNA list as numpy array.
+            - __crossmapping_array ; The __crossmapping list as numpy array.
+
+        @return: The RNA array and the crossmapping array
+        @rtype: tuple(numpy.ndarray, numpy.ndarray)
+        """
+        if self.__RNA_array is None :
+            self.__RNA_array = numpy.array(self.RNA, dtype=numpy.int64)
+            self.__crossmapping_array = numpy.array(self.__crossmapping,
+                                                    dtype=numpy.int64)
+        return self.__RNA_array, self.__crossmapping_array
+    #__arrays
+
     def __plus(self, a, b) :
         """
         This method returns a + b unless a is smaller than zero and the
@@ -532,6 +566,176 @@ class Crossmap() :
         return self.tuple2string(self.g2x(a), fuzzy)
     #g2c
 
+    def g2x_many(self, positions) :
+        """
+        Array version of g2x(). The results are the same as those of g2x()
+        for each of the positions, but they are calculated in one pass using
+        a binary search over the splice sites.
+
+        @arg positions: The genomic positions that must be translated
+        @type positions: list(integer)
+
+        @return: The I{c.} or I{n.} notation of the positions, as tuples
+            (main, offset) in __STOP notation
+        @rtype: list(tuple(integer, integer))
+        """
+        a = numpy.asarray(positions, dtype=numpy.int64)
+        rna, cm = self.__arrays()
+        RNAlen = len(rna)
+        d = self.orientation
+        c = (d - 1) / -2     # c and y are used to unify forward and reverse
+        y = c * (RNAlen - 1) # complement.
+
+        # Index i of the exon or intron [RNA[i], RNA[i + 1]] a is in. Even
+        # indices are exons, odd indices are introns. A position on the
+        # first splice site of an exon is in that exon, not in the intron.
+        i = numpy.clip(numpy.searchsorted(rna, a) - 1, 0, RNAlen - 2)
+        i += (i % 2 == 1) & (a == rna[i + 1])
+        intron = i % 2 == 1
+
+        # A "normal" position in an exon.
+        main = self.__plus_many(cm[i + c], d * (a - rna[i + c]))
+        offset = numpy.zeros_like(a)
+
+        # A position in an intron is relative to the closest exon.
+        closest = numpy.where(d * (a - rna[i]) > d * (rna[i + 1] - a),
+                              i + 1 - c, i + c)
+        main = numpy.where(intron, cm[closest], main)
+        offset = numpy.where(intron, d * (a - rna[closest]), offset)
+
+        # A position before the first exon or after the last exon.
+        for splice_site, outside in ((RNAlen - y - 1, d * a > d * rna[-y - 1]),
+                                     (y, d * a < d * rna[y])):
+            main = numpy.where(outside, cm[splice_site], main)
+            offset = numpy.where(outside, d * (a - rna[splice_site]), offset)
+
+        return zip(main.tolist(), offset.tolist())
+    #g2x_many
+
+    def x2g_many(self, mains, offsets) :
+        """
+        Array version of x2g(). The results are the same as those of x2g()
+        for each of the positions, but they are calculated in one pass using
+        a binary search over the splice sites.
+
+        @arg mains: The I{n.} or I{c.} positions to be translated
+        @type mains: list(integer)
+        @arg offsets: The offsets of the positions
+        @type offsets: list(integer)
+
+        @return: The I{g.} positions
+        @rtype: list(integer)
+        """
+        a = numpy.asarray(mains, dtype=numpy.int64)
+        b = numpy.asarray(offsets, dtype=numpy.int64)
+        rna, cm = self.__arrays()
+        RNAlen = len(rna)
+        d = self.orientation
+        c = (-d - 1) / -2 # Used to unify forward and reverse complement.
+
+        # Assume a position before exon 1.
+        ret = rna[0] - d * (cm[0] - a)
+        # Or after the last exon.
+        ret = numpy.where(d * a > d * cm[RNAlen - 1],
+                          rna[RNAlen - 1] + d * (a - cm[RNAlen - 1]), ret)
+
+        # Is it in an exon? The crossmapping is increasing in the direction
+        # of the transcript, so the last exon starting before the position
+        # is the only candidate.
+        exon_starts = d * cm[::2]
+        i = 2 * numpy.clip(numpy.searchsorted(exon_starts, d * a,
+                                              side='right') - 1,
+                           0, len(exon_starts) - 1)
+        exon = (d * cm[i] <= d * a) & (d * a <= d * cm[i + 1])
+        ret = numpy.where(exon,
+                          rna[i + c] - d * self.__minusr_many(cm[i + c], a),
+                          ret)
+        ret += d * b # Add the intron count.
+
+        if cm[d - c] == 1 : # Patch for CDS start on first nucleotide of
+            ret += d * (a < 0) # exon 1.
+
+        return ret.tolist()
+    #x2g_many
+
+    def tuple2string_many(self, mains, offsets, fuzzy=False) :
+        """
+        Array version of tuple2string().
+
+        @arg mains: Main positions in __STOP notation
+        @type mains: list(integer)
+        @arg offsets: The offsets of the positions
+        @type offsets: list(integer)
+        @kwarg fuzzy: Denotes that the coordinates are fuzzy (i.e. offsets
+            are unknown).
+        @type fuzzy: bool
+
+        @return: The positions in HGVS notation
+        @rtype: list(unicode)
+        """
+        t0 = numpy.asarray(mains, dtype=numpy.int64)
+        t1 = numpy.asarray(offsets, dtype=numpy.int64)
+
+        # Outside the transcript, the offset is added to the main position.
+        outside = (t0 >= self.__trans_end) | (t0 <= self.__trans_start)
+        main = numpy.where(outside, self.__minus_many(t0, -t1), t0)
+        offset = numpy.where(outside, 0, t1)
+
+        positions = []
+        for m, o in zip(main.tolist(), offset.tolist()) :
+            if o > 0 :
+                offset_string = '+?' if fuzzy else '+' + unicode(o)
+            elif o < 0 :
+                offset_string = '-?' if fuzzy else unicode(o)
+            else :
+                offset_string = ''
+            positions.append(self.int2main(m) + offset_string)
+        return positions
+    #tuple2string_many
+
+    def g2c_many(self, positions, fuzzy=False) :
+        """
+        Array version of g2c().
+
+        @arg positions: The genomic positions that must be translated
+        @type positions: list(integer)
+        @kwarg fuzzy: Denotes that the coordinates are fuzzy (i.e. offsets
+            are unknown).
+        @type fuzzy: bool
+
+        @return: The positions in HGVS notation
+        @rtype: list(unicode)
+        """
+        mains, offsets = zip(*self.g2x_many(positions)) or ([], [])
+        return self.tuple2string_many(mains, offsets, fuzzy)
+    #g2c_many
+
+    @staticmethod
+    def __plus_many(a, b) :
+        """
+        Array version of __plus().
+        """
+        r = a + b
+        return r + ((a <= 0) & (r >= 0))
+    #__plus_many
+
+    @staticmethod
+    def __minus_many(a, b) :
+        """
+        Array version of __minus().
+        """
+        r = a - b
+        return r - ((a >= 0) & (r <= 0))
+    #__minus_many
+
+    @staticmethod
+    def __minusr_many(a, b) :
+        """
+        Array version of __minusr().
+        """
+        return a - b - ((a > 0) & (b < 0))
+    #__minusr_many
+
     def info(self) :
         """
         Return transcription start, transcription end and CDS stop.
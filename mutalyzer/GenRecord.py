@@ -17,6 +17,12 @@ search for them each time.
 
 from __future__ import unicode_literals
 
+from bisect import bisect_right
+import copy
+
+from Bio.Alphabet import IUPAC
+from Bio.Data import CodonTable
+
 from mutalyzer import util
 from mutalyzer import Crossmap
 
@@ -293,8 +299,27 @@ class Record(object) :
         self.chromDescription = ""
         self.orientation = 1
         self.recordId = None
+        self._transcript_index = None
+        self._cds_translatable = {}
     #__init__
 
+    def __deepcopy__(self, memo) :
+        """
+        Copy the record. The copy shares the reference sequence, which is
+        never modified, and the cache of cds_translatable with this record.
+        """
+        # Records read from a compact record file have no cache yet.
+        cache = self.__dict__.setdefault('_cds_translatable', {})
+        memo[id(cache)] = cache
+        seq = self.__dict__.get('seq')
+        memo[id(seq)] = seq
+
+        record = self.__class__.__new__(self.__class__)
+        memo[id(self)] = record
+        record.__dict__.update(copy.deepcopy(self.__dict__, memo))
+        return record
+    #__deepcopy__
+
     def findGene(self, name) :
         """
         Returns a Gene object, given its name.
@@ -388,6 +413,94 @@ class Record(object) :
         else :
             self.chromDescription = rawVariant
     #addToChromDescription
+
+    def index_transcripts(self):
+        """
+        Build an index of the transcripts in this record by the range they
+        span on the reference sequence (the mRNA and CDS ranges).
+
+        The ranges are only complete after GenRecord.checkRecord has been
+        called, so this should be called afterwards (and again after any
+        change to the transcripts).
+        """
+        intervals = []
+        for gene in self.geneList:
+            for transcript in gene.transcriptList:
+                positions = []
+                if transcript.mRNA:
+                    positions.extend(transcript.mRNA.positionList or
+                                     transcript.mRNA.location)
+                if transcript.CDS:
+                    positions.extend(transcript.CDS.location)
+                if positions:
+                    intervals.append((min(positions), max(positions),
+                                      transcript))
+        intervals.sort(key=lambda interval: interval[:2])
+
+        # Intervals are sorted by start position, so we only have to look at
+        # intervals starting at most the longest interval length before the
+        # queried range.
+        self._transcript_index = (
+            [start for start, _, _ in intervals], intervals,
+            max([stop - start for start, stop, _ in intervals] or [0]))
+    #index_transcripts
+
+    def overlapping_transcripts(self, first, last):
+        """
+        Find the transcripts overlapping a range on the reference sequence,
+        using the index built by index_transcripts.
+
+        @arg first: First position of the range.
+        @type first: integer
+        @arg last: Last position of the range.
+        @type last: integer
+
+        @return: Transcripts overlapping the range.
+        @rtype: list(Locus)
+        """
+        starts, intervals, max_length = self._transcript_index
+
+        i = bisect_right(starts, first - max_length - 1)
+        j = bisect_right(starts, last)
+        return [transcript for _, stop, transcript in intervals[i:j]
+                if stop >= first]
+    #overlapping_transcripts
+
+    def cds_translatable(self, transcript):
+        """
+        Check if the CDS of a transcript can be translated on the reference
+        sequence (i.e., it has a start codon, a stop codon and no internal
+        stop codons).
+
+        The result is cached in the record (and its copies) by CDS position
+        list and translation table, so the CDS of a transcript is translated
+        only once per record. The CDS position list is only complete after
+        GenRecord.checkRecord has been called.
+
+        @arg transcript: A transcript with a CDS.
+        @type transcript: Locus
+
+        @return: True if the CDS can be translated, False otherwise.
+        @rtype: bool
+        """
+        key = (tuple(transcript.CDS.positionList), transcript.CM.orientation,
+               transcript.txTable)
+        cache = self.__dict__.setdefault('_cds_translatable', {})
+
+        if key not in cache:
+            cds = util.splice(self.seq, transcript.CDS.positionList)
+            cds.alphabet = IUPAC.unambiguous_dna
+            if transcript.CM.orientation == -1:
+                cds = cds.reverse_complement()
+            try:
+                cds.translate(table=transcript.txTable, cds=True)
+            except CodonTable.TranslationError:
+                cache[key] = False
+            else:
+                cache[key] = True
+
+        return cache[key]
+    #cds_translatable
 #Record
 
 class GenRecord() :
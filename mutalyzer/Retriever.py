@@ -9,27 +9,46 @@ to re-download the file.
 
 from __future__ import unicode_literals
 
-import bz2
 import chardet
+import codecs
+from contextlib import contextmanager
+import copy
+import errno
+import fcntl
 import hashlib
 import io
 import os
+import threading
+import time
+import urllib
 import urllib2
 
 from Bio import Entrez
-from Bio import SeqIO
 from Bio.Alphabet import ProteinAlphabet
 from Bio.Seq import UnknownSeq
 from httplib import HTTPException
 from sqlalchemy.orm.exc import NoResultFound
 from xml.dom import DOMException
 
+from mutalyzer import compression
+from mutalyzer import dbgb
+from mutalyzer import file_cache
+from mutalyzer import lookup_cache
+from mutalyzer import nc_db
+from mutalyzer import ncbi
 from mutalyzer import util
 from mutalyzer.config import settings
 from mutalyzer.db import session
 from mutalyzer.db.models import Reference
+from mutalyzer.parsers import compact
 from mutalyzer.parsers import genbank
 from mutalyzer.parsers import lrg
+from mutalyzer.parsers.genbank_reader import read_record
+from mutalyzer.record_cache import cache as record_cache
+
+
+# Number of bytes used to detect the encoding of a file that is not UTF-8.
+ENCODING_DETECTION_SIZE = 64 * 1024
 
 
 class Retriever(object):
@@ -63,42 +82,160 @@ class Retriever(object):
         return os.path.join(
             settings.CACHE_DIR, '{}.{}.bz2'.format(name, self.file_type))
 
-    def _write(self, raw_data, filename):
+    def _name_to_compact_file(self, name):
         """
-        Write raw data to a compressed file.
+        Convert an accession number to the filename of its compact record
+        file (see :mod:`mutalyzer.parsers.compact`).
 
-        :arg str raw_data: The raw_data to be compressed and written.
-        :arg unicode filename: The intended name of the output filename.
+        :arg unicode name: The accession number.
 
-        :returns: The full path and name of the file written.
+        :returns: A filename.
         :rtype: unicode
         """
-        result = chardet.detect(raw_data)
+        return os.path.join(
+            settings.CACHE_DIR, '{}.{}.rec'.format(name, self.file_type))
+
+    def _to_utf8(self, raw_data):
+        """
+        Convert raw data to UTF-8.
+
+        Data that is valid UTF-8 is returned unchanged. Otherwise, the
+        encoding is detected on at most `ENCODING_DETECTION_SIZE` bytes,
+        starting at the first byte that is not valid UTF-8.
+
+        :arg str raw_data: The raw data.
+
+        :returns: The data encoded as UTF-8, or `None` if it could not be
+          decoded.
+        :rtype: str
+        """
+        try:
+            raw_data.decode('utf-8')
+            return raw_data
+        except UnicodeDecodeError as e:
+            result = chardet.detect(
+                raw_data[e.start:e.start + ENCODING_DETECTION_SIZE])
+
         if result['confidence'] > 0.5:
             encoding = unicode(result['encoding'])
         else:
             encoding = 'utf-8'
 
-        if not util.is_utf8_alias(encoding):
+        try:
+            return raw_data.decode(encoding).encode('utf-8')
+        except (UnicodeDecodeError, LookupError):
+            self._output.addMessage(
+                __file__, 4, 'ENOPARSE',
+                'Could not decode file (using {} encoding).'.format(
+                    encoding))
+            return None
+
+    @contextmanager
+    def _lock(self, name):
+        """
+        Context manager holding an exclusive lock on a name, shared by all
+        processes using the cache directory.
+
+        This is used to make sure only one process downloads a record while
+        others wait for it. The lock is implemented by `flock` on a file in
+        the `locks` subdirectory of the cache directory. Unused lock files
+        can be removed at any time (see :func:`file_cache.clean_locks`), so
+        after locking we check that the lock file is still there.
+
+        :arg unicode name: Name to lock (e.g., an accession number).
+
+        :returns: Handle to the lock file, opened for reading and appending.
+          The lock holder can use it to leave a note for the next holder.
+        :rtype: file
+        """
+        directory = os.path.join(settings.CACHE_DIR, 'locks')
+        try:
+            os.mkdir(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        lock_file = self._lock_file(name)
+        while True:
+            handle = open(lock_file, 'a+')
+            fcntl.flock(handle, fcntl.LOCK_EX)
             try:
-                raw_data = raw_data.decode(encoding).encode('utf-8')
-            except UnicodeDecodeError:
-                self._output.addMessage(
-                    __file__, 4, 'ENOPARSE',
-                    'Could not decode file (using {} encoding).'.format(
-                        encoding))
-                return None
+                if os.fstat(handle.fileno()).st_ino == \
+                        os.stat(lock_file).st_ino:
+                    break
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    handle.close()
+                    raise
+            # The lock file was removed while we were waiting for it.
+            handle.close()
+
+        with handle:
+            try:
+                yield handle
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _lock_file(self, name):
+        """
+        Get the filename of the lock file for a name (see :meth:`_lock`).
+
+        Characters that cannot safely be used in a filename are quoted, and
+        long names are hashed.
+
+        :arg unicode name: Name to lock (e.g., an accession number).
+
+        :returns: A filename.
+        :rtype: unicode
+        """
+        name = urllib.quote(name.encode('utf-8'), safe='')
+        if len(name) > 200:
+            name = hashlib.sha1(name).hexdigest()
+        return os.path.join(settings.CACHE_DIR, 'locks',
+                            '{}.lock'.format(name.decode('ascii')))
+
+    def _write(self, raw_data, filename):
+        """
+        Write raw data to a compressed file.
+
+        :arg str raw_data: The raw_data to be compressed and written.
+        :arg unicode filename: The intended name of the output filename.
+
+        :returns: The full path and name of the file written.
+        :rtype: unicode
+        """
+        raw_data = self._to_utf8(raw_data)
+        if raw_data is None:
+            return None
+
+        return self._write_utf8(raw_data, filename)
+
+    def _write_utf8(self, raw_data, filename):
+        """
+        Write UTF-8 encoded data to a compressed file.
+
+        :arg str raw_data: The UTF-8 encoded data to be compressed and
+          written.
+        :arg unicode filename: The intended name of the output filename.
 
-        # Compress the data to save disk space.
-        comp = bz2.BZ2Compressor()
-        data = comp.compress(raw_data)
-        data += comp.flush()
-        out_handle = open(self._name_to_file(filename), 'wb')
-        out_handle.write(data)
-        out_handle.close()
+        :returns: The full path and name of the file written.
+        :rtype: unicode
+        """
+        # Compress the data with the configured codec.
+        data = compression.compress(raw_data)
+
+        # The file is written to a temporary file first and then renamed, so
+        # readers never see a partially written file.
+        filename = self._name_to_file(filename)
+        temporary_filename = '{}.{}.{}.tmp'.format(
+            filename, os.getpid(), threading.current_thread().ident)
+        with open(temporary_filename, 'wb') as out_handle:
+            out_handle.write(data)
+        os.rename(temporary_filename, filename)
+        file_cache.add(filename)
 
         # Return the full path to the file.
-        return out_handle.name
+        return filename
 
     def _calculate_hash(self, content):
         """
@@ -135,11 +272,8 @@ class Retriever(object):
         :rtype: unicode
         """
         # TODO: Documentation.
-        try:
-            reference = Reference.query.filter_by(accession=name).one()
-            current_md5sum = reference.checksum
-        except NoResultFound:
-            current_md5sum = None
+        reference = lookup_cache.get_reference(name)
+        current_md5sum = reference and reference.checksum
 
         if current_md5sum:
             md5sum = self._calculate_hash(raw_data)
@@ -151,6 +285,7 @@ class Retriever(object):
                 Reference.query.filter_by(accession=name).update(
                     {'checksum': md5sum})
                 session.commit()
+                lookup_cache.invalidate_reference(name)
         else:
             reference = Reference(name, self._calculate_hash(raw_data), source)
             session.add(reference)
@@ -169,12 +304,18 @@ class GenBankRetriever(Retriever):
         """
         Retriever.__init__(self, output)
         self.file_type = 'gb'
+        # Records parsed while writing their files, by full path of the
+        # file. Only kept during a call to `loadrecord`, which uses them, and
+        # `None` otherwise. See `write` and `loadrecord`.
+        self._written_records = None
         # TODO documentation
 
     def write(self, raw_data, filename, extract):
         """
         Write raw data to a file. The data is parsed before writing, if a
         parse error occurs an error is returned and the function exits.
+        If called while loading a record, the parsed record is kept for
+        :meth:`loadrecord`, so it does not have to be parsed again.
         If 'filename' is set and 'extract' is set to 0, then 'filename' is
         used for output.
         If 'extract' is set to 1, then the filename is constructed from the
@@ -197,12 +338,14 @@ class GenBankRetriever(Retriever):
                 __file__, 4, 'ENORECORD', 'The record could not be retrieved.')
             return None
 
-        # BioPython needs a file handle.
-        fake_handle = io.BytesIO()
-        fake_handle.write(raw_data)
-        fake_handle.seek(0)
+        raw_data = self._to_utf8(raw_data)
+        if raw_data is None:
+            return None
+
         try:
-            record = SeqIO.read(fake_handle, 'genbank')
+            record = read_record(
+                codecs.getreader('utf-8')(io.BytesIO(raw_data)),
+                genbank.FEATURES)
         except (ValueError, AttributeError):
             self._output.addMessage(
                 __file__, 4, 'ENOPARSE', 'The file could not be parsed.')
@@ -231,20 +374,76 @@ class GenBankRetriever(Retriever):
                     'number to reduce downloading overhead.'.format(
                         unicode(record.id)))
 
-        if not self._write(raw_data, out_filename):
+        genbank_parser = genbank.GBparser()
+        record = genbank_parser.create_record_from_biorecord(record)
+
+        path = self._write_utf8(raw_data, out_filename)
+        if not path:
             return None
 
+        if self._written_records is not None:
+            self._written_records[path] = record
         return out_filename
 
     def fetch(self, name):
         """
-        Todo: Documentation.
+        Fetch a record from the NCBI and store it in the cache.
+
+        Concurrent fetches of the same record (also from other processes)
+        are serialized, such that only one of them downloads the record and
+        the others use the result.
+
+        A successful fetch records the time and the name of the file in the
+        lock file. If the time read under the lock is after we started
+        waiting for the lock, the record was fetched by someone else. This
+        also works for accession numbers without version, whose file is
+        stored under the versioned accession number.
+
+        :arg unicode name: Accession number of the record.
+
+        :returns: The full path to the file, or `None` in case of failure.
+        :rtype: unicode
+        """
+        waiting_since = time.time()
+
+        with self._lock(name) as handle:
+            filename = self._name_to_file(name)
+            if (os.path.isfile(filename) and
+                    lookup_cache.get_reference(name) is not None):
+                # Already in the cache.
+                return filename
+
+            handle.seek(0)
+            try:
+                fetched_at, fetched = handle.read().decode('utf-8').split()
+                fetched_at = float(fetched_at)
+            except ValueError:
+                fetched_at = fetched = None
+            if fetched_at is not None and fetched_at >= waiting_since:
+                # Fetched by someone else while we were waiting.
+                filename = os.path.join(settings.CACHE_DIR, fetched)
+                if os.path.isfile(filename):
+                    return filename
+
+            filename = self._fetch(name)
+            if filename:
+                handle.truncate(0)
+                handle.write('{!r} {}\n'.format(
+                    time.time(),
+                    os.path.basename(filename)).encode('utf-8'))
+                handle.flush()
+            return filename
+
+    def _fetch(self, name):
+        """
+        Implementation of :meth:`fetch` without locking.
 
         Todo: A better implementation would probably use an esummary query
             first to get the length of the sequence. If this is within limits,
             use efetch with rettype=gbwithparts to download the GenBank file.
         """
         try:
+            ncbi.rate_limit()
             net_handle = Entrez.efetch(
                 db='nuccore', id=name, rettype='gb', retmode='text')
             raw_data = net_handle.read()
@@ -292,6 +491,7 @@ class GenBankRetriever(Retriever):
                         name, settings.MAX_FILE_SIZE // 1048576))
                 return None
             try:
+                ncbi.rate_limit()
                 net_handle = Entrez.efetch(
                     db='nuccore', id=name, rettype='gbwithparts',
                     retmode='text')
@@ -327,6 +527,10 @@ class GenBankRetriever(Retriever):
         make a new UD number.
         The content of the slice is placed in the cache with the UD number
         as filename.
+        Slices of chromosomes that are available locally are created from
+        the gbparser database and sequence store (see
+        :func:`nc_db.slice_genbank`), other slices, and slices that could not
+        be created locally, are downloaded from the NCBI.
 
         :arg unicode accno: The accession number of the chromosome.
         :arg int start: Start position of the slice (one-based, inclusive, in
@@ -359,6 +563,19 @@ class GenBankRetriever(Retriever):
         source_data = '{}:{}:{}:{}'.format(
             accno, start, stop, ['forward', 'reverse'][orientation - 1])
 
+        # Concurrent requests for the same slice wait for each other.
+        with self._lock('slice-{}'.format(source_data)):
+            return self._retrieveslice(accno, start, stop, orientation,
+                                       source_data)
+
+    def _retrieveslice(self, accno, start, stop, orientation, source_data):
+        """
+        Implementation of :meth:`retrieveslice` for a valid slice, without
+        locking.
+
+        :arg unicode source_data: Value of the `Reference.source_data` field
+          for the slice.
+        """
         # Check whether we have seen this slice before.
         reference = Reference.query.filter_by(
             source='ncbi_slice',
@@ -368,23 +585,37 @@ class GenBankRetriever(Retriever):
             # It's still present.
             return reference.accession
 
-        # It's not present, so download it.
+        # It's not present, so create it from the chromosome if we have it
+        # locally, or download it otherwise.
         try:
-            # EFetch `seq_start` and `seq_stop` are one-based, inclusive, and
-            # in reference orientation.
-            handle = Entrez.efetch(
-                db='nuccore', rettype='gbwithparts', retmode='text', id=accno,
-                seq_start=start, seq_stop=stop, strand=orientation)
-            raw_data = handle.read()
-            handle.close()
-        except (IOError, urllib2.HTTPError, HTTPException) as e:
+            raw_data = nc_db.slice_genbank(accno, start, stop, orientation)
+        except Exception as e:
+            # Any problem with the gbparser database or the sequence store
+            # should not prevent us from getting the slice from the NCBI.
+            dbgb.session.rollback()
             self._output.addMessage(
                 __file__, -1, 'INFO',
-                'Error connecting to Entrez nuccore database: {}'.format(
-                    unicode(e)))
-            self._output.addMessage(
-                __file__, 4, 'ERETR', 'Could not retrieve slice.')
-            return None
+                'Could not create slice locally: {}'.format(unicode(e)))
+            raw_data = None
+        if raw_data is None:
+            try:
+                # EFetch `seq_start` and `seq_stop` are one-based, inclusive,
+                # and in reference orientation.
+                ncbi.rate_limit()
+                handle = Entrez.efetch(
+                    db='nuccore', rettype='gbwithparts', retmode='text',
+                    id=accno, seq_start=start, seq_stop=stop,
+                    strand=orientation)
+                raw_data = handle.read()
+                handle.close()
+            except (IOError, urllib2.HTTPError, HTTPException) as e:
+                self._output.addMessage(
+                    __file__, -1, 'INFO',
+                    'Error connecting to Entrez nuccore database: {}'.format(
+                        unicode(e)))
+                self._output.addMessage(
+                    __file__, 4, 'ERETR', 'Could not retrieve slice.')
+                return None
 
         # Calculate the hash of the downloaded file.
         md5sum = self._calculate_hash(raw_data)
@@ -401,6 +632,7 @@ class GenBankRetriever(Retriever):
                 Reference.query.filter_by(
                     accession=reference.accession).update({'checksum': md5sum})
                 session.commit()
+                lookup_cache.invalidate_reference(reference.accession)
         else:
             # We haven't seen it before, so give it a name.
             ud = self._new_ud()
@@ -636,13 +868,77 @@ class GenBankRetriever(Retriever):
                 return (self.write(raw_data, reference.accession, 0) and
                         reference.accession)
 
-    def loadrecord(self, accession):
+    def parse_record(self, filename, reference=None):
         """
-        Load a RefSeq record and return it.
+        Parse a GenBank file. If a reference is given, the parsed record is
+        also stored as compact record file for fast loading in the future.
+
+        :arg unicode filename: The full path to the compressed GenBank file.
+        :arg object reference: Optional :class:`Reference` for the file.
+
+        :returns: A parsed RefSeq record.
+        :rtype: object
+        """
+        genbank_parser = genbank.GBparser()
+        record = genbank_parser.create_record(filename)
+
+        if reference:
+            self._write_compact_record(record, reference)
+
+        return record
+
+    def _write_compact_record(self, record, reference):
+        """
+        Store a parsed record as compact record file.
+
+        :arg object record: A parsed RefSeq record.
+        :arg object reference: The :class:`Reference` for the record.
+        """
+        record.id = reference.accession
+        filename = self._name_to_compact_file(reference.accession)
+        try:
+            compact.write_record(record, filename, reference.checksum)
+            file_cache.add(filename)
+        except (EnvironmentError, ValueError) as e:
+            # Not fatal, we just have to parse the file again next time.
+            self._output.addMessage(
+                __file__, -1, 'INFO',
+                'Could not write compact record for {}: {}'.format(
+                    reference.accession, unicode(e)))
+
+    def build_compact_record(self, reference, force=False):
+        """
+        Create the compact record file for a reference in the cache, unless
+        an up to date compact record file already exists.
+
+        :arg object reference: The :class:`Reference` to create a compact
+          record file for.
+        :arg bool force: Create the compact record file even if it exists and
+          is up to date.
+
+        :returns: `True` if the compact record file was created, `False`
+          otherwise.
+        :rtype: bool
+        """
+        filename = self._name_to_file(reference.accession)
+        if not os.path.isfile(filename):
+            return False
+
+        if not force and compact.record_checksum(
+                self._name_to_compact_file(reference.accession)) == \
+                reference.checksum:
+            return False
+
+        self.parse_record(filename, reference)
+        return True
+
+    def retrieverecord(self, accession):
+        """
+        Make sure the file for a RefSeq record is in the cache.
 
-        The record is found by trying the following options in order:
+        The file is found by trying the following options in order:
 
-        1. Returned from the cache if it is there.
+        1. Taken from the cache if it is there.
         2. Re-created (if it was created by slicing) or re-downloaded (if it
            was created by URL) if we have information on its source in the
            database.
@@ -650,12 +946,18 @@ class GenBankRetriever(Retriever):
 
         :arg unicode accession: A RefSeq accession number.
 
-        :returns: A parsed RefSeq record or `None` if no record could be found
-          for the given accession.
-        :rtype: object
+        :returns: The full path to the file, or `None` if no record could be
+          found for the given accession.
+        :rtype: unicode
         """
-        reference = Reference.query.filter_by(accession=accession).first()
+        return self._retrieve_file(accession,
+                                   lookup_cache.get_reference(accession))
 
+    def _retrieve_file(self, accession, reference):
+        """
+        Implementation of :meth:`retrieverecord` for a reference that was
+        already looked up.
+        """
         if reference is None:
             # We don't know it, fetch it from NCBI.
             filename = self.fetch(accession)
@@ -664,7 +966,7 @@ class GenBankRetriever(Retriever):
             # We have seen it before.
             filename = self._name_to_file(reference.accession)
 
-            if os.path.isfile(filename):
+            if file_cache.lookup(filename):
                 # It is still in the cache, so filename is valid.
                 pass
 
@@ -698,15 +1000,65 @@ class GenBankRetriever(Retriever):
                     __file__, 4, 'ERETR', 'Please upload this sequence again.')
                 filename = None
 
-        # If filename is None, we could not retrieve the record.
-        if filename is None:
-            # Notify batch job to skip all instance of identifier.
-            self._output.addOutput('BatchFlags', ('S1', accession))
-            return None
+        return filename
 
-        # Now we have the file, so we can parse it.
-        genbank_parser = genbank.GBparser()
-        record = genbank_parser.create_record(filename)
+    def loadrecord(self, accession):
+        """
+        Load a RefSeq record and return it.
+
+        For a known reference, the parsed record is taken from the cache or
+        from the compact record file if possible. Otherwise, the record file
+        is retrieved as described for :meth:`retrieverecord` and then parsed,
+        unless the file was just written (and parsed) by :meth:`write`.
+
+        :arg unicode accession: A RefSeq accession number.
+
+        :returns: A parsed RefSeq record or `None` if no record could be found
+          for the given accession.
+        :rtype: object
+        """
+        reference = lookup_cache.get_reference(accession)
+
+        # Use the in-process cache of parsed records or the compact record
+        # file. We don't need the record file for these, so it can have been
+        # evicted from the cache.
+        record = None
+        if reference:
+            record = record_cache.get(reference.accession, reference.checksum)
+            if record is not None:
+                return record
+            compact_filename = self._name_to_compact_file(
+                reference.accession)
+            record = compact.create_record(compact_filename,
+                                           reference.checksum)
+            if record is not None:
+                file_cache.access(compact_filename)
+
+        if record is None:
+            self._written_records = {}
+            try:
+                filename = self._retrieve_file(accession, reference)
+                record = self._written_records.get(filename)
+            finally:
+                self._written_records = None
+
+            # If filename is None, we could not retrieve the record.
+            if filename is None:
+                # Notify batch job to skip all instance of identifier.
+                self._output.addOutput('BatchFlags', ('S1', accession))
+                return None
+
+            # Use the record parsed while writing the file. The checksum is
+            # read only now, since retrieving the file may have updated it.
+            if record is not None:
+                if reference is None:
+                    # A newly fetched reference.
+                    reference = lookup_cache.get_reference(accession)
+                if reference:
+                    self._write_compact_record(record, reference)
+            else:
+                # Now we have the file, so we can parse it.
+                record = self.parse_record(filename, reference)
 
         if reference:
             record.id = reference.accession
@@ -720,6 +1072,11 @@ class GenBankRetriever(Retriever):
                 'Protein reference sequences are not supported.')
             return None
 
+        if reference and record_cache.set(reference.accession,
+                                          reference.checksum, record):
+            # The cached record must not be modified by the caller.
+            record = copy.deepcopy(record)
+
         return record
 
 
@@ -736,22 +1093,35 @@ class LRGRetriever(Retriever):
         Retriever.__init__(self, output)
         self.file_type = 'xml'
 
-    def loadrecord(self, identifier):
+    def retrieverecord(self, identifier):
         """
-        Load and parse a LRG file based on the identifier.
+        Make sure the LRG file for the identifier is in the cache.
 
-        :arg unicode identifier: The name of the LRG file to read.
+        :arg unicode identifier: The name of the LRG file.
 
-        :returns: GenRecord.Record of LRG file or None in case of failure.
-        :rtype: object
+        :returns: The full path to the file, or `None` in case of failure.
+        :rtype: unicode
         """
         # Make a filename based upon the identifier.
         filename = self._name_to_file(identifier)
 
-        if not os.path.isfile(filename):
+        if not file_cache.lookup(filename):
             # We can't find the file.
             filename = self.fetch(identifier)
 
+        return filename
+
+    def loadrecord(self, identifier):
+        """
+        Load and parse a LRG file based on the identifier.
+
+        :arg unicode identifier: The name of the LRG file to read.
+
+        :returns: GenRecord.Record of LRG file or None in case of failure.
+        :rtype: object
+        """
+        filename = self.retrieverecord(identifier)
+
         if filename is None:
             # Notify batch to skip all instance of identifier.
             self._output.addOutput('BatchFlags', ('S1', identifier))
@@ -759,7 +1129,7 @@ class LRGRetriever(Retriever):
             return None
 
         # Now we have the file, so we can parse it.
-        file_handle = bz2.BZ2File(filename, 'r')
+        file_handle = compression.open_file(filename)
 
         # Create GenRecord.Record from LRG file.
         record = lrg.create_record(file_handle.read())
@@ -784,11 +1154,18 @@ class LRGRetriever(Retriever):
         url = '{}/{}.xml'.format(settings.LRG_PREFIX_URL.rstrip('/'), name)
         filename = None
 
-        try:
-            filename = self.downloadrecord(url, name)
-        except urllib2.URLError:
-            self._output.addMessage(
-                __file__, 4, 'ERETR', 'Could not retrieve {}.'.format(name))
+        # Concurrent fetches of the same LRG wait for each other.
+        with self._lock(name):
+            if os.path.isfile(self._name_to_file(name)):
+                # Fetched by someone else while we were waiting.
+                return self._name_to_file(name)
+
+            try:
+                filename = self.downloadrecord(url, name)
+            except urllib2.URLError:
+                self._output.addMessage(
+                    __file__, 4, 'ERETR',
+                    'Could not retrieve {}.'.format(name))
 
         return filename
 
@@ -845,6 +1222,7 @@ class LRGRetriever(Retriever):
                     Reference.query.filter_by(accession=lrg_id).update(
                         {'checksum': md5sum})
                     session.commit()
+                    lookup_cache.invalidate_reference(lrg_id)
                 else:
                     # Hash the same as in db.
                     pass
@@ -17,18 +17,28 @@ Module used to add and manage the Batch Jobs.
 
 from __future__ import unicode_literals
 
-import io
-import os                               # os.path.exists
+import collections
+from contextlib import contextmanager
+import errno
+import fcntl
+import multiprocessing
+import os
+import signal
 import smtplib                          # smtplib.STMP
+import sys
 from email.mime.text import MIMEText    # MIMEText
 from sqlalchemy import func
 from sqlalchemy.orm.exc import NoResultFound
 
+from mutalyzer import assembly_cache
+from mutalyzer import batch_results
 from mutalyzer.config import settings
 from mutalyzer.db import queries, session
-from mutalyzer.db.models import Assembly, BatchJob, BatchQueueItem
+from mutalyzer.db.models import BatchJob, BatchQueueItem
 from mutalyzer import ncbi
+from mutalyzer import prefetch
 from mutalyzer import stats
+from mutalyzer import util
 from mutalyzer import variantchecker
 from mutalyzer.grammar import Grammar
 from mutalyzer.output import Output
@@ -39,6 +49,183 @@ from mutalyzer import website
 __all__ = ["Scheduler"]
 
 
+# Header of the result file for each batch job type.
+_RESULT_HEADERS = {
+    'name-checker': ['Input',
+                     'Errors and warnings',
+                     'AccNo',
+                     'Genesymbol',
+                     'Variant',
+                     'Reference Sequence Start Descr.',
+                     'Coding DNA Descr.',
+                     'Protein Descr.',
+                     'GeneSymbol Coding DNA Descr.',
+                     'GeneSymbol Protein Descr.',
+                     'Genomic Reference',
+                     'Coding Reference',
+                     'Protein Reference',
+                     'Affected Transcripts',
+                     'Affected Proteins',
+                     'Restriction Sites Created',
+                     'Restriction Sites Deleted'],
+    'syntax-checker': ['Input', 'Status'],
+    'position-converter': ['Input Variant',
+                           'Errors',
+                           'Chromosomal Variant',
+                           'Coding Variant(s)'],
+    'snp-converter': ['Input Variant',
+                      'HGVS description(s)',
+                      'Errors and warnings']}
+
+
+# The fields of a batch job needed to process its items. Unlike the database
+# model, this can be sent to a worker process.
+_BatchJobInfo = collections.namedtuple(
+    '_BatchJobInfo', ['id', 'job_type', 'argument', 'result_id'])
+
+
+class _InlineResult(object):
+    """
+    Result of a batch queue item processed in the current process, with the
+    same interface as the results from a worker pool: an exception raised by
+    the processing is raised by `get`.
+    """
+    def __init__(self, function, *args):
+        self._value = self._exc_info = None
+        try:
+            self._value = function(*args)
+        except Exception:
+            self._exc_info = sys.exc_info()
+
+    def get(self):
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._value
+
+
+@contextmanager
+def processor_lock():
+    """
+    Context manager holding an exclusive lock on processing batch jobs,
+    shared by all processes using the cache directory.
+
+    Claimed batch queue items are removed from the database and their
+    results are written to the job-file by the claiming process (see
+    {queries.claim_batch_queue_items}), so only one batch processor can run
+    at a time. The lock is implemented by `flock` on a file in the `locks`
+    subdirectory of the cache directory.
+
+    Yields True if the lock was acquired, or False if another process holds
+    the lock.
+    """
+    directory = os.path.join(settings.CACHE_DIR, 'locks')
+    try:
+        os.mkdir(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    with open(os.path.join(directory, 'batch-processor.lock'), 'a') as handle:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _group_by_reference(items):
+    """
+    Reorder batch queue items such that items on the same reference are
+    consecutive. The groups are ordered by their first item and the items
+    in a group keep their order.
+
+    @arg items: Items as tuples of id, input and flags.
+    @type items: list
+
+    @return: The reordered items.
+    @rtype: list
+    """
+    groups = collections.OrderedDict()
+    for item in items:
+        groups.setdefault(util.description_reference(item[1]),
+                          []).append(item)
+    return [item for group in groups.values() for item in group]
+
+
+def _next_group(job_type, items):
+    """
+    Take the next items to process together from the claimed items of a
+    batch job. For name checker jobs, these are the consecutive items on the
+    same reference (see {_group_by_reference}), such that the reference is
+    loaded only once. For other jobs, this is one item.
+
+    @arg job_type: Type of the batch job.
+    @type job_type: unicode
+    @arg items: Claimed items as tuples of id, input and flags. The taken
+        items are removed.
+    @type items: collections.deque
+
+    @return: The taken items.
+    @rtype: list
+    """
+    group = [items.popleft()]
+    if job_type == 'name-checker':
+        reference = util.description_reference(group[0][1])
+        while items and \
+                util.description_reference(items[0][1]) == reference:
+            group.append(items.popleft())
+    return group
+
+
+def _apply_flags(flags, items):
+    """
+    Set flags for batch queue items in memory, as done for the items in the
+    database by {Scheduler._updateDbFlags}: items matching the selector of a
+    skip flag get the flag, and items matching an alter flag are altered and
+    get the flag.
+
+    @arg flags: Flags and their arguments, as returned by
+        {Scheduler._batchFlags}.
+    @type flags: list
+    @arg items: Items as tuples of id, input and flags, changed in place.
+    @type items: list or collections.deque
+    """
+    for flag, args in flags:
+        for i, (item_id, item, item_flags) in enumerate(list(items)):
+            if 'S' in flag:
+                if item.startswith(args):
+                    items[i] = item_id, item, item_flags + flag
+            elif 'A' in flag:
+                old, new, nselector = args
+                if (item.startswith(old + ':') and
+                        not item.startswith(nselector) and
+                        'S2' not in item_flags):
+                    items[i] = (item_id, item.replace(old, new),
+                                item_flags + flag)
+
+
+def _initialize_worker():
+    """
+    Initialize a worker process. Shutdown is handled by the parent process,
+    which waits for the items in progress to finish.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+def _process_batch_items(batch_job, items):
+    """
+    Process batch queue items in a worker process.
+    """
+    return Scheduler()._processItems(batch_job, items)
+
+
 class Scheduler() :
     """
     Special methods:
@@ -55,14 +242,22 @@ class Scheduler() :
         - Batch Position Converter
     """
 
-    def __init__(self) :
+    def __init__(self, workers=1) :
         #TODO: documentation
         """
         Initialize the Scheduler, which requires a database connection.
 
+        @arg workers: Number of worker processes used by {process}. With one
+            worker, all items are processed in the current process.
+        @type workers: int
+
         @todo: documentation
         """
         self.__run = True
+        self.__workers = workers
+        # Records loaded for name checker items, shared by the items
+        # processed together. Only kept during a call to {_processItems}.
+        self._records = None
     #__init__
 
     def stop(self):
@@ -211,10 +406,11 @@ Mutalyzer batch scheduler""" % download_url)
         return False
     #__processFlags
 
-    def __alterBatchEntries(self, jobID, old, new, flag, nselector, O) :
+    def __alterBatchEntries(self, jobID, old, new, flag, nselector) :
         """
         Replace within one JobID all entries matching old with new, if they do
-        not match the negative selector.
+        not match the negative selector. This is done for the entries in the
+        database, see {_apply_flags} for the claimed entries in memory.
 
         This is used to alter batch entries that would otherwise take a long
         time to process. E.g. a batch job with a lot of the same accession
@@ -268,17 +464,18 @@ Mutalyzer batch scheduler""" % download_url)
                          'flags': BatchQueueItem.flags + flag},
                             synchronize_session=False)
         except Exception as ex:
-            message = ("An exception of type '%s' occurred in __alterBatchEntries() "
-                       "with the following arguments: %s. "
-                       "Other info: old=%s, new=%s, flag=%s, nselector=%s"
-                       % (type(ex).__name__, ex.args, old, new, flag, nselector))
-            O.addMessage(__file__, 4, "ABATCHE", message)
+            print ("An exception of type '%s' occurred in __alterBatchEntries() "
+                   "with the following arguments: %s. "
+                   "Other info: old=%s, new=%s, flag=%s, nselector=%s"
+                   % (type(ex).__name__, ex.args, old, new, flag, nselector))
+            session.rollback()
         session.commit()
     #__alterBatchEntries
 
     def __skipBatchEntries(self, jobID, flag, selector) :
         """
-        Skip all batch entries that match a certain selector.
+        Skip all batch entries that match a certain selector in the database,
+        see {_apply_flags} for the claimed entries in memory.
 
         We flag batch entries to be skipped. This is used if it is certain
         that an entry will cause an error, or that its output is ambiguous.
@@ -302,22 +499,23 @@ Mutalyzer batch scheduler""" % download_url)
         session.commit()
     #__skipBatchEntries
 
-    def _updateDbFlags(self, O, jobID) :
+    def _batchFlags(self, O) :
         """
-            Check and set the flags for other entries of jobID.
+            Get the flags to set for other entries of the current job.
 
             After each entry is ran, the Output object can contain BatchFlags.
             If these are set, this means that identical entries need to be
             skipped / altered.
 
             Side-effect:
-               -  Added flags to entries in the database
+               -  Added messages to the Output object.
 
             @arg O:     Output object of the current batchentry
             @type O:    object
-            @arg jobID: ID of job, so that the altering is only done within one
-            job
-            @type jobID:
+
+            @return: List of flags and their arguments to be applied by
+                {_updateDbFlags}.
+            @rtype: list
         """
 
         flags = O.getOutput("BatchFlags")
@@ -332,7 +530,7 @@ Mutalyzer batch scheduler""" % download_url)
         # Flags are set when an entry could be sped up. This is either the
         # case for the Retriever as for the Mutalyzer module
 
-        if not flags: return
+        if not flags: return []
         #First check if we need to skip
         for flag, args in flags :
             if 'S' in flag :
@@ -340,20 +538,48 @@ Mutalyzer batch scheduler""" % download_url)
                 O.addMessage(__file__, 2, "WBSKIP",
                         "All further occurrences with '%s' will be "
                         "skipped" % selector)
-                self.__skipBatchEntries(jobID, flag, selector)
-                return
+                return [(flag, args)]
             #if
         #for
         #If not skipflags, check if we need to alter
+        altered = []
         for flag, args in flags :
             if 'A' in flag :
                 old, new, nselector = args  #Strip arguments
                 O.addMessage(__file__, 2, "WBSUBST",
                         "All further occurrences of %s will be substituted "
                         "by %s" % (old, new))
-                self.__alterBatchEntries(jobID, old, new, flag, nselector, O)
+                altered.append((flag, args))
             #if
         #for
+        return altered
+    #_batchFlags
+
+    def _updateDbFlags(self, flags, jobID, items) :
+        """
+            Set the flags for other entries of jobID.
+
+            Side-effect:
+               -  Added flags to entries in the database and in memory
+
+            @arg flags: Flags and their arguments, as returned by
+                {_batchFlags}.
+            @type flags: list
+            @arg jobID: ID of job, so that the altering is only done within one
+            job
+            @type jobID:
+            @arg items: Claimed entries of the job, as tuples of id, input
+                and flags.
+            @type items: collections.deque
+        """
+        _apply_flags(flags, items)
+        for flag, args in flags :
+            if 'S' in flag :
+                self.__skipBatchEntries(jobID, flag, args)
+            elif 'A' in flag :
+                old, new, nselector = args
+                self.__alterBatchEntries(jobID, old, new, flag, nselector)
+        #for
     #_updateDbFlags
 
     def process(self):
@@ -364,8 +590,8 @@ Mutalyzer batch scheduler""" % download_url)
         last processing round and repeats. This continue until no jobs are
         left to process.
 
-        If during this process the {stop} method is called, the current
-        job item is completed and we return.
+        If during this process the {stop} method is called, the items in
+        progress are completed and we return.
 
         This method uses two database tables, BatchJob and BatchQueue.
 
@@ -376,9 +602,18 @@ Mutalyzer batch scheduler""" % download_url)
                             to send the build version.
 
         If the jobList is not empty, the method will iterate once over the
-        list and fetch the first entry of a job from the database table
-        BatchQueue. This request returns both the input for the batch and
-        the flags for the job.
+        list and take the next entry of each job. Entries are claimed from the
+        database table BatchQueue in chunks of {BATCH_CLAIM_SIZE} entries per
+        job, which are processed from memory. The jobList is only retrieved
+        again after a chunk was claimed or a job was finished. Claimed entries
+        that are not processed when we return are put back in the database.
+
+        For name checker jobs, the entries in a chunk are grouped by their
+        reference and each group is processed together, such that the
+        reference is loaded only once for each group (see {_processItems}).
+        Entries of other jobs are processed one by one. Results are still
+        written in input order. For SNP converter jobs, the dbSNP records for
+        the entries in a chunk are retrieved in bulk.
 
         #Flags
         A job can be flagged in three ways:
@@ -399,55 +634,393 @@ Mutalyzer batch scheduler""" % download_url)
 
         A Flag consists of either an A, S or C followed by a digit, which
         refers to the reason of alteration / skip.
+
+        With more than one worker, the entries are processed in a pool of
+        worker processes, each group of entries processed together in one
+        worker. Items are still claimed in the order described above and
+        their results are written in that same order, so the output of each
+        job follows its input, even if items finish out of order. At most
+        two groups per worker are in progress at any time. A group that was
+        already in progress when an earlier item of its job set flags that
+        apply to it, is processed again with these flags, so the output is
+        the same as with one worker.
+
+        #Results
+        The results of each job are written by a {batch_results.ResultWriter},
+        which buffers the result lines and records a checkpoint with the
+        claimed entries that have no result line in the job-file yet. If a
+        previous run crashed, the job-file is truncated to the checkpoint and
+        these entries are put back in the database before processing the job.
         """
-        while not self.stopped():
-            # Group batch jobs by email address and retrieve the oldest for
-            # each address. This improves fairness when certain users have
-            # many jobs.
-            batch_jobs = BatchJob.query.filter(BatchJob.id.in_(
-                session.query(func.min(BatchJob.id)).group_by(BatchJob.email))
-            ).all()
-
-            if len(batch_jobs) == 0:
-                break
-
-            for batch_job in batch_jobs:
-                if self.stopped():
-                    break
-
-                batch_queue_item = queries.pop_batch_queue_item(batch_job)
-
-                if batch_queue_item is not None:
-                    item, flags = batch_queue_item
-
-                    if batch_job.job_type == 'name-checker':
-                        self._processNameBatch(batch_job, item, flags)
-                    elif batch_job.job_type == 'syntax-checker':
-                        self._processSyntaxCheck(batch_job, item, flags)
-                    elif batch_job.job_type == 'position-converter':
-                        self._processConversion(batch_job, item, flags)
-                    elif batch_job.job_type == 'snp-converter':
-                        self._processSNP(batch_job, item, flags)
-                    else:
-                        # Unknown job type, should never happen.
-                        # Todo: Log some screaming message.
-                        pass
+        self._pool = self._createPool() if self.__workers > 1 else None
+        window = 2 * self.__workers if self._pool else 1
 
-                else:
-                    print ('Job %s finished, email %s file %s' %
-                           (batch_job.id, batch_job.email, batch_job.result_id))
-                    self.__sendMail(batch_job.email, batch_job.result_id)
-                    session.delete(batch_job)
-                    session.commit()
+        # Created after the worker pool, so its threads are not running while
+        # worker processes are forked.
+        if settings.BATCH_PREFETCH_THREADS:
+            self._prefetcher = prefetch.Prefetcher()
+        else:
+            self._prefetcher = None
+
+        # Groups of claimed items in claim order, as tuples of the batch job
+        # info, the items, their (future) results, and the number of flags
+        # of the job that were set when they were dispatched.
+        self._pending = collections.deque()
+
+        # Flags set for other items, by batch job id.
+        self._flags = collections.defaultdict(list)
+
+        # Claimed items that are not yet processed, by batch job id.
+        self._claimed = {}
+
+        # Ids of claimed items without a written result in input order, and
+        # the results of processed items that cannot be written yet, by
+        # batch job id.
+        self._order = collections.defaultdict(collections.deque)
+        self._completed = collections.defaultdict(dict)
+
+        # Result writers by batch job id.
+        self._writers = {}
+
+        batch_jobs = None
+
+        try:
+            while not self.stopped():
+                if batch_jobs is None:
+                    # Group batch jobs by email address and retrieve the
+                    # oldest for each address. This improves fairness when
+                    # certain users have many jobs.
+                    batch_jobs = BatchJob.query.filter(BatchJob.id.in_(
+                        session.query(func.min(BatchJob.id)).group_by(BatchJob.email))
+                    ).all()
+
+                    if len(batch_jobs) == 0:
+                        break
+
+                refresh = False
+                processed = False
+
+                for batch_job in batch_jobs:
+                    if self.stopped():
+                        break
+
+                    while len(self._pending) >= window:
+                        self._completeItems()
+
+                    info = _BatchJobInfo(batch_job.id, batch_job.job_type,
+                                         batch_job.argument,
+                                         batch_job.result_id)
+
+                    writer = self._writers.get(info.id)
+                    if writer is None:
+                        writer = self._openWriter(info)
+
+                    items = self._claimed.get(info.id)
+                    if not items:
+                        chunk = queries.claim_batch_queue_items(
+                            batch_job, settings.BATCH_CLAIM_SIZE,
+                            journal=writer.checkpoint)
+                        self._order[info.id].extend(
+                            item_id for item_id, _, _ in chunk)
+                        if info.job_type == 'name-checker':
+                            # Process items on the same reference together
+                            # (see {_next_group}).
+                            chunk = _group_by_reference(chunk)
+                        elif info.job_type == 'snp-converter':
+                            # Retrieve the dbSNP records in bulk.
+                            ncbi.cache_rsids([cmd for _, cmd, _ in chunk])
+                        items = collections.deque(chunk)
+                        self._claimed[info.id] = items
+                        refresh = refresh or bool(items)
+
+                    if items:
+                        self._pending.append(self._dispatch(
+                            info, _next_group(info.job_type, items)))
+                        processed = True
+
+                    elif not self._unwrittenItems(info.id):
+                        self._writers.pop(info.id).close(complete=True)
+                        del self._claimed[info.id]
+                        del self._order[info.id]
+                        del self._completed[info.id]
+                        self._flags.pop(info.id, None)
+                        print ('Job %s finished, email %s file %s' %
+                               (batch_job.id, batch_job.email, batch_job.result_id))
+                        self.__sendMail(batch_job.email, batch_job.result_id)
+                        session.delete(batch_job)
+                        session.commit()
+                        refresh = True
+
+                if refresh:
+                    batch_jobs = None
+
+                if not processed and self._pending:
+                    # Only items in progress are left for these jobs.
+                    self._completeItems()
+        finally:
+            while self._pending:
+                self._completeItems()
+            if self._pool:
+                self._pool.close()
+                self._pool.join()
+            if self._prefetcher:
+                self._prefetcher.stop()
+            for writer in self._writers.values():
+                writer.close()
+            for batch_job_id in self._writers:
+                queries.restore_batch_queue_items(
+                    batch_job_id, self._unwrittenItems(batch_job_id))
     #process
 
-    def _processNameBatch(self, batch_job, cmd, flags):
+    def _createPool(self):
         """
-        Process an entry from the Name Batch, write the results
-        to the job-file. If an Exception is raised, catch and continue.
+        Create a pool of worker processes.
 
-        Side-effect:
-            - Output written to outputfile.
+        @return: The worker pool.
+        @rtype: multiprocessing.Pool
+        """
+        # Worker processes must not share database connections with this
+        # process, so we make sure there are none when they are forked.
+        session.remove()
+        session.get_bind().dispose()
+        return multiprocessing.Pool(self.__workers,
+                                    initializer=_initialize_worker)
+    #_createPool
+
+    def _dispatch(self, batch_job, items):
+        """
+        Start processing a group of batch queue items, in the worker pool if
+        there is one.
+
+        @arg batch_job: The batch job of the items.
+        @type batch_job: _BatchJobInfo
+        @arg items: The items as tuples of id, input and flags.
+        @type items: list
+
+        @return: Entry for the items in progress (see {process}).
+        @rtype: tuple
+        """
+        if self._pool:
+            result = self._pool.apply_async(
+                _process_batch_items, (batch_job, items))
+        else:
+            result = _InlineResult(self._processItems, batch_job, items)
+        return batch_job, items, result, len(self._flags[batch_job.id])
+    #_dispatch
+
+    def _processItems(self, batch_job, items):
+        """
+        Process a group of batch queue items of a batch job in order. Flags
+        set by an item are applied to the items after it, the caller sets
+        them for the other items of the job (see {_updateDbFlags}). Name
+        checker items share the loaded records (see
+        {variantchecker.check_variant}).
+
+        @arg batch_job: The batch job of the items.
+        @type batch_job: _BatchJobInfo
+        @arg items: The items as tuples of id, input and flags.
+        @type items: list
+
+        @return: For each item, the item with the flags set by the items
+            before it, its result line (see {_processItem}) and the flags to
+            set for other items of the job.
+        @rtype: list(tuple)
+        """
+        items = collections.deque(items)
+        results = []
+
+        self._records = {}
+        try:
+            while items:
+                item = items.popleft()
+                try:
+                    line, flags = self._processItem(batch_job, item[1],
+                                                    item[2])
+                except Exception as ex:
+                    # Processing of the item failed unexpectedly, we write
+                    # an error line for it and continue with the other items.
+                    self._reportError(batch_job, item, ex)
+                    line, flags = self._errorLine(item[1], item[2]), []
+                _apply_flags(flags, items)
+                results.append((item, line, flags))
+        finally:
+            self._records = None
+
+        return results
+    #_processItems
+
+    def _processItem(self, batch_job, item, flags):
+        """
+        Process a batch queue item according to the batch job type.
+
+        @arg batch_job: The batch job of the item.
+        @type batch_job: _BatchJobInfo
+        @arg item: The batch queue item input.
+        @type item: unicode
+        @arg flags: Flags of the batch queue item.
+        @type flags: unicode
+
+        @return: Result line for the job-file, including the separator, or
+            None for an unknown job type, and the flags to set for other
+            items of the job (see {_batchFlags}).
+        @rtype: tuple(unicode, list)
+        """
+        if batch_job.job_type == 'name-checker':
+            return self._processNameBatch(batch_job, item, flags)
+        elif batch_job.job_type == 'syntax-checker':
+            return self._processSyntaxCheck(batch_job, item, flags), []
+        elif batch_job.job_type == 'position-converter':
+            return self._processConversion(batch_job, item, flags), []
+        elif batch_job.job_type == 'snp-converter':
+            return self._processSNP(batch_job, item, flags), []
+        # Unknown job type, should never happen.
+        # Todo: Log some screaming message.
+        return None, []
+    #_processItem
+
+    def _openWriter(self, batch_job):
+        """
+        Open the result writer for a batch job. If a previous run crashed,
+        the items without a result line are put back in the database. For
+        name checker jobs, the reference sequences are retrieved in the
+        background (see {prefetch.Prefetcher}).
+
+        @arg batch_job: The batch job.
+        @type batch_job: _BatchJobInfo
+
+        @return: The result writer.
+        @rtype: batch_results.ResultWriter
+        """
+        writer = batch_results.ResultWriter(
+            batch_job.result_id, _RESULT_HEADERS.get(batch_job.job_type, []),
+            unwritten=lambda: self._unwrittenItems(batch_job.id))
+        queries.restore_batch_queue_items(batch_job.id, writer.recover())
+        self._writers[batch_job.id] = writer
+
+        if self._prefetcher and batch_job.job_type == 'name-checker':
+            # Retrieve the reference sequences before we get to them.
+            self._prefetcher.add_job(
+                [item for item, in session.query(BatchQueueItem.item)
+                 .filter_by(batch_job_id=batch_job.id)])
+
+        return writer
+    #_openWriter
+
+    def _unwrittenItems(self, batch_job_id):
+        """
+        Get the claimed items of a batch job whose result is not yet written.
+        These are in progress, not yet processed, or processed but waiting
+        for the result of an item earlier in the input.
+
+        @arg batch_job_id: ID of the batch job.
+        @type batch_job_id: int
+
+        @return: Items as tuples of id, input and flags.
+        @rtype: list
+        """
+        items = [item for info, group, _, _ in self._pending
+                 if info.id == batch_job_id for item in group]
+        items.extend(item for item, _ in
+                     self._completed.get(batch_job_id, {}).values())
+        items.extend(self._claimed.get(batch_job_id, []))
+        return items
+    #_unwrittenItems
+
+    def _completeItems(self):
+        """
+        Wait for the oldest group of items in progress to be processed and
+        set the resulting flags for other items of its job. Result lines are
+        written to the job-file in input order, so the result of an item is
+        kept until all items before it are processed.
+
+        If flags that apply to the items were set after they were
+        dispatched, they are dispatched again with these flags instead.
+        """
+        batch_job, items, result, flag_count = self._pending.popleft()
+
+        flags = self._flags[batch_job.id][flag_count:]
+        if flags:
+            rewritten = list(items)
+            _apply_flags(flags, rewritten)
+            if rewritten != items:
+                self._pending.appendleft(
+                    self._dispatch(batch_job, rewritten))
+                return
+
+        try:
+            results = result.get()
+        except Exception as ex:
+            # Processing of the items failed unexpectedly, we write an error
+            # line for them and continue with the other items.
+            for item in items:
+                self._reportError(batch_job, item, ex)
+            results = [(item, self._errorLine(item[1], item[2]), [])
+                       for item in items]
+
+        order = self._order[batch_job.id]
+        completed = self._completed[batch_job.id]
+
+        for item, line, flags in results:
+            self._updateDbFlags(flags, batch_job.id,
+                                self._claimed.get(batch_job.id, []))
+            self._flags[batch_job.id].extend(flags)
+            completed[item[0]] = item, line
+
+        while order and order[0] in completed:
+            item, line = completed.pop(order.popleft())
+            if line is not None:
+                self._writers[batch_job.id].write(item, line)
+    #_completeItems
+
+    def _reportError(self, batch_job, item, ex):
+        """
+        Report an unexpected error during processing of a batch queue item.
+
+        @arg batch_job: The batch job of the item.
+        @type batch_job: _BatchJobInfo
+        @arg item: The item as tuple of id, input and flags.
+        @type item: tuple
+        @arg ex: The exception.
+        @type ex: Exception
+        """
+        print ("An exception of type '%s' occurred while processing "
+               "batch item %s of job %s with the following arguments: %s"
+               % (type(ex).__name__, item[1], batch_job.id, ex.args))
+        # The session transaction might have to be rolled back in order to
+        # continue using the session.
+        session.rollback()
+    #_reportError
+
+    def _errorLine(self, cmd, flags):
+        """
+        Result line for the job-file for an entry whose processing failed
+        unexpectedly.
+
+        @arg cmd: The batch queue item input
+        @type cmd: unicode
+        @arg flags: Flags of the batch queue item
+        @type flags: unicode
+
+        @return: Result line, including the separator.
+        @rtype: unicode
+        """
+        O = Output(__file__)
+        O.addMessage(__file__, 4, "EBATCHU",
+                     "Unexpected error occurred, dev-team notified")
+
+        if flags and 'C' in flags:
+            separator = '\t'
+        else:
+            separator = '\n'
+
+        return "%s\t%s%s" % (cmd, "|".join(O.getBatchMessages(2)), separator)
+    #_errorLine
+
+    def _processNameBatch(self, batch_job, cmd, flags):
+        """
+        Process an entry from the Name Batch and return the result line
+        for the job-file and the flags to set for other entries. If an
+        Exception is raised, catch and continue.
 
         @arg cmd: The NameChecker input
         @type cmd:
@@ -455,6 +1028,10 @@ Mutalyzer batch scheduler""" % download_url)
         @type i:
         @arg flags: Flags of the current entry
         @type flags:
+
+        @return: Result line, including the separator, and the flags to set
+            for other entries (see {_batchFlags}).
+        @rtype: tuple(unicode, list)
         """
         O = Output(__file__)
         O.addMessage(__file__, -1, "INFO",
@@ -464,11 +1041,15 @@ Mutalyzer batch scheduler""" % download_url)
 
         #Read out the flags
         skip = self.__processFlags(O, flags)
+        batch_flags = []
 
         if not skip :
             #Run mutalyzer and get values from Output Object 'O'
             try :
-                variantchecker.check_variant(cmd, O)
+                variantchecker.check_variant(
+                    cmd, O,
+                    outputs={variantchecker.OUTPUT_RESTRICTION_SITES},
+                    records=self._records)
             except Exception:
                 #Catch all exceptions related to the processing of cmd
                 O.addMessage(__file__, 4, "EBATCHU",
@@ -486,8 +1067,8 @@ Mutalyzer batch scheduler""" % download_url)
                 session.rollback()
             #except
             finally :
-                #check if we need to update the database
-                self._updateDbFlags(O, batch_job.id)
+                #check if we need to update the other entries
+                batch_flags = self._batchFlags(O)
         #if
 
         batchOutput = O.getOutput("batchDone")
@@ -498,53 +1079,20 @@ Mutalyzer batch scheduler""" % download_url)
         if batchOutput :
             outputline += batchOutput[0]
 
-        #Output
-        filename = "%s/batch-job-%s.txt" % (settings.CACHE_DIR, batch_job.result_id)
-        if not os.path.exists(filename) :
-            # If the file does not yet exist, create it with the correct
-            # header above it. The header is read from the config file as
-            # a list. We need a tab delimited string.
-            header = ['Input',
-                      'Errors and warnings',
-                      'AccNo',
-                      'Genesymbol',
-                      'Variant',
-                      'Reference Sequence Start Descr.',
-                      'Coding DNA Descr.',
-                      'Protein Descr.',
-                      'GeneSymbol Coding DNA Descr.',
-                      'GeneSymbol Protein Descr.',
-                      'Genomic Reference',
-                      'Coding Reference',
-                      'Protein Reference',
-                      'Affected Transcripts',
-                      'Affected Proteins',
-                      'Restriction Sites Created',
-                      'Restriction Sites Deleted']
-            handle = io.open(filename, mode='a', encoding='utf-8')
-            handle.write("%s\n" % "\t".join(header))
-        #if
-        else :
-            handle = io.open(filename, mode='a', encoding='utf-8')
-
         if flags and 'C' in flags:
             separator = '\t'
         else:
             separator = '\n'
 
-        handle.write("%s%s" % (outputline, separator))
-        handle.close()
         O.addMessage(__file__, -1, "INFO",
             "Finished NameChecker batchvariant " + cmd)
+        return "%s%s" % (outputline, separator), batch_flags
     #_processNameBatch
 
     def _processSyntaxCheck(self, batch_job, cmd, flags):
         """
-        Process an entry from the Syntax Check, write the results
-        to the job-file.
-
-        Side-effect:
-            - Output written to outputfile
+        Process an entry from the Syntax Check and return the result line
+        for the job-file.
 
         @arg cmd:   The Syntax Checker input
         @type cmd:
@@ -552,6 +1100,9 @@ Mutalyzer batch scheduler""" % download_url)
         @type i:
         @arg flags: Flags of the current entry
         @type flags:
+
+        @return: Result line, including the separator.
+        @rtype: unicode
         """
         output = Output(__file__)
         grammar = Grammar(output)
@@ -573,39 +1124,22 @@ Mutalyzer batch scheduler""" % download_url)
         else :
             result = "|".join(output.getBatchMessages(2))
 
-        #Output
-        filename = "%s/batch-job-%s.txt" % (settings.CACHE_DIR, batch_job.result_id)
-        if not os.path.exists(filename) :
-            # If the file does not yet exist, create it with the correct
-            # header above it. The header is read from the config file as
-            # a list. We need a tab delimited string.
-            header = ['Input', 'Status']
-            handle = io.open(filename, mode='a', encoding='utf-8')
-            handle.write("%s\n" % "\t".join(header))
-        #if
-        else :
-            handle = io.open(filename, mode='a', encoding='utf-8')
-
         if flags and 'C' in flags:
             separator = '\t'
         else:
             separator = '\n'
 
-        handle.write("%s\t%s%s" % (cmd, result, separator))
-        handle.close()
         output.addMessage(__file__, -1, "INFO",
                           "Finished SyntaxChecker batchvariant " + cmd)
+        return "%s\t%s%s" % (cmd, result, separator)
     #_processSyntaxCheck
 
     def _processConversion(self, batch_job, cmd, flags):
         """
-        Process an entry from the Position Converter, write the results
-        to the job-file. The Position Converter is wrapped in a try except
-        block which ensures that he Batch Process keeps running. Errors
-        are caught and the user will be notified.
-
-        Side-effect:
-            - Output written to outputfile.
+        Process an entry from the Position Converter and return the result
+        line for the job-file. The Position Converter is wrapped in a try
+        except block which ensures that he Batch Process keeps running.
+        Errors are caught and the user will be notified.
 
         @arg cmd: The Syntax Checker input
         @type cmd: unicode
@@ -615,6 +1149,9 @@ Mutalyzer batch scheduler""" % download_url)
         @type build: unicode
         @arg flags: Flags of the current entry
         @type flags:
+
+        @return: Result line, including the separator.
+        @rtype: unicode
         """
         O = Output(__file__)
         variant = cmd
@@ -632,7 +1169,7 @@ Mutalyzer batch scheduler""" % download_url)
             try :
                 #process
                 try:
-                    assembly = Assembly.by_name_or_alias(batch_job.argument)
+                    assembly = assembly_cache.get_assembly(batch_job.argument)
                 except NoResultFound:
                     O.addMessage(__file__, 3, 'ENOASSEMBLY',
                                  'Not a valid assembly: ' + batch_job.argument)
@@ -682,41 +1219,22 @@ Mutalyzer batch scheduler""" % download_url)
 
         error = "%s" % "|".join(O.getBatchMessages(2))
 
-        #Output
-        filename = "%s/batch-job-%s.txt" % (settings.CACHE_DIR, batch_job.result_id)
-        if not os.path.exists(filename) :
-            # If the file does not yet exist, create it with the correct
-            # header above it. The header is read from the config file as
-            # a list. We need a tab delimited string.
-            header = ['Input Variant',
-                      'Errors',
-                      'Chromosomal Variant',
-                      'Coding Variant(s)']
-            handle = io.open(filename, mode='a', encoding='utf-8')
-            handle.write("%s\n" % "\t".join(header))
-        #if
-        else :
-            handle = io.open(filename, mode='a', encoding='utf-8')
-
         if flags and 'C' in flags:
             separator = '\t'
         else:
             separator = '\n'
 
-        handle.write("%s\t%s\t%s\t%s%s" % (cmd, error, gName, "\t".join(cNames), separator))
-        handle.close()
         O.addMessage(__file__, -1, "INFO",
-            "Finisehd PositionConverter batchvariant " + cmd)
+            "Finished PositionConverter batchvariant " + cmd)
+        return "%s\t%s\t%s\t%s%s" % (cmd, error, gName, "\t".join(cNames),
+                                    separator)
     #_processConversion
 
 
     def _processSNP(self, batch_job, cmd, flags):
         """
-        Process an entry from the SNP converter Batch, write the results
-        to the job-file. If an Exception is raised, catch and continue.
-
-        Side-effect:
-            - Output written to outputfile.
+        Process an entry from the SNP converter Batch and return the result
+        line for the job-file. If an Exception is raised, catch and continue.
 
         @arg cmd: The SNP converter input
         @type cmd:
@@ -724,6 +1242,9 @@ Mutalyzer batch scheduler""" % download_url)
         @type i:
         @arg flags: Flags of the current entry
         @type flags:
+
+        @return: Result line, including the separator.
+        @rtype: unicode
         """
         O = Output(__file__)
         O.addMessage(__file__, -1, "INFO",
@@ -744,30 +1265,14 @@ Mutalyzer batch scheduler""" % download_url)
         outputline += "%s\t" % "|".join(descriptions)
         outputline += "%s\t" % "|".join(O.getBatchMessages(2))
 
-        #Output
-        filename = "%s/batch-job-%s.txt" % (settings.CACHE_DIR, batch_job.result_id)
-        if not os.path.exists(filename) :
-            # If the file does not yet exist, create it with the correct
-            # header above it. The header is read from the config file as
-            # a list. We need a tab delimited string.
-            header = ['Input Variant',
-                      'HGVS description(s)',
-                      'Errors and warnings']
-            handle = io.open(filename, mode='a', encoding='utf-8')
-            handle.write("%s\n" % "\t".join(header))
-        #if
-        else :
-            handle = io.open(filename, mode='a', encoding='utf-8')
-
         if flags and 'C' in flags:
             separator = '\t'
         else:
             separator = '\n'
 
-        handle.write("%s%s" % (outputline, separator))
-        handle.close()
         O.addMessage(__file__, -1, "INFO",
                      "Finished SNP converter batch rs%s" % cmd)
+        return "%s%s" % (outputline, separator)
     #_processSNP
 
     def addJob(self, email, queue, columns, job_type, argument=None):
@@ -819,6 +1324,7 @@ Mutalyzer batch scheduler""" % download_url)
             session.add(item)
 
         session.commit()
+
         return batch_job.result_id
     #addJob
 #Scheduler
@@ -0,0 +1,223 @@
+"""
+In-process cache of genome assemblies and their chromosomes.
+
+Most webservice methods and website views start by looking up an assembly by
+name or alias, followed by one of its chromosomes by name or accession
+number. These tables only change when an administrator adds an assembly
+(`mutalyzer-admin assemblies add`), so we keep a copy of them in memory.
+
+Cached rows are kept as detached instances and merged into the current
+session on lookup (without loading them from the database), so callers get
+ordinary :class:`db.models.Assembly` and :class:`db.models.Chromosome`
+objects attached to their session.
+
+Lookups that miss the cache reload the relevant rows from the database, so
+new assemblies and chromosomes are found without invalidation. Changes to
+existing rows should be followed by a call to :func:`invalidate`. This drops
+the cache in the current process and increments a version number in Redis,
+such that other processes drop their caches too. Other processes check this
+version number at most every `ASSEMBLY_CACHE_CHECK_INTERVAL` seconds.
+"""
+
+
+from __future__ import unicode_literals
+
+import threading
+import time
+
+from sqlalchemy.orm import attributes, make_transient_to_detached
+from sqlalchemy.orm.exc import NoResultFound
+
+from mutalyzer.config import settings
+from mutalyzer.db import session
+from mutalyzer.db.models import Assembly, Chromosome
+from mutalyzer.redisclient import client as redis
+
+
+# Redis key for the version number of the assemblies.
+VERSION_KEY = 'assemblies:version'
+
+_ASSEMBLY_COLUMNS = ('id', 'name', 'alias', 'taxonomy_id',
+                     'taxonomy_common_name')
+_CHROMOSOME_COLUMNS = ('id', 'assembly_id', 'name', 'accession', 'organelle')
+
+
+def _detached(cls, columns, values):
+    # Detached instance with the given column values, as if it was loaded
+    # in a session that is now closed.
+    instance = cls.__mapper__.class_manager.new_instance()
+    for column, value in zip(columns, values):
+        setattr(instance, column, value)
+    make_transient_to_detached(instance)
+    return instance
+
+
+class _Cache(object):
+    def __init__(self, version):
+        self.version = version
+        self.checked = time.time()
+
+        # Assemblies by name and by alias.
+        self.assemblies = {}
+
+        # Per assembly id, chromosomes by name and by accession number.
+        self.chromosomes = {}
+
+    def load_assemblies(self):
+        query = session.query(*[getattr(Assembly, column)
+                                for column in _ASSEMBLY_COLUMNS])
+        assemblies = {}
+        for values in query:
+            assembly = _detached(Assembly, _ASSEMBLY_COLUMNS, values)
+            assemblies[assembly.name] = assembly
+            if assembly.alias:
+                assemblies.setdefault(assembly.alias, assembly)
+        self.assemblies = assemblies
+
+    def load_chromosomes(self, assembly):
+        cached_assembly = self.assemblies.get(assembly.name)
+        if cached_assembly is None or cached_assembly.id != assembly.id:
+            self.load_assemblies()
+            cached_assembly = self.assemblies.get(assembly.name)
+            if cached_assembly is None or cached_assembly.id != assembly.id:
+                # Not in the database (yet), we cannot cache it.
+                return None
+
+        query = session.query(*[getattr(Chromosome, column)
+                                for column in _CHROMOSOME_COLUMNS]) \
+            .filter_by(assembly_id=assembly.id)
+        by_name, by_accession = {}, {}
+        for values in query:
+            chromosome = _detached(Chromosome, _CHROMOSOME_COLUMNS, values)
+            attributes.set_committed_value(chromosome, 'assembly',
+                                           cached_assembly)
+            by_name[chromosome.name] = chromosome
+            by_accession[chromosome.accession] = chromosome
+        self.chromosomes[assembly.id] = by_name, by_accession
+        return self.chromosomes[assembly.id]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _version():
+    return int(redis.get(VERSION_KEY) or 0)
+
+
+def _get_cache():
+    # Called with the lock held.
+    global _cache
+
+    if (_cache is not None and time.time() - _cache.checked >=
+            settings.ASSEMBLY_CACHE_CHECK_INTERVAL):
+        if _version() == _cache.version:
+            _cache.checked = time.time()
+        else:
+            _cache = None
+
+    if _cache is None:
+        _cache = _Cache(_version())
+
+    return _cache
+
+
+def get_assembly(name_or_alias):
+    """
+    Get an assembly by name or alias.
+
+    This is a cached version of :meth:`db.models.Assembly.by_name_or_alias`.
+
+    :arg unicode name_or_alias: Assembly name or alias.
+
+    :returns: The assembly.
+    :rtype: db.models.Assembly
+
+    :raises sqlalchemy.orm.exc.NoResultFound: If the assembly does not
+      exist.
+    """
+    with _cache_lock:
+        cache = _get_cache()
+        assembly = cache.assemblies.get(name_or_alias)
+        if assembly is None:
+            cache.load_assemblies()
+            assembly = cache.assemblies.get(name_or_alias)
+
+    if assembly is None:
+        raise NoResultFound('No assembly found: %s' % name_or_alias)
+    return session.merge(assembly, load=False)
+
+
+def _get_chromosome(assembly, index, key):
+    with _cache_lock:
+        cache = _get_cache()
+        chromosomes = cache.chromosomes.get(assembly.id)
+        if chromosomes is None or key not in chromosomes[index]:
+            chromosomes = cache.load_chromosomes(assembly)
+
+    if chromosomes is None:
+        # Uncached assembly.
+        if index == 0:
+            return assembly.chromosomes.filter_by(name=key).one()
+        return assembly.chromosomes.filter_by(accession=key).one()
+
+    try:
+        chromosome = chromosomes[index][key]
+    except KeyError:
+        raise NoResultFound('No chromosome found: %s' % key)
+    return session.merge(chromosome, load=False)
+
+
+def get_chromosome(assembly, name):
+    """
+    Get a chromosome in an assembly by name.
+
+    :arg db.models.Assembly assembly: The assembly.
+    :arg unicode name: Chromosome name (e.g., ``chr1``).
+
+    :returns: The chromosome.
+    :rtype: db.models.Chromosome
+
+    :raises sqlalchemy.orm.exc.NoResultFound: If the chromosome does not
+      exist.
+    """
+    return _get_chromosome(assembly, 0, name)
+
+
+def get_chromosome_by_accession(assembly, accession):
+    """
+    Get a chromosome in an assembly by accession number.
+
+    :arg db.models.Assembly assembly: The assembly.
+    :arg unicode accession: Chromosome accession number including version
+      (e.g., ``NC_000001.10``).
+
+    :returns: The chromosome.
+    :rtype: db.models.Chromosome
+
+    :raises sqlalchemy.orm.exc.NoResultFound: If the chromosome does not
+      exist.
+    """
+    return _get_chromosome(assembly, 1, accession)
+
+
+def invalidate():
+    """
+    Drop the cache, in this process and (with some delay) in all other
+    processes. Call this after changing assemblies or chromosomes.
+    """
+    clear_cache()
+    redis.incr(VERSION_KEY)
+
+
+def clear_cache(*args):
+    """
+    Drop the cache in this process.
+    """
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+
+# The cache was loaded from the previously configured database.
+settings.on_update(clear_cache, 'DATABASE_URI')
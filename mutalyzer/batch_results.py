@@ -0,0 +1,225 @@
+"""
+Result files of batch jobs.
+
+The batch processor writes the result lines of a batch job through a
+:class:`ResultWriter`, which keeps the result file open for the life of the
+job and writes the lines in buffered blocks. A block is written when the
+buffer exceeds `BATCH_RESULT_BUFFER_SIZE` bytes, when the oldest buffered
+line is older than `BATCH_RESULT_FLUSH_INTERVAL` seconds, and when the writer
+is closed.
+
+After each block, a checkpoint is written next to the result file. It
+contains the size of the result file and all batch queue items that were
+claimed from the database but whose result lines are not yet in the file.
+If the batch processor crashes, the next run truncates the result file to
+the checkpointed size and puts the checkpointed items back in the queue, so
+the result file contains every line exactly once.
+
+If `BATCH_RESULT_GZIP` is set, result files are gzip compressed. Every block
+is written as a separate gzip member, which means the file can be truncated
+at each checkpoint and can still be read as one gzip stream.
+"""
+
+
+from __future__ import unicode_literals
+
+import gzip
+import io
+import json
+import os
+import time
+import zlib
+
+from mutalyzer.config import settings
+
+
+def _path(result_id, compressed):
+    return os.path.join(settings.CACHE_DIR, 'batch-job-%s.txt%s' % (
+        result_id, '.gz' if compressed else ''))
+
+
+def result_path(result_id):
+    """
+    Get the path to the result file of a batch job.
+
+    :arg unicode result_id: Result identifier of the batch job.
+
+    :returns: Path to the (possibly compressed) result file, or `None` if
+      there is no result file.
+    :rtype: unicode
+    """
+    for compressed in False, True:
+        path = _path(result_id, compressed)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def open_result(result_id):
+    """
+    Open the result file of a batch job for reading.
+
+    :arg unicode result_id: Result identifier of the batch job.
+
+    :raises IOError: If there is no result file.
+
+    :returns: Binary file-like object with the uncompressed result file.
+    """
+    path = result_path(result_id)
+    if path is None:
+        raise IOError('No result file for batch job: %s' % result_id)
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _read_checkpoint(checkpoint_path):
+    try:
+        with io.open(checkpoint_path, encoding='utf-8') as handle:
+            return json.load(handle)
+    except (EnvironmentError, ValueError):
+        return None
+
+
+def unwritten_items(result_id):
+    """
+    Get the claimed batch queue items of a batch job whose result lines are
+    not yet in the result file, according to the last checkpoint.
+
+    :arg unicode result_id: Result identifier of the batch job.
+
+    :returns: Items as tuples `id`, `item`, `flags`.
+    :rtype: list
+    """
+    path = result_path(result_id)
+    if path is None:
+        return []
+    checkpoint = _read_checkpoint(path + '.checkpoint')
+    if checkpoint is None:
+        return []
+    return [tuple(item) for item in checkpoint['items']]
+
+
+class ResultWriter(object):
+    """
+    Buffered writer for the result file of a batch job, with checkpoints for
+    crash recovery.
+    """
+    def __init__(self, result_id, header, unwritten=None):
+        """
+        :arg unicode result_id: Result identifier of the batch job.
+        :arg list header: Column names, written as the first line of a new
+          result file.
+        :arg unwritten: Function returning the claimed batch queue items that
+          are not yet passed to :meth:`write` (in progress or waiting), as
+          tuples `id`, `item`, `flags`. These are stored in the checkpoint.
+        :type unwritten: callable
+        """
+        existing = result_path(result_id)
+        if existing is not None:
+            self.compressed = existing.endswith('.gz')
+        else:
+            self.compressed = settings.BATCH_RESULT_GZIP
+
+        self.path = _path(result_id, self.compressed)
+        self.checkpoint_path = self.path + '.checkpoint'
+
+        self._header = header
+        self._unwritten = unwritten or (lambda: [])
+        self._buffer = []
+        self._buffer_size = 0
+        self._buffer_time = None
+
+        self._handle = io.open(self.path, 'ab')
+
+    def recover(self):
+        """
+        Recover from a crashed run using the checkpoint, if any. The result
+        file is truncated to the checkpointed size, dropping lines written
+        after the checkpoint.
+
+        Call this before writing anything.
+
+        :returns: Claimed batch queue items whose result lines are not in the
+          result file, as tuples `id`, `item`, `flags`.
+        :rtype: list
+        """
+        checkpoint = _read_checkpoint(self.checkpoint_path)
+        if checkpoint is None:
+            return []
+
+        if checkpoint['size'] < self._handle.tell():
+            self._handle.truncate(checkpoint['size'])
+            self._handle.seek(0, os.SEEK_END)
+
+        return [tuple(item) for item in checkpoint['items']]
+
+    def write(self, item, line):
+        """
+        Write the result line of a batch queue item.
+
+        :arg tuple item: The batch queue item as tuple `id`, `item`, `flags`.
+        :arg unicode line: The result line, including the separator.
+        """
+        if self._buffer_time is None:
+            self._buffer_time = time.time()
+        self._buffer.append((item, line))
+        self._buffer_size += len(line)
+
+        if (self._buffer_size >= settings.BATCH_RESULT_BUFFER_SIZE or
+                time.time() - self._buffer_time >=
+                settings.BATCH_RESULT_FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered lines to the result file and write a checkpoint.
+        """
+        if self._buffer:
+            lines = [line for _, line in self._buffer]
+            if not self._handle.tell():
+                lines.insert(0, '%s\n' % '\t'.join(self._header))
+            data = ''.join(lines).encode('utf-8')
+            if self.compressed:
+                compressor = zlib.compressobj(
+                    zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                    16 + zlib.MAX_WBITS)
+                data = compressor.compress(data) + compressor.flush()
+            self._handle.write(data)
+            self._handle.flush()
+            os.fsync(self._handle.fileno())
+
+        self._buffer = []
+        self._buffer_size = 0
+        self._buffer_time = None
+        self.checkpoint()
+
+    def checkpoint(self, claimed=None):
+        """
+        Write a checkpoint with the current size of the result file and the
+        claimed items whose result lines are not yet in the result file.
+
+        :arg list claimed: Newly claimed batch queue items to include in the
+          checkpoint, as tuples `id`, `item`, `flags`.
+        """
+        items = [item for item, _ in self._buffer]
+        items.extend(self._unwritten())
+        items.extend(claimed or [])
+
+        temporary_path = '%s.%d.tmp' % (self.checkpoint_path, os.getpid())
+        with io.open(temporary_path, 'w', encoding='utf-8') as handle:
+            handle.write(unicode(json.dumps({'size': self._handle.tell(),
+                                             'items': sorted(items)})))
+        os.rename(temporary_path, self.checkpoint_path)
+
+    def close(self, complete=False):
+        """
+        Flush and close the result file.
+
+        :arg bool complete: Whether the batch job is complete, in which case
+          the checkpoint is removed.
+        """
+        self.flush()
+        self._handle.close()
+        if complete:
+            os.unlink(self.checkpoint_path)
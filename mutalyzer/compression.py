@@ -0,0 +1,231 @@
+"""
+Compression of the reference files in the cache.
+
+Reference files are compressed with the codec set by `CACHE_CODEC`:
+
+- ``bz2``: Best compression, but slow to decompress.
+- ``gzip``: Fast compression level of gzip.
+- ``zstd``: Zstandard, fast to decompress. Requires the `zstandard` package.
+- ``none``: No compression, for caches on fast local storage.
+
+The codec of a file is detected from its first bytes, so changing
+`CACHE_CODEC` only affects new files and caches with mixed codecs keep
+working. Existing files can be converted with :func:`transcode`. File names
+are not changed by the codec (reference files keep their ``.bz2`` extension).
+"""
+
+
+from __future__ import unicode_literals
+
+import bz2
+import gzip
+import io
+import os
+import zlib
+
+from mutalyzer.config import settings
+
+
+# The zstandard package is implemented as a C extension, so we use it as an
+# optional dependency.
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+#: Compression level for the gzip codec.
+GZIP_LEVEL = 1
+
+#: Compression level for the zstd codec.
+ZSTD_LEVEL = 3
+
+
+class Codec(object):
+    """
+    A codec for reference files in the cache.
+    """
+    #: Name of the codec as used in the `CACHE_CODEC` setting.
+    name = None
+
+    #: The bytes every file compressed with this codec starts with.
+    magic = None
+
+    def compress(self, data):
+        """
+        Compress data.
+
+        :arg str data: The data to compress.
+
+        :returns: The compressed data.
+        :rtype: str
+        """
+        raise NotImplementedError()
+
+    def open(self, filename):
+        """
+        Open a compressed file for reading.
+
+        :arg unicode filename: The full path to the file.
+
+        :returns: Readable handle to the decompressed data.
+        :rtype: file
+        """
+        raise NotImplementedError()
+
+
+class Bz2Codec(Codec):
+    name = 'bz2'
+    magic = b'BZh'
+
+    def compress(self, data):
+        return bz2.compress(data)
+
+    def open(self, filename):
+        return bz2.BZ2File(filename, 'r')
+
+
+class GzipCodec(Codec):
+    name = 'gzip'
+    magic = b'\x1f\x8b'
+
+    def compress(self, data):
+        # Window size with 16 added writes a gzip header and trailer.
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED,
+                                      16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    def open(self, filename):
+        return gzip.GzipFile(filename, 'rb')
+
+
+class ZstdCodec(Codec):
+    name = 'zstd'
+    magic = b'\x28\xb5\x2f\xfd'
+
+    def compress(self, data):
+        if zstandard is None:
+            raise ValueError('The zstd codec requires the zstandard package')
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+    def open(self, filename):
+        if zstandard is None:
+            raise ValueError('The zstd codec requires the zstandard package')
+        # Our files include the content size, so they can be decompressed
+        # in one go, which is fast enough for the size of reference files.
+        with open(filename, 'rb') as handle:
+            return io.BytesIO(
+                zstandard.ZstdDecompressor().decompress(handle.read()))
+
+
+class NoneCodec(Codec):
+    name = 'none'
+    magic = b''
+
+    def compress(self, data):
+        return data
+
+    def open(self, filename):
+        return open(filename, 'rb')
+
+
+#: Available codecs by name.
+CODECS = {codec.name: codec for codec in
+          (Bz2Codec(), GzipCodec(), ZstdCodec(), NoneCodec())}
+
+
+def get_codec(name=None):
+    """
+    Get a codec by name.
+
+    :arg unicode name: Name of the codec. If `None`, the `CACHE_CODEC`
+      setting is used.
+
+    :raises ValueError: If the codec does not exist.
+
+    :returns: The codec.
+    :rtype: Codec
+    """
+    name = name or settings.CACHE_CODEC
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError('Unknown cache codec: %s' % name)
+
+
+def detect_codec(filename):
+    """
+    Detect the codec of a file.
+
+    Files that do not start with the magic bytes of any codec are assumed to
+    be uncompressed.
+
+    :arg unicode filename: The full path to the file.
+
+    :returns: The codec of the file.
+    :rtype: Codec
+    """
+    with open(filename, 'rb') as handle:
+        start = handle.read(4)
+
+    for codec in CODECS.values():
+        if codec.magic and start.startswith(codec.magic):
+            return codec
+    return CODECS['none']
+
+
+def compress(data):
+    """
+    Compress data with the codec set by `CACHE_CODEC`.
+
+    :arg str data: The data to compress.
+
+    :returns: The compressed data.
+    :rtype: str
+    """
+    return get_codec().compress(data)
+
+
+def open_file(filename):
+    """
+    Open a file in the cache for reading, whatever its codec.
+
+    :arg unicode filename: The full path to the file.
+
+    :returns: Readable handle to the decompressed data.
+    :rtype: file
+    """
+    return detect_codec(filename).open(filename)
+
+
+def transcode(filename, codec=None):
+    """
+    Compress a file in the cache with another codec, in place.
+
+    The file is written to a temporary file first and then renamed, so
+    readers never see a partially written file.
+
+    :arg unicode filename: The full path to the file.
+    :arg unicode codec: Name of the codec. If `None`, the `CACHE_CODEC`
+      setting is used.
+
+    :returns: `True` if the file was transcoded, `False` if it already used
+      the codec.
+    :rtype: bool
+    """
+    codec = get_codec(codec)
+    current = detect_codec(filename)
+    if current is codec:
+        return False
+
+    handle = current.open(filename)
+    try:
+        data = codec.compress(handle.read())
+    finally:
+        handle.close()
+
+    temporary_filename = '%s.%d.tmp' % (filename, os.getpid())
+    with open(temporary_filename, 'wb') as handle:
+        handle.write(data)
+    os.rename(temporary_filename, filename)
+    return True
@@ -25,12 +25,39 @@ BATCH_NOTIFICATION_EMAIL = None
 # reference files from NCBI or user) and batch job results.
 CACHE_DIR = '/tmp'
 
+# Maximum total size of the reference files in the cache directory (in
+# bytes). Least recently used files are removed if it is exceeded, except for
+# uploaded references. If `None`, the size is not limited.
+FILE_CACHE_SIZE = None
+
+# Compression codec for new reference files in the cache directory: 'bz2',
+# 'gzip' (fast level), 'zstd' (requires the zstandard package) or 'none'.
+# Existing files keep their codec.
+CACHE_CODEC = 'bz2'
+
+# Maximum number of parsed reference records kept in memory per process. Set
+# to `0` to disable the in-process record cache.
+RECORD_CACHE_SIZE = 200
+
+# Maximum total sequence length of the parsed reference records kept in
+# memory per process (in bases).
+RECORD_CACHE_MAX_BASES = 200 * 1000 * 1000 # 200 Mbp
+
 # Maximum size for uploaded and downloaded files (in bytes).
 MAX_FILE_SIZE = 10 * 1048576 # 10 MB
 
 # Maximum sequence length for description extractor (in bases).
 EXTRACTOR_MAX_INPUT_LENGTH = 50 * 1000 # 50 Kbp
 
+# Maximum number of variant descriptions in one call to the bulk name checker
+# webservice.
+BULK_CHECK_MAX_VARIANTS = 1000
+
+# Descriptions not checked after this many seconds in a call to the bulk name
+# checker webservice are skipped. This is checked before each description, so
+# a call can take longer by the time it takes to check one description.
+BULK_CHECK_TIME_BUDGET = 60
+
 # The WSGI application runs behind a reverse proxy (e.g., nginx using
 # proxy_pass). This needs to be set if the application is mapped to a URL
 # other than / or a different HTTP scheme is used by the reverse proxy.
@@ -64,16 +91,66 @@ OUTPUT_LEVEL = 1
 # http://docs.python.org/2/library/time.html#time.strftime
 LOG_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
 
+# Format of log messages, either 'text' or 'json' (one JSON object per line).
+LOG_FORMAT = 'text'
+
+# Maximum number of log messages waiting to be written. If this is exceeded,
+# new messages are dropped. Set to 0 to write messages synchronously.
+LOG_QUEUE_SIZE = 10000
+
+# Rotate the log file when it exceeds this size (in bytes), keeping this many
+# old log files. Set LOG_MAX_BYTES to 0 to disable rotation.
+LOG_MAX_BYTES = 0
+LOG_BACKUP_COUNT = 5
+
 # Prefix URL from where LRG files are fetched.
 LRG_PREFIX_URL = 'ftp://ftp.ebi.ac.uk/pub/databases/lrgex/'
 
 # Allow for this fraction of errors in batch jobs.
 BATCH_JOBS_ERROR_THRESHOLD = 0.05
 
+# Number of batch queue items the batch processor claims from a job at once.
+BATCH_CLAIM_SIZE = 100
+
+# Batch job results are written to the result file in blocks of at least this
+# size (in characters), or after this many seconds.
+BATCH_RESULT_BUFFER_SIZE = 64 * 1024
+BATCH_RESULT_FLUSH_INTERVAL = 5
+
+# Write gzip compressed batch job result files.
+BATCH_RESULT_GZIP = False
+
+# Number of threads used by the batch processor to retrieve the reference
+# sequences of name checker batch jobs when it starts processing them (0 to
+# disable).
+BATCH_PREFETCH_THREADS = 4
+
+# Cache expiration time for HGVS descriptions of dbSNP records (in seconds).
+SNP_CACHE_EXPIRATION = 60 * 60 * 24 * 7
+
+# Base URL of the NCBI Entrez service (without trailing slash).
+ENTREZ_URL = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils'
+
 # Cache expiration time for negative transcript<->protein links from the NCBI
 # (in seconds).
 NEGATIVE_LINK_CACHE_EXPIRATION = 60 * 60 * 24 * 30
 
+# Cache expiration time for reference sequence entries looked up by accession
+# number (in seconds).
+REFERENCE_CACHE_EXPIRATION = 60 * 60 * 24
+
+# Cache expiration time for the available versions of a transcript or
+# chromosome (in seconds).
+VERSIONS_CACHE_EXPIRATION = 60 * 60
+
+# Check at most every this many seconds if the transcript mappings were
+# changed by another process, and reload the in-memory index if so.
+MAPPING_INDEX_CHECK_INTERVAL = 60
+
+# Check at most every this many seconds if the assemblies were changed by
+# another process, and drop the in-memory cache if so.
+ASSEMBLY_CACHE_CHECK_INTERVAL = 60
+
 # URL to the website root (without trailing slash). Used for generating
 # download links in the batch scheduler.
 WEBSITE_ROOT_URL = None
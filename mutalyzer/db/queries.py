@@ -9,6 +9,7 @@ Queries on database models.
 
 from __future__ import unicode_literals
 
+from mutalyzer import batch_results
 from mutalyzer.db import session
 from mutalyzer.db.models import BatchQueueItem
 
@@ -48,3 +49,88 @@ def pop_batch_queue_item(batch_job):
     session.commit()
 
     return item, flags
+
+
+def claim_batch_queue_items(batch_job, count, journal=None):
+    """
+    Get the next `count` batch queue items for the given batch job. Return
+    their fields as a list of tuples `id`, `item`, `flags` and remove them
+    from the database in one transaction.
+
+    If `journal` is given, it is called with the list of items before they
+    are removed, such that they can be recorded for crash recovery.
+
+    Claimed items are written to the result file of the batch job by the
+    claiming batch processor (see :class:`batch_results.ResultWriter`), so
+    only one batch processor can run at a time. This is enforced by
+    :func:`Scheduler.processor_lock`.
+
+    If no batch queue items could be found for this batch job, return an
+    empty list.
+    """
+    query = session.query(BatchQueueItem.id,
+                          BatchQueueItem.item,
+                          BatchQueueItem.flags) \
+        .filter_by(batch_job_id=batch_job.id) \
+        .order_by(BatchQueueItem.id.asc()) \
+        .limit(count)
+
+    batch_queue_items = [tuple(row) for row in query]
+    if batch_queue_items:
+        if journal is not None:
+            journal(batch_queue_items)
+        BatchQueueItem.query \
+            .filter(BatchQueueItem.id.in_(
+                [id for id, _, _ in batch_queue_items])) \
+            .delete(synchronize_session=False)
+    session.commit()
+
+    return batch_queue_items
+
+
+def restore_batch_queue_items(batch_job_id, batch_queue_items):
+    """
+    Put claimed batch queue items back in the database, for example if the
+    batch processor is stopped before processing them.
+
+    The items keep their original ids and therefore their position in the
+    queue. Items that are still in the database are ignored.
+
+    :arg int batch_job_id: Batch job id of the items.
+    :arg batch_queue_items: Claimed items as tuples `id`, `item`, `flags`.
+    """
+    if not batch_queue_items:
+        return
+
+    existing = set(id for id, in session.query(BatchQueueItem.id).filter(
+        BatchQueueItem.id.in_([id for id, _, _ in batch_queue_items])))
+    missing = [{'id': id,
+                'batch_job_id': batch_job_id,
+                'item': item,
+                'flags': flags}
+               for id, item, flags in batch_queue_items
+               if id not in existing]
+
+    if missing:
+        session.execute(BatchQueueItem.__table__.insert(), missing)
+    session.commit()
+
+
+def count_batch_queue_items(batch_job):
+    """
+    Get the number of items left for the given batch job. These are the
+    items in the database and the claimed items whose result lines are not
+    yet in the result file.
+
+    :arg BatchJob batch_job: Batch job.
+
+    :returns: Number of items left.
+    :rtype: int
+    """
+    claimed = set(id for id, _, _ in
+                  batch_results.unwritten_items(batch_job.result_id))
+    items = batch_job.batch_queue_items
+    if claimed:
+        # Claimed items that are put back in the database are counted once.
+        items = items.filter(~BatchQueueItem.id.in_(claimed))
+    return items.count() + len(claimed)
@@ -7,6 +7,7 @@ from __future__ import unicode_literals
 
 import argparse
 import codecs
+import datetime
 import json
 import locale
 import os
@@ -19,11 +20,18 @@ from sqlalchemy.orm.exc import NoResultFound
 
 from . import _cli_string
 from .. import announce
+from .. import assembly_cache
+from .. import compression
+from ..config import settings
 from .. import db
 from ..db import session
-from ..db.models import Assembly, BatchJob, BatchQueueItem, Chromosome
+from ..db.models import (Assembly, BatchJob, BatchQueueItem, Chromosome,
+                         Reference)
+from .. import file_cache
 from .. import mapping
 from .. import output
+from .. import Retriever
+from .. import stats
 from .. import sync
 from .. import util
 
@@ -72,6 +80,7 @@ def add_assembly(assembly_file, encoding):
         session.add(chromosome)
 
     session.commit()
+    assembly_cache.invalidate()
 
 
 def list_assemblies():
@@ -175,6 +184,121 @@ def sync_cache(wsdl_url, url_template, history=7):
            % (inserted, downloaded))
 
 
+def build_compact_records(force=False):
+    """
+    Create compact record files for GenBank references in the cache.
+
+    Compact record files are created automatically when a reference is first
+    used. This can be used to create them for an existing cache in advance.
+    """
+    # For long-running processes it can be convenient to have a short and
+    # human-readable process name.
+    util.set_process_name('mutalyzer: build-compact-records')
+
+    retriever = Retriever.GenBankRetriever(output.Output(__file__))
+
+    references = Reference.query \
+        .filter(Reference.source != 'lrg') \
+        .order_by(Reference.id.asc()) \
+        .all()
+
+    created = failed = 0
+    for reference in references:
+        try:
+            if retriever.build_compact_record(reference, force=force):
+                created += 1
+        except (EnvironmentError, EOFError, ValueError) as e:
+            print 'Could not parse %s: %s' % (reference.accession, unicode(e))
+            failed += 1
+
+    print ('Created %d compact record files (%d failed).'
+           % (created, failed))
+
+
+def report_cache():
+    """
+    Show the size and usage of the reference file cache.
+    """
+    summary = file_cache.report()
+    counters = stats.get_totals()
+
+    if settings.FILE_CACHE_SIZE is None:
+        limit = 'unlimited'
+    else:
+        limit = '%d bytes' % settings.FILE_CACHE_SIZE
+
+    if summary['oldest_access'] is None:
+        oldest_access = '-'
+    else:
+        oldest_access = datetime.datetime.fromtimestamp(
+            summary['oldest_access']).strftime('%Y-%m-%d %H:%M:%S')
+
+    print 'Size:           %d bytes in %d files (limit: %s)' % (
+        summary['size'], summary['files'], limit)
+    print 'Pinned:         %d bytes in %d files' % (
+        summary['pinned_size'], summary['pinned_files'])
+    print 'Oldest access:  %s' % oldest_access
+    print 'Hits:           %d' % counters.get('file-cache/hit', 0)
+    print 'Misses:         %d' % counters.get('file-cache/miss', 0)
+    print 'Evictions:      %d' % counters.get('file-cache/eviction', 0)
+
+
+def compact_cache(size=None):
+    """
+    Remove least recently used reference files from the cache.
+
+    The index of the cache is first synchronized with the files in the cache
+    directory. Files are then removed until the cache is at most `size` bytes
+    (default: the `FILE_CACHE_SIZE` setting).
+    """
+    util.set_process_name('mutalyzer: compact-cache')
+
+    if size is None:
+        size = settings.FILE_CACHE_SIZE
+
+    added, forgotten = file_cache.scan()
+    print ('Added %d files to the cache index, removed %d missing files.'
+           % (added, forgotten))
+
+    if size is None:
+        return
+
+    removed = file_cache.evict(size)
+    print 'Removed %d files from the cache.' % len(removed)
+
+
+def transcode_cache(codec=None):
+    """
+    Compress the reference files in the cache with another codec.
+
+    Files are converted in place to the given codec (default: the
+    `CACHE_CODEC` setting). Files already using the codec are skipped.
+    """
+    util.set_process_name('mutalyzer: transcode-cache')
+
+    try:
+        compression.get_codec(codec).compress(b'')
+    except ValueError as e:
+        raise UserError(unicode(e))
+
+    transcoded = failed = 0
+    for name in sorted(os.listdir(settings.CACHE_DIR)):
+        if not name.endswith(('.gb.bz2', '.xml.bz2')):
+            continue
+        try:
+            if compression.transcode(os.path.join(settings.CACHE_DIR, name),
+                                     codec):
+                transcoded += 1
+        except (EnvironmentError, EOFError, ValueError) as e:
+            print 'Could not transcode %s: %s' % (name, unicode(e))
+            failed += 1
+
+    # Update the file sizes in the cache index.
+    file_cache.scan()
+
+    print 'Transcoded %d files (%d failed).' % (transcoded, failed)
+
+
 def list_batch_jobs():
     """
     List batch jobs.
@@ -254,6 +378,9 @@ def setup_database(alembic_config_path=None, destructive=False):
         # the Assembly table exists.
         db.Base.metadata.create_all(bind)
 
+    if destructive:
+        assembly_cache.invalidate()
+
     if alembic_config_path:
         context = MigrationContext.configure(db.session.connection())
         if destructive or context.get_current_revision() is None:
@@ -402,6 +529,50 @@ def main():
         description=list_batch_jobs.__doc__.split('\n\n')[0])
     p.set_defaults(func=list_batch_jobs)
 
+    # Subparsers for 'cache'.
+    s = subparsers.add_parser(
+        'cache', help='manage reference file cache',
+        description='Manage the reference file cache.'
+        ).add_subparsers()
+
+    # Subparser 'cache build-records'.
+    p = s.add_parser(
+        'build-records', help='create compact record files',
+        description=build_compact_records.__doc__.split('\n\n')[0],
+        epilog='Compact record files are created automatically when a '
+        'reference is first used, use this to backfill an existing cache.')
+    p.add_argument(
+        '-f', '--force', dest='force', action='store_true',
+        help='also recreate compact record files that are up to date')
+    p.set_defaults(func=build_compact_records)
+
+    # Subparser 'cache report'.
+    p = s.add_parser(
+        'report', help='show cache size and usage',
+        description=report_cache.__doc__.split('\n\n')[0])
+    p.set_defaults(func=report_cache)
+
+    # Subparser 'cache compact'.
+    p = s.add_parser(
+        'compact', help='remove least recently used reference files',
+        description=compact_cache.__doc__.split('\n\n')[0],
+        epilog='Uploaded reference files are never removed. Without a '
+        'size limit, only the cache index is synchronized.')
+    p.add_argument(
+        '-s', '--size', metavar='BYTES', dest='size', type=int,
+        help='maximum cache size in bytes (default: FILE_CACHE_SIZE setting)')
+    p.set_defaults(func=compact_cache)
+
+    # Subparser 'cache transcode'.
+    p = s.add_parser(
+        'transcode', help='compress reference files with another codec',
+        description=transcode_cache.__doc__.split('\n\n')[0])
+    p.add_argument(
+        '-c', '--codec', dest='codec', type=_cli_string,
+        choices=sorted(compression.CODECS),
+        help='codec to use (default: CACHE_CODEC setting)')
+    p.set_defaults(func=transcode_cache)
+
     # Subparser 'sync-cache'.
     p = subparsers.add_parser(
         'sync-cache', help='synchronize cache with remote Mutalyzer',
@@ -19,15 +19,31 @@ from .. import Scheduler
 from .. import util
 
 
-def process():
+def process(workers=1):
     """
-    Run forever in a loop processing scheduled batch jobs.
+    Run forever in a loop processing scheduled batch jobs. Only one batch
+    processor can run at a time, so we exit if another one is running.
+
+    :arg int workers: Number of worker processes.
     """
     # For long-running processes it can be convenient to have a short and
     # human-readable process name.
     util.set_process_name('mutalyzer: batch-processor')
 
-    scheduler = Scheduler.Scheduler()
+    with Scheduler.processor_lock() as locked:
+        if not locked:
+            sys.stderr.write('mutalyzer-batch-processor: Another batch '
+                             'processor is running\n')
+            sys.exit(1)
+        _process(workers)
+
+
+def _process(workers):
+    """
+    Implementation of :func:`process` while holding the batch processor
+    lock.
+    """
+    scheduler = Scheduler.Scheduler(workers=workers)
 
     def handle_exit(signum, stack_frame):
         if scheduler.stopped():
@@ -66,8 +82,16 @@ def main():
         epilog='The process can be shutdown gracefully by sending a SIGINT '
         '(Ctrl+C) or SIGTERM signal.')
 
-    parser.parse_args()
-    process()
+    parser.add_argument(
+        '-w', '--workers', metavar='N', dest='workers', type=int, default=1,
+        help='number of worker processes (default: 1)')
+
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error('the number of worker processes must be at least 1')
+
+    process(workers=args.workers)
 
 
 if __name__ == '__main__':
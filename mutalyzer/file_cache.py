@@ -0,0 +1,383 @@
+"""
+Size accounting and LRU eviction for the reference files in the cache
+directory.
+
+Reference files (``<accession>.gb.bz2`` and ``<accession>.xml.bz2``) and
+compact record files (``<accession>.gb.rec``) in `CACHE_DIR` are tracked in
+an index in Redis, with the size and last access time of every file. If the
+total size exceeds `FILE_CACHE_SIZE` bytes, least recently used files are
+removed until the total size is below `EVICTION_TARGET` of that.
+
+Files fall into two tiers:
+
+- Pinned files are never removed. These are the files of uploaded
+  references and references unknown to the database, which cannot be
+  re-created.
+- Evictable files are removed in least recently used order. These are
+  compact record files and the files of references that are re-created when
+  they are used again (from the NCBI, by slicing, or by downloading from a
+  URL or the LRG website, see
+  :meth:`Retriever.GenBankRetriever.retrieverecord`).
+
+Use of a reference file is recorded in the `file-cache/hit` and
+`file-cache/miss` counters (see :mod:`stats`), where a miss is a file of a
+previously used reference that is no longer in the cache. Removed files are
+counted in the `file-cache/eviction` counter.
+
+The index is updated by the processes using the cache. It can be rebuilt
+from the files in the cache directory with :func:`scan` (e.g., after
+flushing Redis).
+
+Unused lock files of the retrievers in the `locks` subdirectory are removed
+with :func:`clean_locks`, which is also done by :func:`scan` and
+:func:`evict`.
+"""
+
+
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+import errno
+import fcntl
+import os
+import re
+import time
+
+from redis.exceptions import WatchError
+
+from mutalyzer.config import settings
+from mutalyzer.db import session
+from mutalyzer.db.models import Reference
+from mutalyzer.redisclient import client as redis
+from mutalyzer import stats
+
+
+#: Redis hash with the size of every file in the index (in bytes).
+SIZES_KEY = 'file-cache:sizes'
+
+#: Redis hash with the last access time of every file in the index (in
+#: seconds since the epoch).
+ACCESS_KEY = 'file-cache:access'
+
+#: Redis key with the total size of the files in the index (in bytes).
+TOTAL_KEY = 'file-cache:total'
+
+#: Eviction frees the cache down to this fraction of `FILE_CACHE_SIZE`, so
+#: that we don't have to evict on every write.
+EVICTION_TARGET = 0.9
+
+#: Files accessed less than this number of seconds ago are not evicted,
+#: since they might be in use.
+EVICTION_GRACE = 60
+
+#: References with these sources are re-created when their file is removed.
+EVICTABLE_SOURCES = ('ncbi', 'ncbi_slice', 'url', 'lrg')
+
+#: Lock files that are never removed by :func:`clean_locks`, since their
+#: users don't check if the lock file was removed while they were waiting.
+PERMANENT_LOCKS = ('batch-processor.lock', 'file-cache.lock')
+
+# Number of references to look up in one database query.
+_QUERY_SIZE = 500
+
+_FILENAME = re.compile(r'^(?P<accession>.+)\.(gb|xml)\.(?P<extension>\w+)$')
+
+
+def _parse_filename(name):
+    # Accession number for a file in the cache, and whether it is a compact
+    # record file. Returns `None` for files that are not reference files.
+    match = _FILENAME.match(name)
+    if match is None or match.group('extension') == 'tmp':
+        return None
+    return match.group('accession'), match.group('extension') == 'rec'
+
+
+def _sources(accessions):
+    # Sources of the references for the given accession numbers.
+    sources = {}
+    for i in range(0, len(accessions), _QUERY_SIZE):
+        sources.update(
+            session.query(Reference.accession, Reference.source)
+            .filter(Reference.accession.in_(accessions[i:i + _QUERY_SIZE])))
+    return sources
+
+
+def _is_pinned(name, sources):
+    # Whether a file can never be evicted.
+    accession, compact = _parse_filename(name)
+    return not compact and sources.get(accession) not in EVICTABLE_SOURCES
+
+
+@contextmanager
+def _eviction_lock():
+    # Non-blocking exclusive lock on eviction, shared by all processes using
+    # the cache directory (see :meth:`Retriever.Retriever._lock`). Yields
+    # `False` if another process holds the lock.
+    directory = os.path.join(settings.CACHE_DIR, 'locks')
+    try:
+        os.mkdir(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    with open(os.path.join(directory, 'file-cache.lock'), 'a') as handle:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def add(filename):
+    """
+    Add a file that was written to the cache to the index, and evict files if
+    the cache is larger than `FILE_CACHE_SIZE` bytes.
+
+    :arg unicode filename: The full path to the file.
+    """
+    name = os.path.basename(filename)
+    if _parse_filename(name) is None:
+        return
+
+    try:
+        size = os.path.getsize(filename)
+    except OSError:
+        return
+
+    # The total size is updated with the difference to the previous size of
+    # the file, so this is done in a transaction that is retried if another
+    # process changes the index in the meantime.
+    with redis.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(SIZES_KEY)
+                previous_size = int(pipe.hget(SIZES_KEY, name) or 0)
+                pipe.multi()
+                pipe.hset(SIZES_KEY, name, size)
+                pipe.hset(ACCESS_KEY, name, time.time())
+                pipe.incrby(TOTAL_KEY, size - previous_size)
+                total = pipe.execute()[-1]
+                break
+            except WatchError:
+                continue
+
+    if (settings.FILE_CACHE_SIZE is not None and
+            total > settings.FILE_CACHE_SIZE):
+        evict(int(settings.FILE_CACHE_SIZE * EVICTION_TARGET))
+
+
+def access(filename):
+    """
+    Record an access to a file in the cache. Files that are not in the index
+    yet are added.
+
+    :arg unicode filename: The full path to the file.
+    """
+    name = os.path.basename(filename)
+    if not redis.hexists(SIZES_KEY, name):
+        add(filename)
+    else:
+        redis.hset(ACCESS_KEY, name, time.time())
+
+
+def lookup(filename):
+    """
+    Check if a reference file is in the cache and record the access.
+
+    :arg unicode filename: The full path to the file.
+
+    :returns: `True` if the file is in the cache, `False` otherwise.
+    :rtype: bool
+    """
+    if not os.path.isfile(filename):
+        stats.increment_counter('file-cache/miss')
+        return False
+
+    stats.increment_counter('file-cache/hit')
+    access(filename)
+    return True
+
+
+def _forget(pipe, name, size):
+    # Remove a file from the index.
+    pipe.hdel(SIZES_KEY, name)
+    pipe.hdel(ACCESS_KEY, name)
+    pipe.incrby(TOTAL_KEY, -size)
+
+
+def evict(size):
+    """
+    Remove least recently used files from the cache until its total size is
+    at most `size` bytes.
+
+    Pinned files and files accessed in the last `EVICTION_GRACE` seconds are
+    not removed, so the cache can remain larger than `size` bytes. Nothing is
+    done if another process is already evicting files.
+
+    :arg int size: Maximum total size of the cache (in bytes).
+
+    :returns: Names of the removed files.
+    :rtype: list(unicode)
+    """
+    with _eviction_lock() as locked:
+        if not locked:
+            return []
+
+        clean_locks()
+
+        sizes = {name: int(value)
+                 for name, value in redis.hgetall(SIZES_KEY).items()}
+        total = sum(sizes.values())
+        if total <= size:
+            return []
+
+        accessed = redis.hgetall(ACCESS_KEY)
+        threshold = time.time() - EVICTION_GRACE
+        candidates = sorted(
+            (name for name in sizes
+             if float(accessed.get(name, 0)) < threshold),
+            key=lambda name: float(accessed.get(name, 0)))
+
+        removed = []
+        for i in range(0, len(candidates), _QUERY_SIZE):
+            batch = candidates[i:i + _QUERY_SIZE]
+            sources = _sources(
+                [_parse_filename(name)[0] for name in batch])
+
+            pipe = redis.pipeline(transaction=False)
+            for name in batch:
+                if total <= size:
+                    break
+                if _is_pinned(name, sources):
+                    continue
+                try:
+                    os.remove(os.path.join(settings.CACHE_DIR, name))
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        continue
+                else:
+                    stats.increment_counter('file-cache/eviction')
+                    removed.append(name)
+                _forget(pipe, name, sizes[name])
+                total -= sizes[name]
+            pipe.execute()
+
+            if total <= size:
+                break
+
+        return removed
+
+
+def scan():
+    """
+    Synchronize the index with the files in the cache directory.
+
+    Files that are not in the index are added with their modification time
+    as last access time, files that no longer exist are removed from the
+    index.
+
+    :returns: Number of files added to the index and number of files removed
+      from the index.
+    :rtype: tuple(int, int)
+    """
+    files = {}
+    for name in os.listdir(settings.CACHE_DIR):
+        if _parse_filename(name) is None:
+            continue
+        try:
+            status = os.stat(os.path.join(settings.CACHE_DIR, name))
+        except OSError:
+            continue
+        files[name] = status.st_size, status.st_mtime
+
+    sizes = redis.hgetall(SIZES_KEY)
+    accessed = redis.hgetall(ACCESS_KEY)
+
+    pipe = redis.pipeline(transaction=False)
+    for name in sizes:
+        if name not in files:
+            pipe.hdel(SIZES_KEY, name)
+            pipe.hdel(ACCESS_KEY, name)
+    for name, (size, modified) in files.items():
+        pipe.hset(SIZES_KEY, name, size)
+        if name not in accessed:
+            pipe.hset(ACCESS_KEY, name, modified)
+    pipe.set(TOTAL_KEY, sum(size for size, _ in files.values()))
+    pipe.execute()
+
+    clean_locks()
+
+    return (len([name for name in files if name not in sizes]),
+            len([name for name in sizes if name not in files]))
+
+
+def clean_locks():
+    """
+    Remove the lock files in the `locks` subdirectory of the cache directory
+    that are not in use (see :meth:`Retriever.Retriever._lock`).
+
+    A lock file is only removed while we hold its lock, and a retriever that
+    gets the lock after that sees the lock file is gone and tries again.
+
+    :returns: Number of removed lock files.
+    :rtype: int
+    """
+    directory = os.path.join(settings.CACHE_DIR, 'locks')
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return 0
+
+    removed = 0
+    for name in names:
+        if not name.endswith('.lock') or name in PERMANENT_LOCKS:
+            continue
+        lock_file = os.path.join(directory, name)
+        with open(lock_file, 'a') as handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                continue
+            try:
+                os.remove(lock_file)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            else:
+                removed += 1
+
+    return removed
+
+
+def report():
+    """
+    Summary of the files in the index.
+
+    :returns: Dictionary with the number of files (`files`), their total size
+      in bytes (`size`), the number and size of the pinned files
+      (`pinned_files` and `pinned_size`), and the oldest last access time of
+      the evictable files (`oldest_access`, `None` if there are none).
+    :rtype: dict
+    """
+    sizes = {name: int(value)
+             for name, value in redis.hgetall(SIZES_KEY).items()}
+    accessed = redis.hgetall(ACCESS_KEY)
+    sources = _sources([_parse_filename(name)[0] for name in sizes])
+
+    pinned = set(name for name in sizes if _is_pinned(name, sources))
+    evictable_access = [float(accessed.get(name, 0)) for name in sizes
+                        if name not in pinned]
+
+    return {'files': len(sizes),
+            'size': sum(sizes.values()),
+            'pinned_files': len(pinned),
+            'pinned_size': sum(sizes[name] for name in pinned),
+            'oldest_access': min(evictable_access or [None])}
@@ -21,9 +21,16 @@ The grammar is described in [3].
 
 from __future__ import unicode_literals
 
+import threading
+
 from pyparsing import *
 
 
+# The packrat cache of pyparsing is shared by all parsers and is reset at the
+# start of every parse, so we parse in one thread at a time.
+_parse_lock = threading.Lock()
+
+
 class Grammar():
     """
     Defines the HGVS nomenclature grammar.
@@ -491,7 +498,8 @@ class Grammar():
             http://pyparsing.wikispaces.com/HowToUsePyparsing
         """
         try:
-            return self.Var.parseString(variant, parseAll=True)
+            with _parse_lock:
+                return self.Var.parseString(variant, parseAll=True)
             # Todo: check .dump()
         except ParseException as err:
             #print err.line
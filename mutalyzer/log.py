@@ -0,0 +1,205 @@
+"""
+Process-wide sink for log messages.
+
+All :class:`output.Output` objects write their log messages to the log file
+(`LOG_FILE`) through the global :data:`sink`. Messages are put in a bounded
+queue (`LOG_QUEUE_SIZE`) and written in batches by a background thread, so
+logging does not cost a file open, write and flush for every message. If the
+queue is full, new messages are dropped and the number of dropped messages
+is logged as soon as there is room again. With a queue size of `0`, messages
+are written synchronously.
+
+The log file is rotated when it exceeds `LOG_MAX_BYTES` bytes, keeping
+`LOG_BACKUP_COUNT` old log files (`LOG_FILE.1`, `LOG_FILE.2`, etc).
+
+Messages are written as plain text lines, or as JSON objects (one per line)
+if `LOG_FORMAT` is ``json``. JSON records include an identifier of the
+:class:`output.Output` object, which typically corresponds to one request or
+one batch job item.
+"""
+
+
+from __future__ import unicode_literals
+
+import atexit
+import io
+import json
+import os
+import Queue
+import threading
+import time
+
+from mutalyzer.config import settings
+
+
+# Maximum number of messages written in one batch.
+BATCH_SIZE = 1000
+
+
+def format_record(record):
+    """
+    Format a log record as configured with `LOG_FORMAT`.
+
+    :arg dict record: Log record with fields `time`, `request`, `instance`,
+      `origin`, `code`, `level` and `message`.
+
+    :returns: Log line, including the newline.
+    :rtype: unicode
+    """
+    timestamp = time.strftime(settings.LOG_TIME_FORMAT,
+                              time.localtime(record['time']))
+    if settings.LOG_FORMAT == 'json':
+        return '%s\n' % json.dumps(dict(record, time=timestamp),
+                                   ensure_ascii=False, sort_keys=True)
+    return '%s %s (%s) %s: %s: %s\n' % (
+        timestamp, record['instance'], record['origin'], record['code'],
+        record['level'], record['message'])
+
+
+class LogSink(object):
+    """
+    Queue-backed writer for log messages.
+    """
+    def __init__(self):
+        # Only held while (re)starting the sink, never by the writer thread.
+        self._start_lock = threading.Lock()
+        self._lock = None
+        self._pid = None
+        self._queue = None
+        self._handle = None
+        self._path = None
+        self._dropped = 0
+
+    def _start(self):
+        # Called on first use and in forked processes. The lock and queue
+        # inherited from the parent process may have been held by its writer
+        # thread at the time of the fork, so they are replaced. A handle
+        # inherited from the parent process is left alone.
+        pid = os.getpid()
+        with self._start_lock:
+            if self._pid == pid:
+                return
+            self._lock = threading.Lock()
+            self._handle = None
+            self._path = None
+            self._dropped = 0
+            self._queue = Queue.Queue(settings.LOG_QUEUE_SIZE)
+            if settings.LOG_QUEUE_SIZE > 0:
+                thread = threading.Thread(target=self._run,
+                                          args=(self._queue,),
+                                          name='mutalyzer-log')
+                thread.daemon = True
+                thread.start()
+            self._pid = pid
+
+    def emit(self, **record):
+        """
+        Log a message.
+
+        :arg record: Log record fields, see :func:`format_record`.
+        """
+        record['time'] = time.time()
+        path = settings.LOG_FILE
+
+        if self._pid != os.getpid():
+            self._start()
+
+        with self._lock:
+            if not self._queue.maxsize:
+                self._write([(path, record)])
+                return
+            try:
+                self._queue.put_nowait((path, record))
+            except Queue.Full:
+                self._dropped += 1
+
+    def flush(self):
+        """
+        Wait until all queued messages are written.
+        """
+        if self._pid == os.getpid() and self._queue.maxsize:
+            self._queue.join()
+
+    def _run(self, queue):
+        while True:
+            records = [queue.get()]
+            try:
+                while len(records) < BATCH_SIZE:
+                    records.append(queue.get_nowait())
+            except Queue.Empty:
+                pass
+
+            with self._lock:
+                dropped, self._dropped = self._dropped, 0
+            if dropped:
+                records.append((records[-1][0], {
+                    'time': time.time(), 'request': None,
+                    'instance': 'log', 'origin': 'log', 'code': 'LOGDROP',
+                    'level': 'Warning',
+                    'message': 'Dropped %d log messages' % dropped}))
+
+            try:
+                self._write(records)
+            except Exception:
+                # The writer thread must keep running, `flush` waits for it.
+                # There is nothing we can log.
+                self._close()
+            finally:
+                for _ in range(len(records) - bool(dropped)):
+                    queue.task_done()
+
+    def _write(self, records):
+        try:
+            for path, record in records:
+                if path != self._path:
+                    self._open(path)
+                self._handle.write(format_record(record))
+            self._handle.flush()
+
+            if (settings.LOG_MAX_BYTES > 0 and
+                    self._handle.tell() >= settings.LOG_MAX_BYTES):
+                self._rotate()
+        except EnvironmentError:
+            # The log file is not writable, there is nothing we can log.
+            self._close()
+
+    def _open(self, path):
+        self._close()
+        self._handle = io.open(path, mode='a', encoding='utf-8')
+        self._path = path
+
+    def _close(self):
+        if self._handle is not None:
+            try:
+                self._handle.close()
+            except EnvironmentError:
+                pass
+        self._handle = None
+        self._path = None
+
+    def _rotate(self):
+        path = self._path
+
+        # Another process may have rotated the file already.
+        try:
+            rotated = (os.fstat(self._handle.fileno()).st_ino !=
+                       os.stat(path).st_ino)
+        except OSError:
+            rotated = True
+
+        if not rotated:
+            for i in range(settings.LOG_BACKUP_COUNT - 1, 0, -1):
+                if os.path.exists('%s.%d' % (path, i)):
+                    os.rename('%s.%d' % (path, i), '%s.%d' % (path, i + 1))
+            if settings.LOG_BACKUP_COUNT > 0:
+                os.rename(path, '%s.1' % path)
+            else:
+                os.unlink(path)
+
+        self._open(path)
+
+
+#: Global :class:`LogSink` instance.
+sink = LogSink()
+
+atexit.register(sink.flush)
@@ -0,0 +1,143 @@
+"""
+Redis cache for frequent database lookups.
+
+Checking a variant description starts with a number of small database
+queries which are repeated for every request on the same reference sequence:
+the :class:`db.models.Reference` entry for an accession number, the versions
+of a transcript for which we have a mapping, and the versions of a
+chromosome in the gbparser database. Their results are cached in Redis,
+shared by all processes, and expire after a configurable time.
+
+- References are cached for `REFERENCE_CACHE_EXPIRATION` seconds. Unknown
+  accession numbers are not cached (the first request fetches them), and
+  changes to existing references should be followed by a call to
+  :func:`invalidate_reference`.
+- Transcript versions are cached for `VERSIONS_CACHE_EXPIRATION` seconds.
+  The keys include the version number of the transcript mappings (see
+  :mod:`mapping_index`), so calling :func:`mapping_index.invalidate` after
+  importing transcript mappings also invalidates this cache.
+- Chromosome versions in the gbparser database are cached for
+  `VERSIONS_CACHE_EXPIRATION` seconds. This database is maintained outside
+  Mutalyzer, so we can only rely on expiration here.
+
+The hit ratio of each lookup is recorded in the `reference-lookup`,
+`transcript-versions`, and `nc-versions` counters (see :mod:`stats`).
+"""
+
+
+from __future__ import unicode_literals
+
+import json
+
+from sqlalchemy.orm import make_transient_to_detached
+
+from mutalyzer.config import settings
+from mutalyzer.db import session
+from mutalyzer.db.models import Reference, TranscriptMapping
+from mutalyzer import dbgb
+from mutalyzer.dbgb.models import Reference as GbReference
+from mutalyzer import mapping_index
+from mutalyzer.redisclient import client as redis
+from mutalyzer import stats
+
+
+_REFERENCE_COLUMNS = ('id', 'accession', 'checksum', 'source', 'source_data')
+
+
+def _cached(counter, key, expiration, load):
+    # Cached value for `key`, calling `load` to get it on a cache miss.
+    # Values of `None` are not cached.
+    value = redis.get(key)
+    if value is not None:
+        stats.increment_counter('%s/hit' % counter)
+        return json.loads(value)
+
+    stats.increment_counter('%s/miss' % counter)
+    value = load()
+    if value is not None:
+        redis.setex(key, expiration, json.dumps(value))
+    return value
+
+
+def get_reference(accession):
+    """
+    Get the reference for an accession number.
+
+    :arg unicode accession: Accession number (including version, or the
+      UD or LRG number).
+
+    :returns: The reference, or `None` if it does not exist.
+    :rtype: db.models.Reference
+    """
+    def load():
+        values = session.query(*[getattr(Reference, column)
+                                 for column in _REFERENCE_COLUMNS]) \
+            .filter_by(accession=accession).first()
+        return values and dict(zip(_REFERENCE_COLUMNS, values))
+
+    values = _cached('reference-lookup', 'reference:%s' % accession,
+                     settings.REFERENCE_CACHE_EXPIRATION, load)
+    if values is None:
+        return None
+
+    # Detached instance, as if it was loaded in a session that is now
+    # closed. Other columns are loaded on first use.
+    reference = Reference.__mapper__.class_manager.new_instance()
+    for column in _REFERENCE_COLUMNS:
+        setattr(reference, column, values[column])
+    make_transient_to_detached(reference)
+    return session.merge(reference, load=False)
+
+
+def invalidate_reference(accession):
+    """
+    Remove the reference for an accession number from the cache. Call this
+    after changing the reference.
+
+    :arg unicode accession: Accession number (including version, or the
+      UD or LRG number).
+    """
+    redis.delete('reference:%s' % accession)
+
+
+def get_transcript_versions(assembly, accession):
+    """
+    Get the versions of a transcript for which we have a mapping.
+
+    :arg db.models.Assembly assembly: Assembly of the mappings.
+    :arg unicode accession: Transcript accession number (without version).
+
+    :returns: Versions in no particular order, possibly including `None`
+      (for mappings without version) and duplicates.
+    :rtype: list(int)
+    """
+    def load():
+        query = session.query(TranscriptMapping.version).filter(
+            TranscriptMapping.accession == accession,
+            TranscriptMapping.chromosome.has(assembly=assembly))
+        return [version for version, in query]
+
+    key = 'transcript-versions:%d:%d:%s' % (
+        int(redis.get(mapping_index.VERSION_KEY) or 0), assembly.id,
+        accession)
+    return _cached('transcript-versions', key,
+                   settings.VERSIONS_CACHE_EXPIRATION, load)
+
+
+def get_nc_versions(accession):
+    """
+    Get the versions of a reference in the gbparser database.
+
+    :arg unicode accession: Accession number (without version).
+
+    :returns: Versions in the order they were added.
+    :rtype: list(unicode)
+    """
+    def load():
+        query = dbgb.session.query(GbReference.version) \
+            .filter_by(accession=str(accession)) \
+            .order_by(GbReference.id.asc())
+        return [version for version, in query]
+
+    return _cached('nc-versions', 'nc-versions:%s' % accession,
+                   settings.VERSIONS_CACHE_EXPIRATION, load)
@@ -18,13 +18,17 @@ from operator import attrgetter, itemgetter
 
 import binning
 import MySQLdb
+from sqlalchemy.orm.exc import NoResultFound
 
 from mutalyzer.db import session
 from mutalyzer.db.models import Chromosome, TranscriptMapping
 from mutalyzer.grammar import Grammar
 from mutalyzer.models import SoapMessage, Mapping, Transcript
 from mutalyzer.output import Output
+from mutalyzer import assembly_cache
 from mutalyzer import Crossmap
+from mutalyzer import lookup_cache
+from mutalyzer import mapping_index
 from mutalyzer import Retriever
 from mutalyzer import util
 
@@ -173,9 +177,7 @@ class Converter(object) :
         @kwarg selector_version: Optional transcript version selector.
         @type selector_version: int
         """
-        versions = [m.version for m in TranscriptMapping.query.filter(
-                      TranscriptMapping.accession == acc,
-                      TranscriptMapping.chromosome.has(assembly=self.assembly))]
+        versions = lookup_cache.get_transcript_versions(self.assembly, acc)
 
         if not versions:
             self.__output.addMessage(__file__, 4, "EACCNOTINDB",
@@ -264,6 +266,10 @@ class Converter(object) :
         if not self.mapping:
             return None
 
+        if isinstance(self.mapping, mapping_index.IndexedMapping):
+            self.crossmap = self.mapping.crossmap
+            return self.crossmap
+
         # Create Mutalyzer compatible exon list.
         mrna = []
         for exon in zip(self.mapping.exon_starts, self.mapping.exon_stops):
@@ -277,46 +283,59 @@ class Converter(object) :
     #makeCrossmap
 
     @staticmethod
-    def _getcoords(C, Loc, Type) :
+    def _getcoords(C, Locs, Type) :
         """
-        Return main, offset and g positions given either a position in
-        I{c.} or in I{g.} notation.
+        Return main, offset and g positions given a list of positions in
+        either I{c.} or in I{g.} notation.
+
+        The positions are converted together using the array versions of
+        the crossmapper methods.
 
         @arg C: A crossmapper
         @type C: object
-        @arg Loc: A location in either I{g.} or I{c.} notation
-        @type Loc: object
+        @arg Locs: Locations in either I{g.} or I{c.} notation
+        @type Locs: list(object)
         @arg Type: The reference type
         @type Type: unicode
-        @returns: triple:
+        @returns: list of triples:
             0. Main coordinate in I{c.} notation
             1. Offset coordinate in I{c.} notation
             2. Position in I{g.} notation
-        @rtype: triple (integer, integer, integer)
+        @rtype: list(triple (integer, integer, integer))
         """
-        if Type in 'cn' :
-            if Loc.IVSLoc:
-                ivs_number = int(Loc.IVSLoc.IVSNumber)
-                if ivs_number < 1 or ivs_number > C.numberOfIntrons():
-                    # Todo: Error handling in this entire module is 'suboptimal'
-                    raise Exception('Invalid intron')
-                if Loc.IVSLoc.OffSgn == '+':
-                    g = C.getSpliceSite(ivs_number * 2 - 1) + \
-                        C.orientation * int(Loc.IVSLoc.Offset)
+        g_positions = []
+        x_indices, x_mains, x_offsets = [], [], []
+
+        for Loc in Locs :
+            if Type in 'cn' :
+                if Loc.IVSLoc:
+                    ivs_number = int(Loc.IVSLoc.IVSNumber)
+                    if ivs_number < 1 or ivs_number > C.numberOfIntrons():
+                        # Todo: Error handling in this entire module is 'suboptimal'
+                        raise Exception('Invalid intron')
+                    if Loc.IVSLoc.OffSgn == '+':
+                        g = C.getSpliceSite(ivs_number * 2 - 1) + \
+                            C.orientation * int(Loc.IVSLoc.Offset)
+                    else:
+                        g = C.getSpliceSite(ivs_number * 2) - \
+                            C.orientation * int(Loc.IVSLoc.Offset)
                 else:
-                    g = C.getSpliceSite(ivs_number * 2) - \
-                        C.orientation * int(Loc.IVSLoc.Offset)
-                main, offset = C.g2x(g)
+                    # Converted to g. below.
+                    x_indices.append(len(g_positions))
+                    x_mains.append(C.main2int(Loc.PtLoc.MainSgn +
+                                              Loc.PtLoc.Main))
+                    x_offsets.append(C.offset2int(Loc.PtLoc.OffSgn +
+                                                  Loc.PtLoc.Offset))
+                    g = None
             else:
-                main = C.main2int(Loc.PtLoc.MainSgn +  Loc.PtLoc.Main)
-                offset = C.offset2int(Loc.PtLoc.OffSgn +  Loc.PtLoc.Offset)
-                g = C.x2g(main, offset)
-                main, offset = C.g2x(g)
-        else:
-            g = int(Loc.PtLoc.Main)
-            main, offset = C.g2x(g)
+                g = int(Loc.PtLoc.Main)
+            g_positions.append(g)
+
+        for i, g in zip(x_indices, C.x2g_many(x_mains, x_offsets)) :
+            g_positions[i] = g
 
-        return (main, offset, g)
+        return [(main, offset, g) for (main, offset), g
+                in zip(C.g2x_many(g_positions), g_positions)]
     #_getcoords
 
     def _coreMapping(self) :
@@ -341,27 +360,31 @@ class Converter(object) :
                'Variant description contains no mutation.')
             return None
 
-        mappings = []
-
+        # Only the mutations before the first unsupported one are converted.
+        supported = []
         for mutation in mutations:
-
             if not mutation.StartLoc :
-                self.__output.addMessage(__file__, 4, 'EUNKNOWN',
-                                         'Variant type not supported.')
-                return None
+                break
+            supported.append(mutation)
+
+        # Get the coordinates of all start and end positions at once. If
+        # there is no end position, it is the same as the start position.
+        coords = self._getcoords(
+            Cross, [location for mutation in supported
+                    for location in (mutation.StartLoc,
+                                     mutation.EndLoc or mutation.StartLoc)],
+            self.parseTree.RefType)
+
+        if len(supported) < len(mutations) :
+            self.__output.addMessage(__file__, 4, 'EUNKNOWN',
+                                     'Variant type not supported.')
+            return None
 
-            # Get the coordinates of the start position
-            startmain, startoffset, start_g = \
-                    self._getcoords(Cross, mutation.StartLoc,
-                                    self.parseTree.RefType)
+        mappings = []
 
-            # If there is an end position, calculate the coordinates.
-            if mutation.EndLoc :
-                endmain, endoffset, end_g = \
-                    self._getcoords(Cross, mutation.EndLoc,
-                                    self.parseTree.RefType)
-            else :
-                end_g, endmain, endoffset = start_g, startmain, startoffset
+        for i, mutation in enumerate(supported):
+            startmain, startoffset, start_g = coords[2 * i]
+            endmain, endoffset, end_g = coords[2 * i + 1]
 
             # Assign these values to the Mapping ClassSerializer
             V = Mapping()
@@ -606,12 +629,10 @@ class Converter(object) :
 
         This only works for positions on transcript references in c. notation.
         """
-        versions = [m.version for m in TranscriptMapping.query.filter(
-                      TranscriptMapping.accession == reference,
-                      TranscriptMapping.version != None,
-                      TranscriptMapping.chromosome.has(assembly=self.assembly))]
+        versions = lookup_cache.get_transcript_versions(self.assembly,
+                                                        reference)
 
-        if version not in versions:
+        if version is None or version not in versions:
             return None
 
         self.mapping = TranscriptMapping.query \
@@ -629,12 +650,11 @@ class Converter(object) :
         if not mapper:
             return None
 
-        chromosomal_positions = []
-
-        for position in positions:
-            main = mapper.main2int(position.MainSgn +  position.Main)
-            offset = mapper.offset2int(position.OffSgn +  position.Offset)
-            chromosomal_positions.append(mapper.x2g(main, offset))
+        chromosomal_positions = mapper.x2g_many(
+            [mapper.main2int(position.MainSgn +  position.Main)
+             for position in positions],
+            [mapper.offset2int(position.OffSgn +  position.Offset)
+             for position in positions])
 
         orientation = '+' if self.mapping.orientation == 'forward' else '-'
 
@@ -662,9 +682,10 @@ class Converter(object) :
         if variant.startswith('chr') and ':' in variant:
             preco, postco = variant.split(':', 1)
 
-            chromosome = Chromosome.query.filter_by(assembly=self.assembly,
-                                                    name=preco).first()
-            if not chromosome:
+            try:
+                chromosome = assembly_cache.get_chromosome(self.assembly,
+                                                           preco)
+            except NoResultFound:
                 self.__output.addMessage(__file__, 4, "ENOTINDB",
                     "Accession number %s could not be found in our database "
                     "or is not suitable for the requested conversion." %
@@ -696,10 +717,10 @@ class Converter(object) :
         acc = self.parseTree.LrgAcc or self.parseTree.RefSeqAcc
         version = self.parseTree.Version
 
-        chromosome = Chromosome.query \
-            .filter_by(assembly=self.assembly,
-                       accession='%s.%s' % (acc, version)).first()
-        if not chromosome :
+        try:
+            chromosome = assembly_cache.get_chromosome_by_accession(
+                self.assembly, '%s.%s' % (acc, version))
+        except NoResultFound:
             self.__output.addMessage(__file__, 4, "ENOTINDB",
                 "Accession number %s could not be found in our database or is "
                 "not suitable for the requested conversion." %
@@ -731,23 +752,13 @@ class Converter(object) :
             min_loc = min(min_loc, loc)
             max_loc = max(max_loc, loc2)
 
+        index = mapping_index.get_index(chromosome)
         if gene:
-            mappings = chromosome.transcript_mappings.filter_by(gene=gene)
+            mappings = index.by_gene(gene)
         else:
             start = max(min_loc - 5000, 1)
             stop = min(max_loc + 5000, binning.MAX_POSITION + 1)
-            bins = binning.overlapping_bins(start - 1, stop)
-            mappings = chromosome.transcript_mappings.filter(
-                TranscriptMapping.bin.in_(bins),
-                TranscriptMapping.start <= stop,
-                TranscriptMapping.stop >= start
-            ).order_by(
-                TranscriptMapping.start,
-                TranscriptMapping.stop,
-                TranscriptMapping.gene,
-                TranscriptMapping.accession,
-                TranscriptMapping.version,
-                TranscriptMapping.transcript)
+            mappings = index.overlapping(start, stop)
 
         HGVS_notatations = defaultdict(list)
         NM_list = []
@@ -777,8 +788,15 @@ class Converter(object) :
             else:
                 mtype = 'n'
 
+            # Positions of all variants in c. or n. notation.
+            positions = self.crossmap.tuple2string_many(
+                [main for cmap in core_mapping
+                 for main in (cmap.startmain, cmap.endmain)],
+                [offset for cmap in core_mapping
+                 for offset in (cmap.startoffset, cmap.endoffset)])
+
             mutations = []
-            for variant, cmap in zip(variants, core_mapping):
+            for i, (variant, cmap) in enumerate(zip(variants, core_mapping)):
                 try:
                     f_change = _construct_change(variant)
                     r_change = _construct_change(variant, reverse=True)
@@ -787,8 +805,7 @@ class Converter(object) :
                                              "ENOTIMPLEMENTEDERROR", unicode(e))
                     return None
 
-                startp = self.crossmap.tuple2string((cmap.startmain, cmap.startoffset))
-                endp = self.crossmap.tuple2string((cmap.endmain, cmap.endoffset))
+                startp, endp = positions[2 * i:2 * i + 2]
 
                 if strand :
                     change = f_change
@@ -866,6 +883,7 @@ def import_from_ucsc_by_gene(assembly, gene):
         session.add(mapping)
 
     session.commit()
+    mapping_index.invalidate()
 
 
 def import_from_reference(assembly, reference):
@@ -915,6 +933,7 @@ def import_from_reference(assembly, reference):
         session.add(mapping)
 
     session.commit()
+    mapping_index.invalidate()
 
 
 def import_from_mapview_file(assembly, mapview_file, group_label):
@@ -1066,6 +1085,7 @@ def import_from_mapview_file(assembly, mapview_file, group_label):
             session.add(mapping)
 
     session.commit()
+    mapping_index.invalidate()
 
 
 def import_from_lrgmap_file(assembly, lrgmap_file):
@@ -1137,3 +1157,4 @@ def import_from_lrgmap_file(assembly, lrgmap_file):
         session.add(mapping)
 
     session.commit()
+    mapping_index.invalidate()
@@ -0,0 +1,220 @@
+"""
+In-memory index of transcript mappings.
+
+Converting chromosomal positions to transcript positions needs all transcript
+mappings overlapping the position. Instead of querying the database (on the
+`TranscriptMapping.bin` column) for every position, we keep an index of all
+transcript mappings per assembly in memory. It is loaded on first use and
+contains, per chromosome, the mappings sorted by position.
+
+The indexed mappings are :class:`IndexedMapping` objects, which can be used
+in place of :class:`db.models.TranscriptMapping` objects where only their
+values are needed. Each of them holds a :class:`Crossmap.Crossmap` that is
+built only once and shared by all users, so it must not be modified.
+
+Importing transcript mappings (e.g., with `mutalyzer-admin import-mapview`)
+should call :func:`invalidate`. This drops the indices in the current process
+and increments a version number in Redis, such that other processes reload
+their indices. Other processes check this version number at most every
+`MAPPING_INDEX_CHECK_INTERVAL` seconds.
+"""
+
+
+from __future__ import unicode_literals
+
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+import threading
+import time
+
+from mutalyzer.config import settings
+from mutalyzer.db import session
+from mutalyzer.db.models import Chromosome, TranscriptMapping
+from mutalyzer import Crossmap
+from mutalyzer.redisclient import client as redis
+
+
+# Redis key for the version number of the transcript mappings.
+VERSION_KEY = 'transcript-mappings:version'
+
+# Columns loaded for each transcript mapping.
+_COLUMNS = ('id', 'chromosome_id', 'reference_type', 'accession', 'version',
+            'gene', 'transcript', 'orientation', 'start', 'stop', 'cds_start',
+            'cds_stop', 'exon_starts', 'exon_stops', 'select_transcript')
+
+
+class IndexedMapping(object):
+    """
+    Read-only copy of a transcript mapping.
+    """
+    __slots__ = _COLUMNS + ('_crossmap',)
+
+    def __init__(self, *values):
+        for column, value in zip(_COLUMNS, values):
+            setattr(self, column, value)
+        self._crossmap = None
+
+    # These only depend on the column values.
+    coding = TranscriptMapping.coding
+    cds = property(TranscriptMapping.cds.fget)
+    get_reference = TranscriptMapping.get_reference.__func__
+    reference = TranscriptMapping.reference
+
+    @property
+    def crossmap(self):
+        """
+        Crossmap for this transcript (shared, do not modify).
+        """
+        if self._crossmap is None:
+            mrna = []
+            for exon in zip(self.exon_starts, self.exon_stops):
+                mrna.extend(exon)
+            orientation = 1 if self.orientation == 'forward' else -1
+            self._crossmap = Crossmap.Crossmap(mrna, self.cds or [],
+                                               orientation)
+        return self._crossmap
+
+    def __repr__(self):
+        return '<IndexedMapping %s %s %s %d-%d>' % (
+            self.reference, self.gene, self.orientation, self.start,
+            self.stop)
+
+
+class ChromosomeIndex(object):
+    """
+    Index of the transcript mappings on one chromosome.
+    """
+    def __init__(self, mappings):
+        """
+        :arg list mappings: List of :class:`IndexedMapping` objects.
+        """
+        # Same order as used in the webservices.
+        self._mappings = sorted(mappings, key=lambda m: (
+            m.start, m.stop, m.gene, m.accession, m.version, m.transcript))
+        self._starts = [m.start for m in self._mappings]
+        self._max_length = max([m.stop - m.start for m in self._mappings]
+                               or [0])
+
+        self._genes = defaultdict(list)
+        for mapping in sorted(mappings, key=lambda m: m.id):
+            self._genes[mapping.gene].append(mapping)
+
+    def __len__(self):
+        return len(self._mappings)
+
+    def overlapping(self, start, stop):
+        """
+        Get the mappings overlapping a range.
+
+        :arg int start: Start of the range (one-based, inclusive).
+        :arg int stop: End of the range (one-based, inclusive).
+
+        :returns: Mappings ordered by position.
+        :rtype: list(IndexedMapping)
+        """
+        first = bisect_left(self._starts, start - self._max_length)
+        last = bisect_right(self._starts, stop)
+        return [m for m in self._mappings[first:last] if m.stop >= start]
+
+    def contained(self, start, stop):
+        """
+        Get the mappings contained in a range.
+
+        :arg int start: Start of the range (one-based, inclusive).
+        :arg int stop: End of the range (one-based, inclusive).
+
+        :returns: Mappings ordered by position.
+        :rtype: list(IndexedMapping)
+        """
+        first = bisect_left(self._starts, start)
+        last = bisect_right(self._starts, stop)
+        return [m for m in self._mappings[first:last] if m.stop <= stop]
+
+    def by_gene(self, gene):
+        """
+        Get the mappings for a gene.
+
+        :arg unicode gene: Gene symbol.
+
+        :returns: Mappings in the order they were imported.
+        :rtype: list(IndexedMapping)
+        """
+        return list(self._genes.get(gene, []))
+
+
+class _AssemblyIndex(object):
+    def __init__(self, assembly_id, version):
+        self.version = version
+        self.checked = time.time()
+
+        mappings = defaultdict(list)
+        query = session.query(*[getattr(TranscriptMapping, column)
+                                for column in _COLUMNS]) \
+            .join(Chromosome) \
+            .filter(Chromosome.assembly_id == assembly_id)
+        for values in query:
+            mapping = IndexedMapping(*values)
+            mappings[mapping.chromosome_id].append(mapping)
+
+        self.chromosomes = {chromosome_id: ChromosomeIndex(chromosome_mappings)
+                            for chromosome_id, chromosome_mappings
+                            in mappings.items()}
+
+
+# Loaded indices by assembly id.
+_indices = {}
+_indices_lock = threading.Lock()
+
+_empty = ChromosomeIndex([])
+
+
+def _version():
+    return int(redis.get(VERSION_KEY) or 0)
+
+
+def get_index(chromosome):
+    """
+    Get the index of transcript mappings on a chromosome.
+
+    :arg db.models.Chromosome chromosome: The chromosome.
+
+    :returns: The index.
+    :rtype: ChromosomeIndex
+    """
+    with _indices_lock:
+        index = _indices.get(chromosome.assembly_id)
+
+        if (index is not None and time.time() - index.checked >=
+                settings.MAPPING_INDEX_CHECK_INTERVAL):
+            if _version() == index.version:
+                index.checked = time.time()
+            else:
+                index = None
+
+        if index is None:
+            index = _AssemblyIndex(chromosome.assembly_id, _version())
+            _indices[chromosome.assembly_id] = index
+
+    return index.chromosomes.get(chromosome.id, _empty)
+
+
+def invalidate():
+    """
+    Drop all indices, in this process and (with some delay) in all other
+    processes. Call this after changing the transcript mappings.
+    """
+    with _indices_lock:
+        _indices.clear()
+    redis.incr(VERSION_KEY)
+
+
+def clear_indices(*args):
+    """
+    Drop all indices in this process.
+    """
+    with _indices_lock:
+        _indices.clear()
+
+
+# Indices were loaded from the previously configured database.
+settings.on_update(clear_indices, 'DATABASE_URI')
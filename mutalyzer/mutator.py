@@ -8,17 +8,21 @@ coordinates greatly simplifies combined mutations in a variant. A
 visualisation of each raw variant within a combined variant is made and
 effects on restriction sites are also analysed.
 
-The original as well as the mutated string are stored here.
+The original as well as the mutated string are stored here. The mutated
+string is represented by the list of edits on the original string, so only
+the parts that are actually read are ever copied.
 """
 
 
 from __future__ import unicode_literals
 
+from bisect import bisect_right
 from collections import defaultdict
 
 from Bio import Restriction
 
 from mutalyzer import util
+from mutalyzer.sequence import EditedSequence
 
 
 # Length of the flanking sequences used in the visualisation of mutations.
@@ -36,11 +40,12 @@ class Mutator():
     """
     Mutate a string and register all shift points. For each mutation a
     visualisation is made (on genomic level) and the addition or deletion
-    of restriction sites is detected. Output for each raw variant is stored
-    in the output object as 'visualisation', 'deletedRestrictionSites' and
-    'addedRestrictionSites' respectively.
+    of restriction sites is detected (both can be disabled). Output for each
+    raw variant is stored in the output object as 'visualisation',
+    'deletedRestrictionSites' and 'addedRestrictionSites' respectively.
     """
-    def __init__(self, orig, output):
+    def __init__(self, orig, output, visualisation=True,
+                 restriction_sites=True):
         """
         Initialise the instance with the original sequence.
 
@@ -48,17 +53,28 @@ class Mutator():
         @type orig: Bio.Seq.Seq
         @arg output: The output object.
         @type output: mutalyzer.Output.Output
+        @arg visualisation: Whether or not to visualise each mutation.
+        @type visualisation: bool
+        @arg restriction_sites: Whether or not to analyse the effect of each
+            mutation on restriction sites.
+        @type restriction_sites: bool
         """
         self._shifts = defaultdict(int)
+        self._shift_index = None
         self._removed_sites = set()
         self._restriction_batch = Restriction.RestrictionBatch([], ['N'])
 
         self._output = output
+        self._visualisation = visualisation
+        self._restriction_sites = restriction_sites
         self.orig = orig
 
         # Note that we don't need to create a copy here, since mutation
         # operations are not in place (`self._mutate`).
         self.mutated = orig
+
+        # Interbase ranges in the original string that were mutated.
+        self.mutated_ranges = []
     #__init__
 
     def _restriction_count(self, sequence):
@@ -100,10 +116,34 @@ class Mutator():
         return diff
     #_counts_diff
 
+    def _flanks(self, pos1, pos2):
+        """
+        Get the flanking sequences of the given indel in the original and in
+        the mutated string.
+
+        @arg pos1: First interbase position of the deleted sequence.
+        @type pos1: int
+        @arg pos2: Second interbase position of the deleted sequence.
+        @type pos2: int
+
+        @return: Left and right flank in the original string and left and
+            right flank in the mutated string.
+        @rtype: tuple
+        """
+        loflank = self.orig[max(pos1 - VIS_FLANK_LENGTH, 0):pos1]
+        roflank = self.orig[pos2:pos2 + VIS_FLANK_LENGTH]
+
+        bp1 = self.shift(pos1)
+        bp2 = self.shift(pos2)
+        lmflank = self.mutated[max(bp1 - VIS_FLANK_LENGTH, 0):bp1]
+        rmflank = self.mutated[bp2:bp2 + VIS_FLANK_LENGTH]
+
+        return loflank, roflank, lmflank, rmflank
+    #_flanks
+
     def _visualise(self, pos1, pos2, ins):
         """
-        Create visualisation and do a restriction site analysis on the given
-        indel.
+        Create visualisation of the given indel.
 
         @arg pos1: First interbase position of the deleted sequence.
         @type pos1: int
@@ -115,17 +155,11 @@ class Mutator():
         @return: Visualisation.
         @rtype: unicode
         """
-        loflank = self.orig[max(pos1 - VIS_FLANK_LENGTH, 0):pos1]
-        roflank = self.orig[pos2:pos2 + VIS_FLANK_LENGTH]
+        loflank, roflank, lmflank, rmflank = self._flanks(pos1, pos2)
         delPart = self.orig[pos1:pos2]
         odel = util.visualise_sequence(delPart, VIS_MAX_LENGTH,
                                        VIS_CLIP_FLANK_LENGTH)
 
-        bp1 = self.shift(pos1)
-        bp2 = self.shift(pos2)
-        lmflank = self.mutated[max(bp1 - VIS_FLANK_LENGTH, 0):bp1]
-        rmflank = self.mutated[bp2:bp2 + VIS_FLANK_LENGTH]
-
         insvis = util.visualise_sequence(ins, VIS_MAX_LENGTH,
                                          VIS_CLIP_FLANK_LENGTH)
         fill = abs(len(odel) - len(insvis))
@@ -136,17 +170,52 @@ class Mutator():
             visualisation = ['%s %s%s %s' % (loflank, odel, '-' * fill, roflank),
                              '%s %s %s' % (lmflank, insvis, rmflank)]
 
-        # Todo: This part is for restriction site analysis. It doesn't really
-        #     belong in this method, but since it uses many variables computed
-        #     for the visualisation, we leave it here for the moment.
+        return visualisation
+    #_visualise
+
+    def _analyse_restriction_sites(self, pos1, pos2, ins):
+        """
+        Do a restriction site analysis on the given indel.
+
+        @arg pos1: First interbase position of the deleted sequence.
+        @type pos1: int
+        @arg pos2: Second interbase position of the deleted sequence.
+        @type pos2: int
+        @arg ins: Inserted sequence.
+        @type ins: unicode
+        """
+        loflank, roflank, lmflank, rmflank = self._flanks(pos1, pos2)
+        delPart = self.orig[pos1:pos2]
+
         counts1 = self._restriction_count(loflank + delPart + roflank)
         counts2 = self._restriction_count(lmflank + ins + rmflank)
         self._output.addOutput('restrictionSites',
                                [self._counts_diff(counts2, counts1),
                                 self._counts_diff(counts1, counts2)])
+    #_analyse_restriction_sites
 
-        return visualisation
-    #_visualise
+    def _report(self, title, pos1, pos2, ins):
+        """
+        Add the visualisation and the restriction site analysis of the given
+        indel to the output object (if enabled).
+
+        @arg title: Title of the visualisation.
+        @type title: unicode
+        @arg pos1: First interbase position of the deleted sequence.
+        @type pos1: int
+        @arg pos2: Second interbase position of the deleted sequence.
+        @type pos2: int
+        @arg ins: Inserted sequence.
+        @type ins: unicode
+        """
+        if self._visualisation:
+            visualisation = [title]
+            visualisation.extend(self._visualise(pos1, pos2, ins))
+            self._output.addOutput('visualisation', visualisation)
+
+        if self._restriction_sites:
+            self._analyse_restriction_sites(pos1, pos2, ins)
+    #_report
 
     def _add_shift(self, position, shift):
         """
@@ -158,6 +227,7 @@ class Mutator():
         @type shift: int
         """
         self._shifts[position] += shift
+        self._shift_index = None
     #_add_shift
 
     def _shift_minus_at(self, position):
@@ -172,7 +242,7 @@ class Mutator():
             given position, False otherwise.
         @rtype: bool
         """
-        return self._shifts[position] < 0
+        return self._shifts.get(position, 0) < 0
     #_shift_minus_at
 
     def shift_at(self, position):
@@ -185,7 +255,17 @@ class Mutator():
         @return: Shift for the given position.
         @rtype: int
         """
-        return sum(s for p, s in self._shifts.items() if p <= position)
+        # The shift index is a sorted list of shift positions with the
+        # cumulative shift up to and including each position.
+        if self._shift_index is None:
+            positions = sorted(self._shifts)
+            sums = [0]
+            for p in positions:
+                sums.append(sums[-1] + self._shifts[p])
+            self._shift_index = positions, sums
+
+        positions, sums = self._shift_index
+        return sums[bisect_right(positions, position)]
     #shift_at
 
     def shift(self, position):
@@ -341,12 +421,18 @@ class Mutator():
         @arg ins: Inserted sequence.
         @type ins: unicode
         """
+        # The mutated string may have been replaced by an ordinary sequence
+        # (e.g., by a protein sequence).
+        if not isinstance(self.mutated, EditedSequence):
+            self.mutated = EditedSequence(self.mutated)
+
         correct = 1 if pos1 == pos2 else 0
-        self.mutated = (self.mutated[:self.shift(pos1 + 1) - 1] +
-                        ins +
-                        self.mutated[self.shift(pos2 + correct) - correct:])
+        self.mutated = self.mutated.replace(
+            self.shift(pos1 + 1) - 1, self.shift(pos2 + correct) - correct,
+            ins)
 
         self._add_shift(pos2 + 1, pos1 - pos2 + len(ins))
+        self.mutated_ranges.append((pos1, pos2))
     #_mutate
 
     def deletion(self, pos1, pos2):
@@ -359,12 +445,11 @@ class Mutator():
         @type pos2: int
         """
         if pos1 == pos2:
-            visualisation = ['deletion of %i' % pos1]
+            title = 'deletion of %i' % pos1
         else:
-            visualisation = ['deletion of %i to %i' % (pos1, pos2)]
+            title = 'deletion of %i to %i' % (pos1, pos2)
 
-        visualisation.extend(self._visualise(pos1 - 1, pos2, ''))
-        self._output.addOutput('visualisation', visualisation)
+        self._report(title, pos1 - 1, pos2, '')
 
         self._mutate(pos1 - 1, pos2, '')
     #deletion
@@ -378,9 +463,8 @@ class Mutator():
         @arg ins: Inserted sequence.
         @type ins: unicode
         """
-        visualisation = ['insertion between %i and %i' % (pos, pos + 1)]
-        visualisation.extend(self._visualise(pos, pos, ins))
-        self._output.addOutput('visualisation', visualisation)
+        self._report('insertion between %i and %i' % (pos, pos + 1),
+                     pos, pos, ins)
 
         self._mutate(pos, pos, ins)
     #insertion
@@ -397,9 +481,8 @@ class Mutator():
         @arg ins: Inserted sequence.
         @type ins: unicode
         """
-        visualisation = ['delins from %i to %i' % (pos1, pos2)]
-        visualisation.extend(self._visualise(pos1 - 1, pos2, ins))
-        self._output.addOutput('visualisation', visualisation)
+        self._report('delins from %i to %i' % (pos1, pos2),
+                     pos1 - 1, pos2, ins)
 
         self._mutate(pos1 - 1, pos2, ins)
     #delins
@@ -413,9 +496,7 @@ class Mutator():
         @arg nuc: Substituted nucleotide.
         @type nuc: unicode
         """
-        visualisation = ['substitution at %i' % pos]
-        visualisation.extend(self._visualise(pos - 1, pos, nuc))
-        self._output.addOutput('visualisation', visualisation)
+        self._report('substitution at %i' % pos, pos - 1, pos, nuc)
 
         self._mutate(pos - 1, pos, nuc)
     #substitution
@@ -431,9 +512,8 @@ class Mutator():
         """
         sequence = util.reverse_complement(unicode(self.orig[pos1 - 1:pos2]))
 
-        visualisation = ['inversion between %i and %i' % (pos1, pos2)]
-        visualisation.extend(self._visualise(pos1 - 1, pos2, sequence))
-        self._output.addOutput('visualisation', visualisation)
+        self._report('inversion between %i and %i' % (pos1, pos2),
+                     pos1 - 1, pos2, sequence)
 
         self._mutate(pos1 - 1, pos2, sequence)
     #inversion
@@ -449,9 +529,8 @@ class Mutator():
         """
         sequence = unicode(self.orig[pos1 - 1:pos2])
 
-        visualisation = ['duplication from %i to %i' % (pos1, pos2)]
-        visualisation.extend(self._visualise(pos2, pos2, sequence))
-        self._output.addOutput('visualisation', visualisation)
+        self._report('duplication from %i to %i' % (pos1, pos2),
+                     pos2, pos2, sequence)
 
         self._mutate(pos1 - 1, pos1 - 1, sequence)
     #duplication
@@ -1,14 +1,21 @@
+from collections import OrderedDict
 from datetime import datetime
 
-import mmap
 import os
+from StringIO import StringIO
+from Bio import SeqIO
 from Bio.Seq import Seq
+from Bio.SeqFeature import (AfterPosition, BeforePosition, CompoundLocation,
+                            FeatureLocation, SeqFeature)
+from Bio.SeqRecord import SeqRecord
 from Bio.Alphabet import generic_dna
 from mutalyzer.GenRecord import PList, Locus, Gene, Record
 from mutalyzer.dbgb.models import Transcript, Reference
+from mutalyzer.sequence import open_sequence
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 
 from mutalyzer.config import settings
+from mutalyzer import lookup_cache
 
 
 def get_chromosome_ids(transcript_id):
@@ -180,6 +187,232 @@ def cds_position_list(mrna_position_list, cds_location):
     return ret
 
 
+def slice_genbank(accno, start, stop, orientation):
+    """
+    Create a GenBank file for a slice of a chromosome from the gbparser
+    database and the sequence store, as an alternative to slicing by the
+    NCBI with Entrez efetch.
+
+    The file contains the sequence of the slice and the gene, transcript and
+    CDS features of the transcripts overlapping the slice. Like in the files
+    sliced by the NCBI, features that are not completely in the slice are
+    clipped to the slice and get partial locations.
+
+    :param accno: The accession number (including version) of the
+        chromosome.
+    :param start: Start position of the slice (one-based, inclusive, in
+        reference orientation).
+    :param stop: End position of the slice (one-based, inclusive, in
+        reference orientation).
+    :param orientation: Orientation of the slice: 1 for forward, 2 for
+        reverse complement.
+    :return: The GenBank file (UTF-8 encoded), or None if the chromosome is
+        not available locally.
+    """
+    if (not settings.get('DATABASE_GB_URI') or not settings.get('SEQ_PATH') or
+            not os.path.isdir(settings.SEQ_PATH)):
+        return None
+
+    accession, version = get_accession_version(accno)
+    if version is None:
+        return None
+
+    reference = _get_reference(accession, version)
+    if reference is None or not 1 <= start <= stop <= reference.length:
+        return None
+
+    seq_path = settings.SEQ_PATH + reference.checksum_sequence + '.sequence'
+    try:
+        sequence = open_sequence(seq_path, reference.length, generic_dna)
+    except IOError:
+        return None
+
+    sequence = sequence[start - 1:stop]
+    if orientation == 2:
+        sequence = sequence.reverse_complement()
+
+    def location(parts, strand, partial_start=False, partial_stop=False):
+        # Feature location on the slice from chromosomal positions (one-based,
+        # inclusive), with the parts in transcription order.
+        if orientation == 2:
+            parts = [(stop - part_stop, stop - part_start + 1)
+                     for part_start, part_stop in parts]
+            strand = -strand
+            partial_start, partial_stop = partial_stop, partial_start
+        else:
+            parts = [(part_start - start, part_stop - start + 1)
+                     for part_start, part_stop in parts]
+        parts.sort(reverse=strand == -1)
+
+        locations = [FeatureLocation(part_start, part_stop, strand)
+                     for part_start, part_stop in parts]
+        if partial_start:
+            first = min(locations, key=lambda l: l.start)
+            locations[locations.index(first)] = FeatureLocation(
+                BeforePosition(first.start), first.end, strand)
+        if partial_stop:
+            last = max(locations, key=lambda l: l.end)
+            locations[locations.index(last)] = FeatureLocation(
+                last.start, AfterPosition(last.end), strand)
+
+        if len(locations) == 1:
+            return locations[0]
+        return CompoundLocation(locations)
+
+    source_qualifiers = OrderedDict([('organism', ['Homo sapiens']),
+                                     ('mol_type', [reference.mol_type])])
+    if reference.transl_table == '2':
+        # Vertebrate mitochondrial code.
+        source_qualifiers['organelle'] = ['mitochondrion']
+    features = [SeqFeature(FeatureLocation(0, stop - start + 1, 1),
+                           type='source', qualifiers=source_qualifiers)]
+
+    transcripts = Transcript.query \
+        .filter_by(reference_id=reference.id) \
+        .filter(Transcript.transcript_start <= stop,
+                Transcript.transcript_stop >= start) \
+        .order_by(Transcript.transcript_start, Transcript.id) \
+        .all()
+
+    genes = []
+    gene_transcripts = {}
+    for transcript in transcripts:
+        if transcript.gene not in gene_transcripts:
+            genes.append(transcript.gene)
+            gene_transcripts[transcript.gene] = []
+        gene_transcripts[transcript.gene].append(transcript)
+
+    for gene in genes:
+        strand = -1 if gene_transcripts[gene][0].strand == '-' else 1
+        gene_start = min(t.transcript_start for t in gene_transcripts[gene])
+        gene_stop = max(t.transcript_stop for t in gene_transcripts[gene])
+        features.append(SeqFeature(
+            location([(max(gene_start, start), min(gene_stop, stop))],
+                     strand, partial_start=gene_start < start,
+                     partial_stop=gene_stop > stop),
+            type='gene', qualifiers=OrderedDict([('gene', [gene])])))
+
+        for transcript in gene_transcripts[gene]:
+            features.extend(_slice_transcript_features(
+                transcript, strand, reference.transl_table, start, stop,
+                location))
+
+    annotations = {'accessions': [accession],
+                   'sequence_version': int(version),
+                   'organism': 'Homo sapiens',
+                   'source': 'Homo sapiens (human)',
+                   'topology': 'linear',
+                   'data_file_division': 'CON'}
+    if reference.date_annotation:
+        annotations['date'] = reference.date_annotation
+    record = SeqRecord(sequence, id=accno, name=accession,
+                       description='Homo sapiens slice of %s' % accno,
+                       annotations=annotations, features=features)
+
+    handle = StringIO()
+    SeqIO.write(record, handle, 'genbank')
+
+    # BioPython writes only the accession number on the ACCESSION line, but
+    # we also want the region like in the files sliced by the NCBI.
+    region = '%d..%d' % (start, stop)
+    if orientation == 2:
+        region = 'complement(%s)' % region
+    return handle.getvalue().replace(
+        '\nACCESSION   %s\n' % accession,
+        '\nACCESSION   %s REGION: %s\n' % (accession, region),
+        1).encode('utf-8')
+
+
+def _clip(parts, start, stop):
+    """
+    Clip parts in chromosomal positions to a slice.
+
+    :param parts: List of tuples of start and stop positions (one-based,
+        inclusive).
+    :param start: Start position of the slice.
+    :param stop: End position of the slice.
+    :return: The clipped parts overlapping the slice, and the number of
+        positions clipped before and after the slice.
+    """
+    clipped = [(max(part_start, start), min(part_stop, stop))
+               for part_start, part_stop in parts
+               if part_start <= stop and part_stop >= start]
+    before = sum(min(part_stop, start - 1) - part_start + 1
+                 for part_start, part_stop in parts if part_start < start)
+    after = sum(part_stop - max(part_start, stop + 1) + 1
+                for part_start, part_stop in parts if part_stop > stop)
+    return clipped, before, after
+
+
+def _slice_transcript_features(transcript, strand, transl_table, start, stop,
+                               location):
+    """
+    Create the transcript and CDS features for a transcript on a slice.
+
+    :param transcript: A gbparser database transcript entry.
+    :param strand: Strand of the transcript on the chromosome.
+    :param transl_table: Genetic code table of the chromosome.
+    :param start: Start position of the slice.
+    :param stop: End position of the slice.
+    :param location: Function creating feature locations on the slice from
+        chromosomal positions (see `slice_genbank`).
+    :return: The features.
+    """
+    if transcript.exons_start and transcript.exons_stop:
+        exons = zip(map(int, transcript.exons_start.split(',')),
+                    map(int, transcript.exons_stop.split(',')))
+    else:
+        exons = [(transcript.transcript_start, transcript.transcript_stop)]
+
+    exons_clipped, before, after = _clip(exons, start, stop)
+    if not exons_clipped:
+        # Only an intron of the transcript overlaps the slice.
+        return []
+
+    qualifiers = OrderedDict([('gene', [transcript.gene])])
+    if transcript.transcript_product:
+        qualifiers['product'] = [transcript.transcript_product]
+    qualifiers['transcript_id'] = ['%s.%s' % (transcript.transcript_accession,
+                                              transcript.transcript_version)]
+    if transcript.locus_tag:
+        qualifiers['locus_tag'] = [transcript.locus_tag]
+    features = [SeqFeature(location(exons_clipped, strand,
+                                    partial_start=before > 0,
+                                    partial_stop=after > 0),
+                           type=transcript.feature_type or 'mRNA',
+                           qualifiers=qualifiers)]
+
+    if transcript.protein_accession and transcript.protein_version:
+        cds, before, after = _clip(
+            _clip(exons, transcript.cds_start, transcript.cds_stop)[0],
+            start, stop)
+
+        # If the start of the CDS is clipped, the reading frame on the slice
+        # shifts by the number of clipped positions.
+        codon_start = int(transcript.codon_start or '1')
+        clipped = before if strand == 1 else after
+        codon_start = (codon_start - 1 - clipped) % 3 + 1
+
+        qualifiers = OrderedDict([
+            ('gene', [transcript.gene]),
+            ('codon_start', [unicode(codon_start)])])
+        if transcript.protein_product:
+            qualifiers['product'] = [transcript.protein_product]
+        qualifiers['protein_id'] = ['%s.%s' % (transcript.protein_accession,
+                                               transcript.protein_version)]
+        if transcript.locus_tag:
+            qualifiers['locus_tag'] = [transcript.locus_tag]
+        if transl_table and transl_table != '1':
+            qualifiers['transl_table'] = [transl_table]
+        if cds:
+            features.append(SeqFeature(location(cds, strand,
+                                                partial_start=before > 0,
+                                                partial_stop=after > 0),
+                                       type='CDS', qualifiers=qualifiers))
+
+    return features
+
+
 def _bare_record(reference):
     record = Record()
     # Populating the record with the generic information.
@@ -322,8 +555,7 @@ def _get_mutalyzer_record(reference, db_transcripts):
     # Get the sequence.
     seq_path = settings.SEQ_PATH + reference.checksum_sequence + '.sequence'
     try:
-        seq = Seq(_get_sequence_mmap(seq_path, 1, reference.length + 1),
-                  generic_dna)
+        seq = open_sequence(seq_path, reference.length, generic_dna)
     except IOError:
         return None
     else:
@@ -468,14 +700,7 @@ def _get_versions(accession):
     :param accession: The accession for which to look for the versions.
     :return: List with the versions for the provided accession.
     """
-    references = Reference.query.\
-        filter_by(accession=str(accession))\
-        .order_by(Reference.id.asc()) \
-        .all()
-    versions = []
-    for reference in references:
-        versions.append(reference.version)
-    return versions
+    return lookup_cache.get_nc_versions(accession)
 
 
 def _get_transcripts(reference, position_start, position_end):
@@ -512,16 +737,3 @@ def _get_transcripts(reference, position_start, position_end):
 
     return transcripts
 
-
-def _get_sequence_mmap(file_path, start, end):
-    """
-    Sequence retrieval.
-    :param file_path: Path towards the sequence file.
-    :param start: Start position.
-    :param end: End position
-    :return: The sequence.
-    """
-    with open(file_path, "r+b") as f:
-        # memory-map the file, size 0 means whole file
-        mm = mmap.mmap(f.fileno(), 0)
-        return mm[start - 1:end]
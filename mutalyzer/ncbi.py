@@ -4,10 +4,14 @@ Communication with the NCBI.
 
 
 import httplib
-from xml.dom import minidom
-from xml.parsers import expat
+import io
+import json
+import threading
+import time
 
 from Bio import Entrez
+from lxml import etree
+import requests
 
 from .config import settings
 from .redisclient import client as redis
@@ -37,6 +41,103 @@ class ServiceError(Exception):
     pass
 
 
+# Timeout in seconds for requests to the Entrez service.
+ENTREZ_TIMEOUT = 60
+
+_session = None
+_session_lock = threading.Lock()
+
+_last_request = 0
+_last_request_lock = threading.Lock()
+
+
+def _entrez_session():
+    """
+    HTTP session for requests to the Entrez service, shared by all threads.
+    Connections in the session are kept alive and reused.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=10)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+def rate_limit():
+    """
+    Wait until the next request to the Entrez service can be sent.
+
+    The NCBI allows three requests per second (ten per second if an API key
+    is configured). Call this before each request, it is safe to use from
+    multiple threads.
+    """
+    global _last_request
+
+    if hasattr(settings, 'ENTREZ_API_KEY'):
+        delay = 0.1
+    else:
+        delay = 1 / 3.0
+
+    with _last_request_lock:
+        wait = _last_request + delay - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        _last_request = time.time()
+
+
+def _entrez(utility, **parameters):
+    """
+    Call an Entrez utility and parse the resulting XML document.
+
+    Requests are sent to the Entrez service at `ENTREZ_URL` over a pooled
+    HTTP session and are subject to :func:`rate_limit`.
+
+    :arg str utility: Name of the utility (e.g., ``esearch``).
+    :arg parameters: Parameters for the utility. For list values, the
+      parameter is repeated for each item.
+
+    :raises ServiceError: On error in Entrez communication.
+
+    :returns: Root element of the resulting XML document.
+    :rtype: lxml.etree._Element
+    """
+    parameters.update(tool='mutalyzer', email=settings.EMAIL)
+    if hasattr(settings, 'ENTREZ_API_KEY'):
+        parameters['api_key'] = settings.ENTREZ_API_KEY
+
+    rate_limit()
+    try:
+        response = _entrez_session().post(
+            '%s/%s.fcgi' % (settings.ENTREZ_URL, utility), data=parameters,
+            timeout=ENTREZ_TIMEOUT)
+        response.raise_for_status()
+        return etree.fromstring(response.content)
+    except (requests.RequestException, etree.XMLSyntaxError):
+        # TODO: Log error.
+        raise ServiceError()
+
+
+def _get_accession_versions(db, gis):
+    """
+    Get the accession numbers of records in an NCBI database.
+
+    :arg str db: NCBI database.
+    :arg list gis: Record GI numbers.
+
+    :raises ServiceError: On error in Entrez communication.
+
+    :returns: Accession number with version per GI number.
+    :rtype: dict(str, str)
+    """
+    result = _entrez('esummary', db=db, id=','.join(gis))
+    return {unicode(docsum.findtext('Id')):
+            unicode(docsum.findtext('Item[@Name="AccessionVersion"]'))
+            for docsum in result.iterfind('DocSum')}
+
+
 def _get_link_from_ncbi(source_db, target_db, match_link_name,
                         source_accession, source_version=None,
                         match_version=True):
@@ -199,41 +300,45 @@ def _get_link_from_cache(forward_key, reverse_key, source_accession,
     raise NoLinkError()
 
 
-def _cache_negative_link(forward_key, source_accession, source_version=None,
-                         match_version=True):
+def _cache_negative_link(pipe, forward_key, source_accession,
+                         source_version=None, match_version=True):
     """
     Store a negative transcript-protein link (a "no link found" result) in the
     cache.
 
     The cache value for a negative link is the empty string and expires in
     `NEGATIVE_LINK_CACHE_EXPIRATION` seconds.
+
+    :arg pipe: Redis pipeline to add the commands to.
     """
     if source_version is not None:
         # Store a negative forward link with version.
-        redis.setex(forward_key %
-                    ('%s.%d' % (source_accession, source_version)),
-                    settings.NEGATIVE_LINK_CACHE_EXPIRATION, '')
+        pipe.setex(forward_key %
+                   ('%s.%d' % (source_accession, source_version)),
+                   settings.NEGATIVE_LINK_CACHE_EXPIRATION, '')
     if source_version is None or not match_version:
         # Store a negative forward link without version.
-        redis.setex(forward_key % source_accession,
-                    settings.NEGATIVE_LINK_CACHE_EXPIRATION, '')
+        pipe.setex(forward_key % source_accession,
+                   settings.NEGATIVE_LINK_CACHE_EXPIRATION, '')
 
 
-def _cache_link(forward_key, reverse_key, source_accession, target_accession,
-                source_version=None, target_version=None):
+def _cache_link(pipe, forward_key, reverse_key, source_accession,
+                target_accession, source_version=None, target_version=None):
     """
     Store a transcript-protein link in the cache.
+
+    :arg pipe: Redis pipeline to add the commands to.
     """
     # Store the link without version in both directions.
-    redis.set(forward_key % source_accession, target_accession)
-    redis.set(reverse_key % target_accession, source_accession)
+    pipe.set(forward_key % source_accession, target_accession)
+    pipe.set(reverse_key % target_accession, source_accession)
 
     if source_version is not None and target_version is not None:
         # Store the link with version in both directions.
-        redis.set(forward_key % ('%s.%d' % (source_accession, source_version)),
-                  '%s.%d' % (target_accession, target_version))
-        redis.set(reverse_key % ('%s.%d' % (target_accession, target_version)),
-                  '%s.%d' % (source_accession, source_version))
+        pipe.set(forward_key % ('%s.%d' % (source_accession, source_version)),
+                 '%s.%d' % (target_accession, target_version))
+        pipe.set(reverse_key % ('%s.%d' % (target_accession, target_version)),
+                 '%s.%d' % (source_accession, source_version))
 
 
 def _get_link(forward_key, reverse_key, source_db, target_db, match_link_name,
@@ -261,18 +366,199 @@ def _get_link(forward_key, reverse_key, source_db, target_db, match_link_name,
     except NoLinkError:
         # No link found, store this negative result in the cache and re-raise
         # the exception.
+        pipe = redis.pipeline(transaction=False)
         _cache_negative_link(
-            forward_key, source_accession, source_version=source_version,
-            match_version=match_version)
+            pipe, forward_key, source_accession,
+            source_version=source_version, match_version=match_version)
+        pipe.execute()
         raise
 
     # Store the link in the cache and return the target value.
+    pipe = redis.pipeline(transaction=False)
     _cache_link(
-        forward_key, reverse_key, source_accession, target_accession,
+        pipe, forward_key, reverse_key, source_accession, target_accession,
         source_version=source_version, target_version=target_version)
+    pipe.execute()
     return target_accession, target_version
 
 
+def _get_links_from_ncbi(source_db, target_db, match_link_name, sources):
+    """
+    Retrieve linked accession numbers from the NCBI for a number of sources
+    at once.
+
+    Contrary to :func:`_get_link_from_ncbi`, which needs three requests to
+    the Entrez service per source, this needs at most four requests in
+    total.
+
+    :arg str source_db: NCBI source database.
+    :arg str target_db: NCBI target database.
+    :arg function match_link_name: For each link found, this function is
+      called with the link name (`str`) and it should return `True` iff the
+      link is to be used.
+    :arg list sources: Accession numbers for which we want to find a link
+      (with or without version number).
+
+    :raises ServiceError: On error in Entrez communication.
+
+    :returns: Target accession number with version for each source that has
+      a link.
+    :rtype: dict(str, str)
+    """
+    # Find source records. A source without version may match several
+    # records, in which case we use the one with the highest version.
+    result = _entrez('esearch', db=source_db, term=' OR '.join(sources),
+                     retmax=10 * len(sources))
+    gis = [unicode(gi.text) for gi in result.iterfind('IdList/Id')]
+    if not gis:
+        return {}
+
+    source_gis = {}
+    sources = set(sources)
+    for gi, accession_version in _get_accession_versions(
+            source_db, gis).items():
+        accession, _, version = accession_version.partition('.')
+        version = int(version) if version.isdigit() else 0
+        if accession_version in sources:
+            source_gis[accession_version] = gi, version
+        if accession in sources and version >= source_gis.get(
+                accession, (None, -1))[1]:
+            source_gis[accession] = gi, version
+    if not source_gis:
+        return {}
+
+    # Find links from source records to target records. The source GI
+    # numbers are passed as separate `id` parameters, which gives one
+    # linkset per source record.
+    result = _entrez('elink', dbfrom=source_db, db=target_db,
+                     id=sorted(set(gi for gi, _ in source_gis.values())))
+    target_gis = {}
+    for linkset in result.iterfind('LinkSet'):
+        for link in linkset.iterfind('LinkSetDb'):
+            if match_link_name(unicode(link.findtext('LinkName'))):
+                target_gis[unicode(linkset.findtext('IdList/Id'))] = \
+                    unicode(link.findtext('Link/Id'))
+                break
+    if not target_gis:
+        return {}
+
+    # Get target records.
+    targets = _get_accession_versions(target_db,
+                                      sorted(set(target_gis.values())))
+
+    return {source: targets[target_gis[gi]]
+            for source, (gi, _) in source_gis.items()
+            if target_gis.get(gi) in targets}
+
+
+def _get_links(forward_key, reverse_key, source_db, target_db,
+               match_link_name, sources, match_version=True):
+    """
+    Like :func:`_get_link`, but for a number of sources at once.
+
+    All sources are looked up in the cache in one pipeline, sources not in
+    the cache are queried at the NCBI using :func:`_get_links_from_ncbi`,
+    and the results are stored in the cache in one pipeline.
+
+    Negative results due to an error in Entrez communication are not cached.
+
+    :arg list sources: List of `(source_accession, source_version)` tuples,
+      where `source_version` can be `None`.
+
+    :returns: For each source, a tuple of `(target_accession,
+      target_version)` representing the link target, or `None` if no link
+      could be found.
+    :rtype: dict(tuple(str, int), tuple(str, int))
+    """
+    sources = list(set(sources))
+    links = {}
+
+    def versioned(accession, version):
+        if version is None:
+            return accession
+        return '%s.%d' % (accession, version)
+
+    # Query cache for links with and without version.
+    pipe = redis.pipeline(transaction=False)
+    for accession, version in sources:
+        pipe.get(forward_key % versioned(accession, version))
+        pipe.get(forward_key % accession)
+    values = pipe.execute()
+
+    uncached = []
+    for source, with_version, without_version in zip(sources, values[::2],
+                                                     values[1::2]):
+        if source[1] is not None and with_version is not None:
+            if with_version:
+                target_accession, target_version = with_version.split('.')
+                links[source] = target_accession, int(target_version)
+            else:
+                links[source] = None
+        elif ((source[1] is None or not match_version) and
+              without_version is not None):
+            links[source] = (without_version, None) if without_version \
+                            else None
+        else:
+            uncached.append(source)
+
+    if not uncached:
+        return links
+
+    # Query NCBI service, first with version (if we have it). If we are not
+    # strictly matching on version, we try again without version.
+    found = []
+    try:
+        targets = _get_links_from_ncbi(
+            source_db, target_db, match_link_name,
+            list(set(versioned(*source) for source in uncached)))
+        retry = []
+        for accession, version in uncached:
+            target = targets.get(versioned(accession, version))
+            if target is not None:
+                target_accession, _, target_version = target.partition('.')
+                if version is not None:
+                    target_version = int(target_version)
+                else:
+                    target_version = None
+                links[accession, version] = target_accession, target_version
+                found.append((accession, version))
+            elif version is not None and not match_version:
+                retry.append((accession, version))
+            else:
+                links[accession, version] = None
+                found.append((accession, version))
+
+        if retry:
+            targets = _get_links_from_ncbi(
+                source_db, target_db, match_link_name,
+                list(set(accession for accession, _ in retry)))
+            for accession, version in retry:
+                target = targets.get(accession)
+                if target is not None:
+                    links[accession, version] = target.split('.')[0], None
+                else:
+                    links[accession, version] = None
+                found.append((accession, version))
+    except ServiceError:
+        for source in uncached:
+            links.setdefault(source, None)
+
+    # Store the results in the cache.
+    pipe = redis.pipeline(transaction=False)
+    for source in found:
+        if links[source] is None:
+            _cache_negative_link(
+                pipe, forward_key, source[0], source_version=source[1],
+                match_version=match_version)
+        else:
+            _cache_link(
+                pipe, forward_key, reverse_key, source[0], links[source][0],
+                source_version=source[1], target_version=links[source][1])
+    pipe.execute()
+
+    return links
+
+
 def transcript_to_protein(transcript_accession, transcript_version=None,
                           match_version=True):
     """
@@ -337,6 +623,39 @@ def protein_to_transcript(protein_accession, protein_version=None,
         match_version=match_version)
 
 
+def transcripts_to_proteins(transcripts, match_version=True):
+    """
+    Try to find the proteins linked to a number of transcripts.
+
+    This is like calling :func:`transcript_to_protein` for each transcript,
+    but links that are not in the cache are retrieved from the NCBI for all
+    transcripts together.
+
+    :arg list transcripts: List of `(transcript_accession,
+      transcript_version)` tuples, where `transcript_version` can be `None`.
+    :arg bool match_version: If `False`, the links do not have to match
+      `transcript_version`.
+
+    :returns: For each transcript, a tuple of `(protein_accession,
+      protein_version)` representing the linked protein, or `None` if no
+      link could be found. If `transcript_version` is not specified or
+      `match_version` is `False`, `protein_version` can be `None`.
+    :rtype: dict(tuple(str, int), tuple(str, int))
+    """
+    return _get_links(
+        'ncbi:transcript-to-protein:%s', 'ncbi:protein-to-transcript:%s',
+        'nucleotide', 'protein',
+        lambda link: link in ('nuccore_protein', 'nuccore_protein_cds'),
+        transcripts, match_version=match_version)
+
+
+# Maximum number of rs# per Entrez request in :func:`cache_rsids`.
+SNP_BATCH_SIZE = 200
+
+# Cache key format string for the HGVS descriptions of an rs#.
+_SNP_KEY = 'ncbi:rsid-to-descriptions:%s'
+
+
 def _get_snp_from_ncbi(rsid):
     """
     Connects to the Entrez DB to fetch the annotated SNP records.
@@ -349,6 +668,7 @@ def _get_snp_from_ncbi(rsid):
         Entrez.api_key = settings.ENTREZ_API_KEY
 
     try:
+        rate_limit()
         response = Entrez.efetch(db='snp', id=rsid[2:], retmode='xml')
     except (IOError, httplib.HTTPException):
         # TODO: Log error.
@@ -363,10 +683,108 @@ def _get_snp_from_ncbi(rsid):
     return response_text
 
 
+def _iter_snp_docsums(handle):
+    """
+    Parse dbSNP records in the Entrez docsum format.
+
+    The document is parsed incrementally and each record is discarded after
+    it is parsed, so memory use does not depend on the number of records.
+
+    :arg file handle: Open handle to the document.
+
+    :raises lxml.etree.XMLSyntaxError: If the document is not valid XML.
+
+    :returns: Generator yielding tuples of the record rs# number (without
+      the `rs` prefix) and the value of its DOCSUM field (`None` if it is
+      missing or empty).
+    :rtype: generator(tuple(str, str))
+    """
+    docsum = None
+    for _, element in etree.iterparse(handle):
+        tag = etree.QName(element).localname
+        if tag == 'DOCSUM':
+            docsum = unicode(element.text) if element.text else None
+        elif tag == 'DocumentSummary':
+            yield element.get('uid'), docsum
+            docsum = None
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+
+def _docsum_descriptions(docsum):
+    """
+    Get the HGVS descriptions from the DOCSUM field of a dbSNP record.
+    """
+    for part in docsum.split('|'):
+        if part.startswith('HGVS='):
+            return part.split('=')[1].split(',')
+    return []
+
+
+def cache_rsids(rsids):
+    """
+    Retrieve the HGVS descriptions for a number of dbSNP rs# in bulk and
+    store them in the cache, such that :func:`rsid_to_descriptions` does not
+    have to contact the NCBI for them.
+
+    Records are retrieved with one Entrez request per `SNP_BATCH_SIZE` rs#
+    and cached for `SNP_CACHE_EXPIRATION` seconds. Invalid and already cached
+    rs# are skipped. Records that are not found and errors in Entrez
+    communication are not cached, :func:`rsid_to_descriptions` will retry
+    and report them.
+
+    :arg list rsids: The rs# of the dbSNP records (e.g., `rs9919552`).
+
+    :returns: Number of cached records.
+    :rtype: int
+    """
+    rsids = sorted(set(rsid for rsid in rsids
+                       if rsid.startswith('rs') and rsid[2:].isdigit()))
+
+    pipe = redis.pipeline(transaction=False)
+    for rsid in rsids:
+        pipe.exists(_SNP_KEY % rsid)
+    rsids = [rsid for rsid, cached in zip(rsids, pipe.execute())
+             if not cached]
+
+    Entrez.email = settings.EMAIL
+    if hasattr(settings, 'ENTREZ_API_KEY'):
+        Entrez.api_key = settings.ENTREZ_API_KEY
+
+    count = 0
+    for start in range(0, len(rsids), SNP_BATCH_SIZE):
+        ids = set(rsid[2:] for rsid in rsids[start:start + SNP_BATCH_SIZE])
+
+        pipe = redis.pipeline(transaction=False)
+        try:
+            rate_limit()
+            response = Entrez.efetch(db='snp', id=','.join(sorted(ids)),
+                                     retmode='xml')
+            try:
+                for uid, docsum in _iter_snp_docsums(response):
+                    if uid in ids and docsum is not None:
+                        pipe.setex(_SNP_KEY % ('rs' + uid),
+                                   settings.SNP_CACHE_EXPIRATION,
+                                   json.dumps(_docsum_descriptions(docsum)))
+                        count += 1
+            finally:
+                response.close()
+        except (IOError, httplib.HTTPException, etree.XMLSyntaxError):
+            # TODO: Log error.
+            pass
+        pipe.execute()
+
+    return count
+
+
 def rsid_to_descriptions(rsid, output):
     """
     Return all annotated HGVS descriptions for a given dbSNP rs#.
 
+    Results are cached for `SNP_CACHE_EXPIRATION` seconds (see also
+    :func:`cache_rsids`).
+
     :arg str rsid: The rs# of the dbSNP record (e.g., `rs9919552`).
 
     :raises ServiceError: On error in Entrez communication.
@@ -381,6 +799,15 @@ def rsid_to_descriptions(rsid, output):
                           'Incorrect RSID input format.')
         return []
 
+    cached = redis.get(_SNP_KEY % rsid)
+    if cached == '':
+        output.addMessage(__file__, 2, 'EENTREZ',
+                          'Non existing %s in the DB or no root element.'
+                          % rsid)
+        return []
+    if cached is not None:
+        return json.loads(cached)
+
     # Get the NCBI Entrez DB response.
     try:
         response_text = _get_snp_from_ncbi(rsid)
@@ -397,20 +824,22 @@ def rsid_to_descriptions(rsid, output):
 
     try:
         # Parse the output.
-        doc = minidom.parseString(response_text)
-        docsum = doc.getElementsByTagName('DOCSUM')[0].childNodes[0].data
-    except expat.ExpatError:
+        docsum = next((docsum for _, docsum in
+                       _iter_snp_docsums(io.BytesIO(response_text))), None)
+    except etree.XMLSyntaxError:
         # TODO: Log error.
         raise ServiceError()
-    except IndexError:
+
+    if docsum is None:
         # The expected root element is not present, this has also been
         # observed as a response for non-existing rs#.
         output.addMessage(__file__, 2, 'EENTREZ',
                           'Non existing %s in the DB or no root element.'
                           % rsid)
+        redis.setex(_SNP_KEY % rsid, settings.SNP_CACHE_EXPIRATION, '')
         return []
 
-    for part in docsum.split('|'):
-        if part.startswith('HGVS='):
-            return part.split('=')[1].split(',')
-    return []
+    descriptions = _docsum_descriptions(docsum)
+    redis.setex(_SNP_KEY % rsid, settings.SNP_CACHE_EXPIRATION,
+                json.dumps(descriptions))
+    return descriptions
@@ -6,7 +6,8 @@ retrieved at a later time to provide flexibility. Message levels are
 defined to increase or decrease the amount of logging and ouput.
 
 The position of the log file, as well as the levels are defined in the
-configuration file.
+configuration file. Log messages are written by the process-wide log sink
+(see the :mod:`mutalyzer.log` module).
 
 Message levels:
   - -1 : Log     ; Specifically log a message.
@@ -25,9 +26,9 @@ Public classes:
 
 from __future__ import unicode_literals
 
-import io
-import time
+import uuid
 
+from mutalyzer import log
 from mutalyzer import util
 from mutalyzer.config import settings
 
@@ -40,10 +41,13 @@ class Output() :
         - _outputdata ; The output dictionary.
         - _messages   ; The messages list.
         - _instance   ; The name of the module that made this object.
-        - _loghandle  ; The handle of the log file.
         - _errors     ; The number of errors that have been processed.
         - _warnings   ; The number of warnings that have been processed.
 
+    Public variables:
+        - request_id ; Identifier of this object in structured log
+                       messages.
+
     Special methods:
         - __init__(instance) ; Initialise the class with the calling
                                module.
@@ -68,8 +72,6 @@ class Output() :
             - _messages   ; The messages list.
             - _instance   ; Initialised with the name of the module that
                              created this object.
-            - _loghandle  ; Initialised as the handle of the log file
-                             defined in the configuration file.
             - _errors     ; Initialised to 0.
             - _warnings   ; Initialised to 0.
 
@@ -79,8 +81,7 @@ class Output() :
         self._outputData = {}
         self._messages = []
         self._instance = util.nice_filename(instance)
-        self._loghandle = io.open(settings.LOG_FILE, mode='a+',
-                                  encoding='utf-8')
+        self.request_id = uuid.uuid4().hex
         self._errors = 0
         self._warnings = 0
     #__init__
@@ -96,7 +97,6 @@ class Output() :
         Private variables:
             - _messages  ; The messages list.
             - _instance  ; Module that created the Output object.
-            - _loghandle ; Handle to the log file.
 
         Private variables (altered):
             - _warnings ; Increased by one if the severity equals 2.
@@ -121,11 +121,9 @@ class Output() :
         # Log the message if the message is important enough, or if it is only
         # meant to be logged (level -1).
         if level >= settings.LOG_LEVEL or level == -1 :
-            self._loghandle.write(time.strftime(
-                settings.LOG_TIME_FORMAT + ' ') + "%s (%s) %s: %s: %s\n" % (
-                    self._instance, nice_name, code, message.named_level(),
-                    description))
-            self._loghandle.flush()
+            log.sink.emit(request=self.request_id, instance=self._instance,
+                          origin=nice_name, code=code,
+                          level=message.named_level(), message=description)
         #if
     #addMessage
 
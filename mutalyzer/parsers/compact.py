@@ -0,0 +1,217 @@
+"""
+Module for reading and writing parsed GenRecord.Record objects in a compact
+binary format.
+
+Parsing a GenBank file is expensive, so we store the result of the parser
+next to the GenBank file in the cache. This compact record file contains the
+gene/transcript/exon/CDS structure as derived by the GenBank parser
+(including the transcript-protein links) and the sequence as raw bytes.
+
+The file layout is as follows:
+
+1. The magic string ``MUTREC02`` (8 bytes).
+2. The length of the header (unsigned 64-bit integer, little endian).
+3. The header, a JSON document with the serialized record structure and the
+   offset and length of the sequence.
+4. Padding up to the sequence offset, which is aligned at a memory page
+   boundary.
+5. The sequence (ASCII encoded).
+
+Since the sequence is stored as raw bytes, the file can be memory mapped
+directly (with :func:`sequence.open_sequence`) and reading a record costs
+only reading the header.
+
+The header also contains the checksum of the GenBank file the record was
+created from, such that a stale compact record (e.g., after the GenBank file
+was updated) is never used.
+"""
+
+
+from __future__ import unicode_literals
+
+import importlib
+import json
+import mmap
+import os
+import struct
+
+from Bio.Seq import Seq
+
+from ..GenRecord import PList, Locus, Gene, Record
+from ..sequence import open_sequence
+
+
+#: Magic string identifying (the version of) the file format.
+MAGIC = b'MUTREC02'
+
+#: Struct for the length of the header.
+HEADER_LENGTH = struct.Struct(b'<Q')
+
+# Classes that can be serialized (by name).
+_CLASSES = {cls.__name__: cls for cls in (PList, Locus, Gene, Record)}
+
+
+def _serialize(value):
+    """
+    Serialize a value from a record structure into something that can be
+    represented in JSON.
+    """
+    if isinstance(value, (PList, Locus, Gene, Record)):
+        return {'class': value.__class__.__name__,
+                'attributes': {key: _serialize(attribute)
+                               for key, attribute in vars(value).items()
+                               if key not in ('seq', '_cds_translatable')}}
+    if isinstance(value, tuple):
+        return {'tuple': [_serialize(item) for item in value]}
+    if isinstance(value, list):
+        return [_serialize(item) for item in value]
+    if value is None or isinstance(value, (bool, int, long, float, unicode)):
+        return value
+    if isinstance(value, str):
+        return unicode(value)
+    raise ValueError('Cannot serialize value of type {}'.format(
+        type(value).__name__))
+
+
+def _deserialize(value):
+    """
+    Inverse of :func:`_serialize`.
+    """
+    if isinstance(value, dict):
+        if 'tuple' in value:
+            return tuple(_deserialize(item) for item in value['tuple'])
+        instance = _CLASSES[value['class']].__new__(_CLASSES[value['class']])
+        instance.__dict__.update(
+            (key, _deserialize(attribute))
+            for key, attribute in value['attributes'].items())
+        return instance
+    if isinstance(value, list):
+        return [_deserialize(item) for item in value]
+    return value
+
+
+def _alphabet_to_name(alphabet):
+    return '{}.{}'.format(alphabet.__class__.__module__,
+                          alphabet.__class__.__name__)
+
+
+def _name_to_alphabet(name):
+    module, cls = name.rsplit('.', 1)
+    return getattr(importlib.import_module(module), cls)()
+
+
+def write_record(record, filename, checksum):
+    """
+    Write a record to a compact record file.
+
+    The file is written to a temporary file first and then renamed, so
+    readers never see a partially written file.
+
+    :arg GenRecord.Record record: The record to write.
+    :arg unicode filename: The full path to the compact record file.
+    :arg unicode checksum: Checksum of the file the record was created from.
+    """
+    sequence = unicode(record.seq).encode('ascii')
+
+    header = {'checksum': checksum,
+              'alphabet': _alphabet_to_name(record.seq.alphabet),
+              'record': _serialize(record),
+              'sequence_length': len(sequence)}
+
+    # The sequence offset depends on the header length, which depends on the
+    # sequence offset. We just reserve enough space for it.
+    header['sequence_offset'] = 0
+    length = len(MAGIC) + HEADER_LENGTH.size + \
+        len(json.dumps(header, separators=(',', ':'))) + 20
+    header['sequence_offset'] = \
+        (length // mmap.ALLOCATIONGRANULARITY + 1) * mmap.ALLOCATIONGRANULARITY
+
+    serialized_header = json.dumps(header, separators=(',', ':')).encode(
+        'utf-8')
+
+    temporary_filename = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(temporary_filename, 'wb') as handle:
+        handle.write(MAGIC)
+        handle.write(HEADER_LENGTH.pack(len(serialized_header)))
+        handle.write(serialized_header)
+        handle.seek(header['sequence_offset'])
+        handle.write(sequence)
+    os.rename(temporary_filename, filename)
+
+
+def read_header(handle):
+    """
+    Read the header from an open compact record file.
+
+    :arg file handle: Open readable handle to a compact record file.
+
+    :raises ValueError: If the file is not a valid compact record file.
+
+    :returns: The header.
+    :rtype: dict
+    """
+    if handle.read(len(MAGIC)) != MAGIC:
+        raise ValueError('Not a compact record file')
+    try:
+        length, = HEADER_LENGTH.unpack(handle.read(HEADER_LENGTH.size))
+    except struct.error:
+        raise ValueError('Not a compact record file')
+    return json.loads(handle.read(length).decode('utf-8'))
+
+
+def record_checksum(filename):
+    """
+    Get the checksum of the file a compact record file was created from.
+
+    :arg unicode filename: The full path to the compact record file.
+
+    :returns: The checksum or `None` if the file does not exist or is not
+      valid.
+    :rtype: unicode
+    """
+    try:
+        with open(filename, 'rb') as handle:
+            return read_header(handle)['checksum']
+    except (EnvironmentError, ValueError, KeyError):
+        return None
+
+
+def create_record(filename, checksum=None):
+    """
+    Create a GenRecord.Record from a compact record file.
+
+    :arg unicode filename: The full path to the compact record file.
+    :arg unicode checksum: If not `None`, the record is only returned if it
+      was created from a file with this checksum.
+
+    :returns: A GenRecord.Record instance or `None` if the file does not
+      exist, is not valid, or is stale.
+    :rtype: object (record)
+    """
+    try:
+        with open(filename, 'rb') as handle:
+            header = read_header(handle)
+
+            if checksum is not None and header['checksum'] != checksum:
+                return None
+
+            record = _deserialize(header['record'])
+            alphabet = _name_to_alphabet(header['alphabet'])
+
+            if header['sequence_length']:
+                # The mapping of the file is shared by all records loaded
+                # from it and is closed by `sequence.close_sequences`. It
+                # stays valid after the file is replaced or removed.
+                record.seq = open_sequence(
+                    filename, header['sequence_length'], alphabet,
+                    offset=header['sequence_offset'], handle=handle)
+                if len(record.seq) != header['sequence_length']:
+                    return None
+            else:
+                record.seq = Seq('', alphabet)
+    except (EnvironmentError, ValueError, KeyError, AttributeError,
+            ImportError):
+        # Missing or invalid file, we just pretend it is not there.
+        return None
+
+    return record
@@ -8,19 +8,30 @@ from __future__ import unicode_literals
 
 import codecs
 import re
-import bz2
 from itertools import izip_longest
 
-from Bio import SeqIO
 from Bio.Alphabet import ProteinAlphabet
 
+from .. import compression
 from .. import ncbi
 from ..GenRecord import PList, Locus, Gene, Record
+from .genbank_reader import read_record
 
 
 # Regular expression used to find version number in locus tag
 LOCUS_TAG_VERSION = re.compile('\d{1,3}$')
 
+# Qualifiers used for transcript and protein features.
+LOCUS_QUALIFIERS = ('gene', 'locus_tag', 'transcript_id', 'protein_id',
+                    'product', 'transl_table')
+
+# Features we read from the GenBank file with their qualifiers (`None` for
+# all qualifiers), all other features and qualifiers are skipped.
+FEATURES = dict({'source': None, 'gene': ('gene',), 'exon': ('gene',)},
+                **{feature_type: LOCUS_QUALIFIERS
+                   for feature_type in ('mRNA', 'misc_RNA', 'ncRNA', 'rRNA',
+                                        'tRNA', 'tmRNA', 'CDS')})
+
 
 class tempGene():
     """
@@ -209,7 +220,6 @@ class GBparser():
         @type locusList: list
         """
 
-        productList = []
         for i in locusList :
             # Transfer some variables from the dictionary to the locus object.
             self.__tagByDict(i, "locus_tag")
@@ -218,6 +228,16 @@ class GBparser():
             self.__tagByDict(i, "gene")
             self.__tagByDict(i, "product")
 
+        # Retrieve the protein links for all transcripts at once. We ignore
+        # the version.
+        transcripts = [i.transcript_id.split('.')
+                       for i in locusList if i.transcript_id]
+        links = ncbi.transcripts_to_proteins(
+            [(accession, int(version)) for accession, version in transcripts],
+            match_version=False)
+
+        productList = []
+        for i in locusList :
             # Gather the product tags.
             productList.append(i.product)
 
@@ -229,12 +249,9 @@ class GBparser():
             #if
             else :                # Tag an mRNA with the protein id too.
                 accession, version = i.transcript_id.split('.')
-                try:
-                    # We ignore the version.
-                    i.proteinLink = ncbi.transcript_to_protein(
-                        accession, int(version), match_version=False)[0]
-                except ncbi.NoLinkError:
-                    pass
+                link = links[accession, int(version)]
+                if link is not None:
+                    i.proteinLink = link[0]
             i.original_location = i.location
             if i.ref:
                 # This is a workaround for a bug in BioPython.
@@ -458,12 +475,27 @@ class GBparser():
         @return: A GenRecord.Record instance
         @rtype: object (record)
         """
-        # first create an intermediate genbank record with BioPython
-        file_handle = bz2.BZ2File(filename, "r")
+        # first create an intermediate genbank record with only the features
+        # we use
+        file_handle = compression.open_file(filename)
         file_handle = codecs.getreader('utf-8')(file_handle)
-        biorecord = SeqIO.read(file_handle, "genbank")
+        biorecord = read_record(file_handle, FEATURES)
         file_handle.close()
 
+        return self.create_record_from_biorecord(biorecord)
+    #create_record
+
+    def create_record_from_biorecord(self, biorecord):
+        """
+        Create a GenRecord.Record from a BioPython record
+
+        @arg biorecord: A BioPython record as read by
+            genbank_reader.read_record with FEATURES
+        @type biorecord: object (Bio.SeqRecord.SeqRecord)
+
+        @return: A GenRecord.Record instance
+        @rtype: object (record)
+        """
         record = Record()
         record.seq = biorecord.seq
 
@@ -685,5 +717,5 @@ class GBparser():
         record.geneList = [gene for gene in record.geneList
                            if gene.transcriptList]
         return record
-    #create_record
+    #create_record_from_biorecord
 #GBparser
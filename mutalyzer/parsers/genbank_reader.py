@@ -0,0 +1,143 @@
+"""
+Streaming reader for GenBank files.
+
+Reading a GenBank file with `Bio.SeqIO` creates feature objects for all
+features and qualifiers in the file, and collects the sequence as a list of
+lines before joining them. For large references (e.g., UD slices of a
+chromosome) this uses a lot of memory, while the GenBank parser only uses a
+few feature types and qualifiers.
+
+The reader in this module uses the BioPython GenBank scanner, but skips all
+features and qualifiers that are not asked for while scanning the feature
+table and reads the sequence into a compact bytes buffer. The result is a
+`Bio.SeqRecord.SeqRecord` that is identical to what `Bio.SeqIO.read` returns,
+except for the skipped features and qualifiers.
+"""
+
+
+from __future__ import unicode_literals
+
+import warnings
+
+from Bio import BiopythonParserWarning
+from Bio.GenBank import _FeatureConsumer
+from Bio.GenBank.Scanner import GenBankScanner
+from Bio.GenBank.utils import FeatureValueCleaner
+
+
+class _Scanner(GenBankScanner):
+    """
+    GenBank scanner skipping features and qualifiers and reading the sequence
+    into a bytes buffer.
+    """
+    def __init__(self, features):
+        GenBankScanner.__init__(self)
+        self._features = features
+
+    def parse_feature(self, feature_key, lines):
+        # Skipped features are not parsed at all, `parse_features` drops
+        # them.
+        if feature_key not in self._features:
+            return None
+
+        feature_key, location, qualifiers = GenBankScanner.parse_feature(
+            self, feature_key, lines)
+
+        keep = self._features[feature_key]
+        if keep is not None:
+            qualifiers = [(key, value) for key, value in qualifiers
+                          if key in keep]
+        return feature_key, location, qualifiers
+
+    def parse_features(self, skip=False):
+        return [feature for feature in
+                GenBankScanner.parse_features(self, skip=skip)
+                if feature is not None]
+
+    def parse_footer(self):
+        # Same as `GenBankScanner.parse_footer`, but the sequence is upper
+        # cased per line and collected in a bytearray.
+        if self.line[:self.HEADER_WIDTH].rstrip() not in \
+                self.SEQUENCE_HEADERS:
+            raise ValueError("Footer format unexpected:  '%s'" % self.line)
+
+        misc_lines = []
+        while (self.line[:self.HEADER_WIDTH].rstrip() in self.SEQUENCE_HEADERS
+               or self.line[:self.HEADER_WIDTH] == ' ' * self.HEADER_WIDTH
+               or self.line[:3] == 'WGS'):
+            misc_lines.append(self.line.rstrip())
+            self.line = self.handle.readline()
+            if not self.line:
+                raise ValueError('Premature end of file')
+
+        if self.line[:self.HEADER_WIDTH].rstrip() in self.SEQUENCE_HEADERS:
+            raise ValueError("Eh? '%s'" % self.line)
+
+        sequence = bytearray()
+        line = self.line
+        while True:
+            if not line:
+                warnings.warn('Premature end of file in sequence data',
+                              BiopythonParserWarning)
+                line = '//'
+                break
+            line = line.rstrip()
+            if not line:
+                warnings.warn('Blank line in sequence data',
+                              BiopythonParserWarning)
+                line = self.handle.readline()
+                continue
+            if line == '//' or line.startswith('CONTIG'):
+                break
+            if len(line) > 9 and line[9:10] != ' ':
+                # Sequence indented by one space too many.
+                warnings.warn('Invalid indentation for sequence line',
+                              BiopythonParserWarning)
+                line = line[1:]
+                if len(line) > 9 and line[9:10] != ' ':
+                    raise ValueError("Sequence line mal-formed, '%s'" % line)
+            sequence.extend(
+                line[10:].replace(' ', '').upper().encode('ascii'))
+            line = self.handle.readline()
+
+        self.line = line
+        return misc_lines, sequence.decode('ascii')
+
+
+class _Consumer(_FeatureConsumer):
+    """
+    GenBank consumer for the already upper cased sequence from
+    :class:`_Scanner`.
+    """
+    def sequence(self, content):
+        self._seq_data.append(content)
+
+
+def read_record(handle, features):
+    """
+    Read a GenBank record, only including the given features.
+
+    :arg file handle: Open readable handle (yielding unicode strings) to a
+      GenBank file containing exactly one record.
+    :arg dict features: Dictionary with the types of the features to include
+      as keys and their qualifiers to include as values (a collection of
+      qualifier names, or `None` for all qualifiers).
+
+    :raises ValueError: If the file does not contain exactly one valid
+      GenBank record.
+
+    :returns: The record with the given features.
+    :rtype: Bio.SeqRecord.SeqRecord
+    """
+    scanner = _Scanner(features)
+    consumer = _Consumer(use_fuzziness=1,
+                         feature_cleaner=FeatureValueCleaner())
+
+    if not scanner.feed(handle, consumer):
+        raise ValueError('No records found in handle')
+    if consumer.data.id is None:
+        raise ValueError("Failed to parse the record's ID. Invalid ID line?")
+    if scanner.find_start():
+        raise ValueError('More than one record found in handle')
+
+    return consumer.data
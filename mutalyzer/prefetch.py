@@ -0,0 +1,159 @@
+"""
+Prefetching of reference sequences for batch jobs.
+
+The batch checker processes the entries of a name checker job one by one,
+retrieving reference sequences that are not in the cache as it goes. To not
+have the batch checker wait for these downloads, the batch processor
+retrieves the reference sequences of a job in the background as soon as it
+starts processing the job (see :class:`Prefetcher`). This is done
+concurrently by `BATCH_PREFETCH_THREADS` threads, which also parse the
+descriptions of the job to find its reference sequences.
+
+Prefetching is a best-effort optimization. Errors are ignored here, the
+batch checker will try again and report them.
+"""
+
+
+from __future__ import unicode_literals
+
+from multiprocessing.pool import ThreadPool
+import threading
+
+from mutalyzer.config import settings
+from mutalyzer.db import session
+from mutalyzer.grammar import Grammar
+from mutalyzer.output import Output
+from mutalyzer import Retriever
+from mutalyzer import util
+
+
+def job_references(descriptions):
+    """
+    Get the reference sequences used in a list of variant descriptions.
+
+    Chromosomal reference sequences are skipped (we expect them in the
+    gbparser database), as are descriptions that cannot be parsed.
+
+    :arg list descriptions: Variant descriptions.
+
+    :returns: Distinct reference sequences as `(filetype, record_id)` tuples,
+      where `filetype` is either ``LRG`` or ``GB``.
+    :rtype: list(tuple(unicode, unicode))
+    """
+    # We parse only the first description for each reference.
+    first = {}
+    for description in descriptions:
+        first.setdefault(util.description_reference(description), description)
+
+    grammar = Grammar(Output(__file__))
+    references = set()
+
+    for description in first.values():
+        parsed_description = grammar.parse(description)
+        if not parsed_description:
+            continue
+
+        if parsed_description.LrgAcc:
+            references.add(('LRG', parsed_description.LrgAcc))
+        elif (parsed_description.RefSeqAcc and
+              not parsed_description.RefSeqAcc.isdigit()):
+            record_id = parsed_description.RefSeqAcc
+            if parsed_description.Version:
+                record_id += '.' + parsed_description.Version
+            if 'NC' not in record_id:
+                references.add(('GB', record_id))
+
+    return sorted(references)
+
+
+def _retrieve(reference):
+    # Retrieve one reference sequence, runs in a worker thread.
+    filetype, record_id = reference
+    output = Output(__file__)
+    if filetype == 'LRG':
+        retriever = Retriever.LRGRetriever(output)
+    else:
+        retriever = Retriever.GenBankRetriever(output)
+
+    try:
+        return retriever.retrieverecord(record_id) is not None
+    except Exception:
+        return False
+    finally:
+        session.remove()
+
+
+class Prefetcher(object):
+    """
+    Retrieve reference sequences in the background, using one pool of
+    `BATCH_PREFETCH_THREADS` threads.
+
+    Call :meth:`stop` (or :meth:`join`) when done, such that no reference
+    sequences are being retrieved when the process exits.
+    """
+    def __init__(self):
+        self._pool = ThreadPool(settings.BATCH_PREFETCH_THREADS)
+        self._stopped = threading.Event()
+        self._jobs = []
+        self._queued = set()
+        self._queued_lock = threading.Lock()
+
+    def add_job(self, descriptions):
+        """
+        Retrieve the reference sequences used in a list of variant
+        descriptions in the background (see :func:`job_references`).
+
+        :arg list descriptions: Variant descriptions.
+        """
+        self._jobs.append(
+            self._pool.apply_async(self._add_job, (descriptions,)))
+
+    def _add_job(self, descriptions):
+        if not self._stopped.is_set():
+            self.add(job_references(descriptions))
+
+    def add(self, references):
+        """
+        Retrieve reference sequences that are not in the cache in the
+        background. Reference sequences that are already waiting to be
+        retrieved are skipped.
+
+        :arg list references: Reference sequences as `(filetype, record_id)`
+          tuples (see :func:`job_references`).
+        """
+        for reference in references:
+            with self._queued_lock:
+                if reference in self._queued:
+                    continue
+                self._queued.add(reference)
+            self._pool.apply_async(self._retrieve, (reference,))
+
+    def _retrieve(self, reference):
+        try:
+            if not self._stopped.is_set():
+                _retrieve(reference)
+        finally:
+            # A failed retrieval is tried again if the reference sequence is
+            # added again.
+            with self._queued_lock:
+                self._queued.discard(reference)
+
+    def join(self):
+        """
+        Wait until all added jobs and reference sequences are retrieved. No
+        jobs or reference sequences can be added after this.
+        """
+        # Jobs add their reference sequences to the pool, so wait for them
+        # before closing it.
+        for job in self._jobs:
+            job.wait()
+        self._pool.close()
+        self._pool.join()
+
+    def stop(self):
+        """
+        Stop retrieving reference sequences. Retrievals in progress are
+        finished, other added reference sequences are skipped.
+        """
+        self._stopped.set()
+        self.join()
@@ -0,0 +1,162 @@
+"""
+In-process cache of parsed reference records.
+
+Parsing a GenBank file into a :class:`GenRecord.Record` is expensive, while
+batch jobs and webservice clients tend to check many variants on the same few
+references. We therefore keep a bounded least recently used cache of parsed
+records per process.
+
+Entries are keyed by accession number and validated against the checksum of
+the reference file as stored in the database (`Reference.checksum`), so a
+changed reference file is never served from the cache.
+
+Callers always get a deep copy of the cached record, since the record is
+enriched (and thereby modified) during variant checking. A stored record is
+not copied, the cache takes it over from the caller. Copies share the
+reference sequence with the cached record (see
+:meth:`GenRecord.Record.__deepcopy__`), so they are cheap.
+
+The cache is bounded by the number of records (`RECORD_CACHE_SIZE`) and by
+the total length of the cached sequences (`RECORD_CACHE_MAX_BASES`), the
+latter being a reasonable approximation of memory usage. Setting either of
+these to `0` disables the cache.
+"""
+
+
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import copy
+import threading
+
+from mutalyzer.config import settings
+from mutalyzer import stats
+
+
+class RecordCache(object):
+    """
+    Least recently used cache of parsed records, validated by checksum.
+    """
+    def __init__(self):
+        self._records = OrderedDict()
+        self._bases = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._records)
+
+    @property
+    def bases(self):
+        """
+        Total length of the cached sequences.
+        """
+        return self._bases
+
+    def _enabled(self):
+        return settings.RECORD_CACHE_SIZE > 0 and \
+            settings.RECORD_CACHE_MAX_BASES > 0
+
+    def _remove(self, accession):
+        checksum, record = self._records.pop(accession)
+        self._bases -= len(record.seq)
+
+    def get(self, accession, checksum):
+        """
+        Get a copy of the cached record for `accession`, or `None` if it is
+        not in the cache or if the cached record does not match `checksum`.
+
+        :arg unicode accession: Accession number of the record.
+        :arg unicode checksum: Current checksum of the reference file.
+
+        :returns: A copy of the cached record or `None`.
+        :rtype: GenRecord.Record
+        """
+        if not self._enabled():
+            return None
+
+        with self._lock:
+            try:
+                cached_checksum, record = self._records.pop(accession)
+            except KeyError:
+                record = None
+            else:
+                if cached_checksum == checksum:
+                    # Re-insert to mark as most recently used.
+                    self._records[accession] = cached_checksum, record
+                else:
+                    # Stale entry, the reference file has changed.
+                    self._bases -= len(record.seq)
+                    record = None
+
+        if record is None:
+            stats.increment_counter('record-cache/miss')
+            return None
+
+        stats.increment_counter('record-cache/hit')
+        return copy.deepcopy(record)
+
+    def set(self, accession, checksum, record):
+        """
+        Store `record` in the cache for `accession` with the given reference
+        file `checksum`. Least recently used records are evicted to stay
+        within the configured limits.
+
+        If the record is stored, the cache takes it over and the caller must
+        not modify it anymore (use a copy instead).
+
+        :arg unicode accession: Accession number of the record.
+        :arg unicode checksum: Current checksum of the reference file.
+        :arg GenRecord.Record record: The parsed record.
+
+        :returns: `True` if the record is stored, `False` otherwise.
+        :rtype: bool
+        """
+        if not self._enabled():
+            return False
+
+        length = len(record.seq)
+        if length > settings.RECORD_CACHE_MAX_BASES:
+            return False
+
+        with self._lock:
+            if accession in self._records:
+                self._remove(accession)
+
+            while self._records and (
+                    len(self._records) >= settings.RECORD_CACHE_SIZE or
+                    self._bases + length > settings.RECORD_CACHE_MAX_BASES):
+                self._remove(next(iter(self._records)))
+                stats.increment_counter('record-cache/eviction')
+
+            self._records[accession] = checksum, record
+            self._bases += length
+
+        return True
+
+    def invalidate(self, accession=None):
+        """
+        Remove the record for `accession` from the cache, or all records if
+        `accession` is `None`.
+        """
+        with self._lock:
+            if accession is None:
+                self._records.clear()
+                self._bases = 0
+            elif accession in self._records:
+                self._remove(accession)
+
+
+def clear_cache(*args):
+    """
+    Remove all records from the cache.
+    """
+    cache.invalidate()
+
+
+# Records were parsed from files in the cache directory, so we start afresh
+# if it is changed.
+settings.on_update(clear_cache, 'CACHE_DIR')
+
+
+#: Global :class:`RecordCache` instance.
+cache = RecordCache()
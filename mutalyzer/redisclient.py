@@ -10,11 +10,9 @@ simple and just use one global connection pool as created by `StrictRedis`.
     If the `REDIS_URI` configuration setting is `None`, we silently
     instantiate a mock interface to Redis.
 
-.. todo:: We currently use Redis for storing stat counters, but there are many
-    opportunities to use it for caching. For example, which version numbers
-    are available for a certain accession number, which is a costly operation
-    and something we implemented quite a hack for to optimize in the batch
-    name checker (the whole alter thing with batchflags).
+.. note:: Besides stat counters, Redis is used for caching. For example,
+    which version numbers are available for a certain accession number is
+    cached by :mod:`mutalyzer.lookup_cache`.
 """
 
 
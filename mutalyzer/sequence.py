@@ -0,0 +1,263 @@
+"""
+Lazy sequence types.
+
+Chromosomal reference sequences (e.g., from the NC sequence store configured
+with `SEQ_PATH`) are hundreds of megabases long, while checking a variant
+only ever looks at a small window of the sequence. Instead of reading such a
+sequence into memory, :class:`MappedSequence` memory maps the file and only
+copies the parts that are actually accessed.
+
+Each file is mapped only once per process and the mapping is shared by all
+:class:`MappedSequence` instances for that file. Sequence files are named
+after the checksum of their content and therefore never change, but should a
+file be replaced anyway, the new file is mapped on the next open.
+
+Likewise, :class:`EditedSequence` represents the result of a series of edits
+on a sequence without copying the unchanged parts.
+"""
+
+
+from __future__ import unicode_literals
+
+from bisect import bisect_right
+import mmap
+import numbers
+import os
+import threading
+
+from Bio.Alphabet import generic_dna
+from Bio.Seq import Seq
+
+
+# Shared memory maps by file path, as `(identity, mapping)` tuples where
+# `identity` is the `(device, inode)` tuple of the mapped file.
+_mappings = {}
+_mappings_lock = threading.Lock()
+
+
+class MappedSequence(Seq):
+    """
+    Read-only sequence backed by a memory mapped file.
+
+    This is a drop-in replacement for :class:`Bio.Seq.Seq`. Indexing returns
+    a single base and slicing returns an ordinary :class:`Bio.Seq.Seq`
+    containing only the requested bases. Any other operation materializes
+    the entire sequence.
+    """
+    def __init__(self, mapping, alphabet=generic_dna, start=0, stop=None):
+        """
+        :arg mmap.mmap mapping: Memory map of the sequence file.
+        :arg Bio.Alphabet.Alphabet alphabet: Sequence alphabet.
+        :arg int start: Offset of the sequence in the file.
+        :arg int stop: End of the sequence in the file (default is the end
+          of the file).
+        """
+        self._mapping = mapping
+        self._start = start
+        self._stop = len(mapping) if stop is None else min(stop, len(mapping))
+        self.alphabet = alphabet
+
+    @property
+    def _data(self):
+        # Used by all inherited `Seq` methods.
+        return self._mapping[self._start:self._stop].decode('ascii')
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, index):
+        length = self._stop - self._start
+
+        if isinstance(index, numbers.Integral):
+            if index < 0:
+                index += length
+            if not 0 <= index < length:
+                raise IndexError('sequence index out of range')
+            return self._mapping[self._start + index].decode('ascii')
+
+        start, stop, step = index.indices(length)
+        if step != 1:
+            return Seq(self._data[index], self.alphabet)
+        return Seq(self._mapping[self._start + start:
+                                 self._start + max(start, stop)]
+                   .decode('ascii'), self.alphabet)
+
+    def __repr__(self):
+        return '%s(<%d mapped bases>, %r)' % (self.__class__.__name__,
+                                              len(self), self.alphabet)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        # Immutable and the mapping is shared, so there is nothing to copy.
+        return self
+
+
+class EditedSequence(Seq):
+    """
+    Read-only sequence defined by a list of edits on a base sequence.
+
+    The sequence is stored as a list of pieces, each piece being a range in
+    either the base sequence or in an inserted sequence. Replacing a range
+    creates a new instance and costs time linear in the number of pieces,
+    but is independent of the sequence length. Like :class:`MappedSequence`,
+    indexing and slicing only touch the requested parts of the sequence.
+    """
+    def __init__(self, base, pieces=None):
+        """
+        :arg Bio.Seq.Seq base: The base sequence.
+        :arg list pieces: List of `(sequence, start, stop)` tuples (default
+          is the entire base sequence).
+        """
+        self._base = base
+        self._pieces = pieces if pieces is not None else [(base, 0, len(base))]
+        self.alphabet = base.alphabet
+
+        # Offset of each piece in the sequence.
+        self._offsets = []
+        length = 0
+        for _, start, stop in self._pieces:
+            self._offsets.append(length)
+            length += stop - start
+        self._length = length
+
+    @property
+    def _data(self):
+        # Used by all inherited `Seq` methods.
+        return ''.join(unicode(sequence[start:stop])
+                       for sequence, start, stop in self._pieces)
+
+    def _cut(self, start, stop):
+        """
+        Get the list of pieces making up the range from `start` to `stop`.
+        """
+        pieces = []
+        if start >= stop:
+            return pieces
+        i = bisect_right(self._offsets, start) - 1
+        while i < len(self._pieces) and self._offsets[i] < stop:
+            sequence, piece_start, piece_stop = self._pieces[i]
+            offset = self._offsets[i]
+            pieces.append((sequence,
+                           piece_start + max(start - offset, 0),
+                           min(piece_stop, piece_start + stop - offset)))
+            i += 1
+        return pieces
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, numbers.Integral):
+            if index < 0:
+                index += self._length
+            if not 0 <= index < self._length:
+                raise IndexError('sequence index out of range')
+            i = bisect_right(self._offsets, index) - 1
+            sequence, start, _ = self._pieces[i]
+            return sequence[start + index - self._offsets[i]]
+
+        start, stop, step = index.indices(self._length)
+        if step != 1:
+            return Seq(self._data[index], self.alphabet)
+        return Seq(''.join(unicode(sequence[piece_start:piece_stop])
+                           for sequence, piece_start, piece_stop
+                           in self._cut(start, stop)),
+                   self.alphabet)
+
+    def __repr__(self):
+        return '%s(<%d bases in %d pieces>, %r)' % (
+            self.__class__.__name__, len(self), len(self._pieces),
+            self.alphabet)
+
+    def replace(self, start, stop, insertion):
+        """
+        Replace a range by another sequence.
+
+        This is equivalent to `self[:start] + insertion + self[stop:]`,
+        including the semantics of negative and out of range positions.
+
+        :arg int start: Start of the replaced range.
+        :arg int stop: End of the replaced range.
+        :arg unicode insertion: Inserted sequence.
+
+        :returns: The edited sequence.
+        :rtype: EditedSequence
+        """
+        _, start, _ = slice(None, start).indices(self._length)
+        stop, _, _ = slice(stop, None).indices(self._length)
+
+        pieces = self._cut(0, start)
+        if insertion:
+            insertion = unicode(insertion)
+            pieces.append((insertion, 0, len(insertion)))
+        pieces.extend(self._cut(stop, self._length))
+
+        return EditedSequence(self._base, pieces)
+
+
+def open_sequence(path, length=None, alphabet=generic_dna, offset=0,
+                  handle=None):
+    """
+    Open a sequence file for lazy access.
+
+    :arg unicode path: Path to a file containing the sequence (ASCII
+      encoded).
+    :arg int length: Length of the sequence (default is up to the end of the
+      file).
+    :arg Bio.Alphabet.Alphabet alphabet: Sequence alphabet.
+    :arg int offset: Offset of the sequence in the file.
+    :arg file handle: Open handle to the file at `path`, for example to make
+      sure the sequence is read from the same file as a header that was read
+      from it (default is to open `path`).
+
+    :raises IOError: If the file cannot be opened or is empty.
+
+    :returns: The sequence.
+    :rtype: MappedSequence
+    """
+    if handle is None:
+        with open(path, 'rb') as handle:
+            mapping = _map_file(path, handle)
+    else:
+        mapping = _map_file(path, handle)
+
+    stop = None if length is None else offset + length
+    return MappedSequence(mapping, alphabet, start=offset, stop=stop)
+
+
+def _map_file(path, handle):
+    """
+    Get the shared memory map for a file.
+    """
+    status = os.fstat(handle.fileno())
+    identity = status.st_dev, status.st_ino
+
+    with _mappings_lock:
+        entry = _mappings.get(path)
+        if entry is not None and entry[0] == identity:
+            return entry[1]
+
+        try:
+            mapping = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise IOError('Cannot map empty file: %s' % path)
+        # The file descriptor can be closed, the mapping stays valid. A
+        # mapping of a replaced file is not closed here, since sequences
+        # using it may still be around, but it is no longer shared and goes
+        # away with the last of them.
+        _mappings[path] = identity, mapping
+        return mapping
+
+
+def close_sequences():
+    """
+    Close all shared memory maps.
+
+    Sequences opened before calling this function can no longer be used.
+    """
+    with _mappings_lock:
+        for _, mapping in _mappings.values():
+            mapping.close()
+        _mappings.clear()
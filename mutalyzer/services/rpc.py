@@ -19,8 +19,8 @@ from spyne.model.primitive import Integer, Boolean, DateTime, Unicode
 from spyne.model.complex import Array
 from spyne.model.fault import Fault
 import io
-import os
 import socket
+import time
 from operator import attrgetter
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql import func
@@ -30,15 +30,19 @@ import extractor
 import mutalyzer
 from mutalyzer.config import settings
 from mutalyzer.db import session
+from mutalyzer.db import queries
 from mutalyzer.db import session as sessiongb
-from mutalyzer.db.models import (Assembly, Chromosome, BatchJob,
-                                 BatchQueueItem, TranscriptMapping)
+from mutalyzer.db.models import Chromosome, BatchJob, TranscriptMapping
 from mutalyzer.output import Output
 from mutalyzer.grammar import Grammar
 from mutalyzer.sync import CacheSync
 from mutalyzer import announce
+from mutalyzer import assembly_cache
+from mutalyzer import batch_results
+from mutalyzer import mapping_index
 from mutalyzer import ncbi
 from mutalyzer import stats
+from mutalyzer import util
 from mutalyzer import variantchecker
 from mutalyzer.mapping import Converter
 from mutalyzer import File
@@ -65,6 +69,241 @@ def create_rpc_fault(output):
         return Fault('ESERVER', 'The request could not be completed')
 
 
+def _run_mutalyzer_light(variant, extras, records=None):
+    """
+    Run the Mutalyzer name checker, see MutalyzerService.runMutalyzerLight.
+
+    @arg variant: The variant description to check.
+    @type variant: string
+    @arg extras: Additional fields to be included in the response.
+    @type extras: RequestExtras
+    @arg records: Loaded records shared with other checks (see
+        variantchecker.check_variant).
+    @type records: dict
+
+    @return: Response object, see MutalyzerService.runMutalyzerLight.
+    """
+    def check_param(obj, attr=None):
+        """
+        Checks whether `attr` is present in the `obj`. Added specifically
+        for the `extras` parameter.
+        :param obj: Call parameter.
+        :param attr: Attribute to search for in obj.
+        :return:
+        """
+        if not obj:
+            return False
+        if obj and not attr:
+            return True
+        if hasattr(obj, attr) and getattr(obj, attr):
+            return True
+        else:
+            return False
+
+    def get_variant_details():
+        """
+        Extracts the variant description details from the parse tree and
+        the sequence.
+
+        Currently accepts only one variant description and three mutation
+        types ('del', 'ins', and 'subst') with their corresponding
+        locations as natural numbers only ('c.10-3_10-5del' and other
+        positions such as '*3' are not accepted). Thus, it is mainly for
+        genomic references with 'g.' coordinates and no specific annotated
+        segment.
+
+        Example of accepted variant descriptions and their output terms:
+        - input: 'NC_000014.8:g.94844865G>A'
+            - output terms:
+                - 'reference_file': 'NC_000014.8'
+                - 'start': '94844865'
+                - 'stop': '94844865'
+                - 'ref': 'G'
+                - 'alt': 'A'
+                - 'operation': 'subst'
+        - input: 'NC_000011.9:g.47353833_47353857del'
+            - output terms:
+                - 'reference_file': 'NC_000011.9'
+                - 'start': '47353833'
+                - 'stop': '47353857'
+                - 'ref': 'AGGGAAGCCATCCAGGCTGAGAGGG'
+                - 'alt': '.'
+                - 'operation': 'del'
+        - input: 'NC_000008.10:g.10480387_10480388dup'
+            - output terms:
+                - 'reference_file': 'NC_000008.10'
+                - 'start': '10480387'
+                - 'stop': '10480388'
+                - 'ref': '.'
+                - 'alt': 'GC'
+                - 'operation': 'dup'
+        - input: 'NC_000008.10:g.10480387_10480388insA'
+            - output terms:
+                - 'reference_file': 'NC_000008.10'
+                - 'start': '10480388'
+                - 'stop': '10480388'
+                - 'ref': '.'
+                - 'alt': 'A'
+                - 'operation': 'ins'
+        - input: 'NC_000014.8:g.19400000delinsGT'
+            - output terms:
+                - 'reference_file': 'NC_000014.8'
+                - 'stop': '19400000'
+                - 'start': '19400000'
+                - 'ref': 'A'
+                - 'alt': 'GT'
+                - 'operation': 'delins'
+
+        For 'del' variants the sequence is required.
+        For 'ins' and 'subst' variants the sequence is not required with
+        the 'ref' and 'alt' terms being obtained directly from the HGVS
+        description.
+        """
+        varDetails = VarDetails()
+        varDetails.info = []
+        output = Output(__file__)
+        grammar = Grammar(output)
+        if result.genomicDescription:
+            variant_tree = grammar.parse(result.genomicDescription)
+        else:
+            varDetails.info.append("No genomic description generated.")
+            return varDetails
+
+        # Only one variant accepted for the moment
+        if variant_tree and not variant_tree.SingleAlleleVarSet:
+            # Extract the only variant
+            variant = variant_tree.RawVar
+
+            # Should be NCBI and not LRG
+            if variant_tree.RefSeqAcc and variant_tree.Version:
+                record_id = variant_tree.RefSeqAcc + '.' + variant_tree.Version
+                varDetails.reference_file = record_id
+            else:
+                varDetails.info.append("Only ncbi references with accession "
+                                       "and version are accepted.")
+                return varDetails
+
+            # Extract the variant type
+            try:
+                mutation_type = variant.MutationType
+            except AttributeError:
+                varDetails.info.append("No operation (mutation) type found.")
+                return varDetails
+
+            # Extract the the positions
+            varDetails.start = varDetails.stop = variant.StartLoc.PtLoc.Main
+            if variant.EndLoc:
+                varDetails.stop = variant.EndLoc.PtLoc.Main
+            if abs(int(varDetails.stop) - int(varDetails.start)) > 524288:
+                varDetails.info.append("Too long (> 524288 bases) sequence change.")
+                return varDetails
+
+            # Extract the 'ref' and 'alt' terms
+            if mutation_type == 'subst':
+                varDetails.ref = unicode(variant.Arg1)
+                varDetails.alt = unicode(variant.Arg2)
+                varDetails.operation = 'subst'
+            elif mutation_type == 'del':
+                varDetails.ref = unicode(O.getIndexedOutput("original", 0)\
+                    [int(varDetails.start)-1:int(varDetails.stop)])
+                varDetails.alt = '.'
+                varDetails.operation = 'del'
+            elif mutation_type == 'dup':
+                varDetails.ref = '.'
+                varDetails.alt = unicode(O.getIndexedOutput("original", 0)\
+                    [int(varDetails.start)-1:int(varDetails.stop)])
+                varDetails.operation = 'dup'
+            elif mutation_type == 'ins':
+                varDetails.ref = '.'
+                varDetails.alt = unicode(variant.Seq.Sequence)
+                varDetails.operation = 'ins'
+            elif mutation_type == 'delins':
+                varDetails.ref = unicode(O.getIndexedOutput("original", 0)\
+                    [int(varDetails.start)-1:int(varDetails.stop)])
+                varDetails.alt = unicode(variant.Seq.Sequence)
+                varDetails.operation = 'delins'
+            else:
+                varDetails.info.append("Conversion not performed since "
+                                       "'%s' operation is not supported."
+                                       % mutation_type)
+                return varDetails
+        else:
+            varDetails.info.append("Conversion not performed since multiple "
+                                   "variants are present in the description.")
+            return varDetails
+
+        return varDetails
+
+    O = Output(__file__)
+    O.addMessage(__file__, -1, "INFO",
+        "Received request runMutalyzerLight(%s)" % (variant))
+
+    stats.increment_counter('name-checker/webservice')
+
+    outputs = {variantchecker.OUTPUT_LEGENDS}
+    if check_param(extras, 'original') or check_param(extras, 'varDetails'):
+        outputs.add(variantchecker.OUTPUT_ORIGINAL)
+    if check_param(extras, 'mutated'):
+        outputs.add(variantchecker.OUTPUT_MUTATED)
+    variantchecker.check_variant(variant, O, outputs=outputs,
+                                 records=records)
+
+    result = MutalyzerOutput()
+
+    result.referenceId = O.getIndexedOutput('reference_id', 0)
+    result.sourceId = O.getIndexedOutput('source_id', 0)
+    result.sourceAccession = O.getIndexedOutput('source_accession', 0)
+    result.sourceVersion = O.getIndexedOutput('source_version', 0)
+    result.molecule = O.getIndexedOutput('molecule', 0)
+
+    if check_param(extras, 'original'):
+        result.original = O.getIndexedOutput("original", 0)
+    if check_param(extras, 'mutated'):
+        result.mutated = O.getIndexedOutput("mutated", 0)
+
+    result.chromDescription = \
+        O.getIndexedOutput("genomicChromDescription", 0)
+    result.genomicDescription = \
+        O.getIndexedOutput("genomicDescription", 0)
+
+    if check_param(extras, 'varDetails'):
+        result.varDetails = get_variant_details()
+
+    result.transcriptDescriptions = O.getOutput("descriptions")
+    result.proteinDescriptions = O.getOutput("protDescriptions")
+
+    if O.getIndexedOutput('hasTranscriptInfo', 0, False):
+        result.exons = []
+        for e in O.getOutput('exonInfo'):
+            exon = ExonInfo()
+            exon.gStart, exon.gStop, exon.cStart, exon.cStop = e
+            result.exons.append(exon)
+
+    result.legend = []
+    for name, id, locusTag, product, linkMethod in O.getOutput('legends'):
+        record = LegendRecord()
+        record.name = name
+        record.id = id
+        record.locusTag = locusTag
+        record.product = product
+        record.linkMethod = linkMethod
+        result.legend.append(record)
+
+    result.errors, result.warnings, result.summary = O.Summary()
+
+    O.addMessage(__file__, -1, "INFO",
+        "Finished processing runMutalyzerLight(%s)" % (variant))
+
+    result.messages = []
+    for message in O.getMessages():
+        soap_message = SoapMessage()
+        soap_message.errorcode = message.code
+        soap_message.message = message.description
+        result.messages.append(soap_message)
+
+    return result
+
+
 class MutalyzerService(ServiceBase):
     """
     Mutalyzer web services.
@@ -177,7 +416,10 @@ class MutalyzerService(ServiceBase):
 
         @return: Number of entries left.
         """
-        return BatchQueueItem.query.join(BatchJob).filter_by(result_id=job_id).count()
+        batch_job = BatchJob.query.filter_by(result_id=job_id).first()
+        if batch_job is None:
+            return 0
+        return queries.count_batch_queue_items(batch_job)
 
     @srpc(Mandatory.Unicode, _returns=ByteArray)
     def getBatchJob(job_id):
@@ -196,14 +438,12 @@ class MutalyzerService(ServiceBase):
 
         @return: Batch job result file (UTF-8, base64 encoded).
         """
-        left = BatchQueueItem.query.join(BatchJob).filter_by(result_id=job_id).count()
-
-        if left > 0:
+        # Claimed items are no longer in the queue, so the job is only done
+        # when the job itself is removed.
+        if BatchJob.query.filter_by(result_id=job_id).count() > 0:
             raise Fault('EBATCHNOTREADY', 'Batch job result is not yet ready.')
 
-        filename = 'batch-job-%s.txt' % job_id
-        handle = open(os.path.join(settings.CACHE_DIR, filename), 'rb')
-        return handle
+        return batch_results.open_result(job_id)
 
     @srpc(Mandatory.Unicode, Mandatory.Unicode, Mandatory.Integer, Boolean,
         _returns=Array(Mandatory.Unicode))
@@ -236,7 +476,7 @@ class MutalyzerService(ServiceBase):
             pos, versions))
 
         try:
-            assembly = Assembly.by_name_or_alias(build)
+            assembly = assembly_cache.get_assembly(build)
         except NoResultFound:
             L.addMessage(__file__, 4, "EARG", "EARG %s" % build)
             raise Fault("EARG",
@@ -244,25 +484,14 @@ class MutalyzerService(ServiceBase):
                             "build name." % build)
 
         try:
-            chromosome = assembly.chromosomes.filter_by(name=chrom).one()
+            chromosome = assembly_cache.get_chromosome(assembly, chrom)
         except NoResultFound:
             L.addMessage(__file__, 4, "EARG", "EARG %s" % chrom)
             raise Fault("EARG", "The chrom argument (%s) was not a valid " \
                             "chromosome name." % chrom)
 
         pos = max(min(pos, binning.MAX_POSITION + 1), 1)
-        bins = binning.overlapping_bins(pos - 1, pos)
-        mappings = chromosome.transcript_mappings.filter(
-            TranscriptMapping.bin.in_(bins),
-            TranscriptMapping.start <= pos,
-            TranscriptMapping.stop >= pos
-        ).order_by(
-            TranscriptMapping.start,
-            TranscriptMapping.stop,
-            TranscriptMapping.gene,
-            TranscriptMapping.accession,
-            TranscriptMapping.version,
-            TranscriptMapping.transcript)
+        mappings = mapping_index.get_index(chromosome).overlapping(pos, pos)
 
         L.addMessage(__file__, -1, "INFO",
                      "Finished processing getTranscripts(%s %s %s %s)"
@@ -283,7 +512,7 @@ class MutalyzerService(ServiceBase):
             "Received request getTranscriptsByGene(%s %s)" % (build, name))
 
         try:
-            assembly = Assembly.by_name_or_alias(build)
+            assembly = assembly_cache.get_assembly(build)
         except NoResultFound:
             L.addMessage(__file__, 4, "EARG", "EARG %s" % build)
             raise Fault("EARG",
@@ -348,7 +577,7 @@ class MutalyzerService(ServiceBase):
                         % (pos1, pos2))
 
         try:
-            assembly = Assembly.by_name_or_alias(build)
+            assembly = assembly_cache.get_assembly(build)
         except NoResultFound:
             L.addMessage(__file__, 4, "EARG", "EARG %s" % build)
             raise Fault("EARG",
@@ -356,30 +585,17 @@ class MutalyzerService(ServiceBase):
                             "build name." % build)
 
         try:
-            chromosome = assembly.chromosomes.filter_by(name=chrom).one()
+            chromosome = assembly_cache.get_chromosome(assembly, chrom)
         except NoResultFound:
             L.addMessage(__file__, 4, "EARG", "EARG %s" % chrom)
             raise Fault("EARG", "The chrom argument (%s) was not a valid " \
                             "chromosome name." % chrom)
 
+        index = mapping_index.get_index(chromosome)
         if method:
-            bins = binning.overlapping_bins(pos1 - 1, pos2)
-            range_filter = (TranscriptMapping.bin.in_(bins),
-                            TranscriptMapping.start <= pos2,
-                            TranscriptMapping.stop >= pos1)
+            mappings = index.overlapping(pos1, pos2)
         else:
-            bins = binning.contained_bins(pos1 - 1, pos2)
-            range_filter = (TranscriptMapping.bin.in_(bins),
-                            TranscriptMapping.start >= pos1,
-                            TranscriptMapping.stop <= pos2)
-
-        mappings = chromosome.transcript_mappings.filter(*range_filter).order_by(
-            TranscriptMapping.start,
-            TranscriptMapping.stop,
-            TranscriptMapping.gene,
-            TranscriptMapping.accession,
-            TranscriptMapping.version,
-            TranscriptMapping.transcript)
+            mappings = index.contained(pos1, pos2)
 
         L.addMessage(__file__, -1, "INFO",
             "Finished processing getTranscriptsRange(%s %s %s %s %s)" % (
@@ -445,7 +661,7 @@ class MutalyzerService(ServiceBase):
                         % (pos1, pos2))
 
         try:
-            assembly = Assembly.by_name_or_alias(build)
+            assembly = assembly_cache.get_assembly(build)
         except NoResultFound:
             output.addMessage(__file__, 4, "EARG", "EARG %s" % build)
             raise Fault("EARG",
@@ -453,30 +669,17 @@ class MutalyzerService(ServiceBase):
                             "build name." % build)
 
         try:
-            chromosome = assembly.chromosomes.filter_by(name=chrom).one()
+            chromosome = assembly_cache.get_chromosome(assembly, chrom)
         except NoResultFound:
             output.addMessage(__file__, 4, "EARG", "EARG %s" % chrom)
             raise Fault("EARG", "The chrom argument (%s) was not a valid " \
                             "chromosome name." % chrom)
 
+        index = mapping_index.get_index(chromosome)
         if method:
-            bins = binning.overlapping_bins(pos1 - 1, pos2)
-            range_filter = (TranscriptMapping.bin.in_(bins),
-                            TranscriptMapping.start <= pos2,
-                            TranscriptMapping.stop >= pos1)
+            mappings = index.overlapping(pos1, pos2)
         else:
-            bins = binning.contained_bins(pos1 - 1, pos2)
-            range_filter = (TranscriptMapping.bin.in_(bins),
-                            TranscriptMapping.start >= pos1,
-                            TranscriptMapping.stop <= pos2)
-
-        mappings = chromosome.transcript_mappings.filter(*range_filter).order_by(
-            TranscriptMapping.start,
-            TranscriptMapping.stop,
-            TranscriptMapping.gene,
-            TranscriptMapping.accession,
-            TranscriptMapping.version,
-            TranscriptMapping.transcript)
+            mappings = index.contained(pos1, pos2)
 
         transcripts = []
 
@@ -523,7 +726,7 @@ class MutalyzerService(ServiceBase):
             "Received request getGeneName(%s %s)" % (build, accno))
 
         try:
-            assembly = Assembly.by_name_or_alias(build)
+            assembly = assembly_cache.get_assembly(build)
         except NoResultFound:
             L.addMessage(__file__, 4, "EARG", "EARG %s" % build)
             raise Fault("EARG",
@@ -606,7 +809,7 @@ class MutalyzerService(ServiceBase):
             accNo, variant))
 
         try:
-            assembly = Assembly.by_name_or_alias(build)
+            assembly = assembly_cache.get_assembly(build)
         except NoResultFound:
             L.addMessage(__file__, 4, "EARG", "EARG %s" % build)
             raise Fault("EARG",
@@ -652,7 +855,7 @@ class MutalyzerService(ServiceBase):
             accNo))
 
         try:
-            assembly = Assembly.by_name_or_alias(build)
+            assembly = assembly_cache.get_assembly(build)
         except NoResultFound:
             O.addMessage(__file__, 4, "EARG", "EARG %s" % build)
             raise Fault("EARG",
@@ -686,7 +889,7 @@ class MutalyzerService(ServiceBase):
             "Received request chromAccession(%s %s)" % (build, name))
 
         try:
-            assembly = Assembly.by_name_or_alias(build)
+            assembly = assembly_cache.get_assembly(build)
         except NoResultFound:
             L.addMessage(__file__, 4, "EARG", "EARG %s" % build)
             raise Fault("EARG",
@@ -694,7 +897,7 @@ class MutalyzerService(ServiceBase):
                             "build name." % build)
 
         try:
-            chromosome = assembly.chromosomes.filter_by(name=name).one()
+            chromosome = assembly_cache.get_chromosome(assembly, name)
         except NoResultFound:
             L.addMessage(__file__, 4, "EARG", "EARG %s" % name)
             raise Fault("EARG", "The name argument (%s) was not a valid " \
@@ -724,7 +927,7 @@ class MutalyzerService(ServiceBase):
             "Received request chromName(%s %s)" % (build, accNo))
 
         try:
-            assembly = Assembly.by_name_or_alias(build)
+            assembly = assembly_cache.get_assembly(build)
         except NoResultFound:
             L.addMessage(__file__, 4, "EARG", "EARG %s" % build)
             raise Fault("EARG",
@@ -732,7 +935,8 @@ class MutalyzerService(ServiceBase):
                             "build name." % build)
 
         try:
-            chromosome = assembly.chromosomes.filter_by(accession=accNo).one()
+            chromosome = assembly_cache.get_chromosome_by_accession(
+                assembly, accNo)
         except NoResultFound:
             L.addMessage(__file__, 4, "EARG", "EARG %s" % accNo)
             raise Fault("EARG", "The accNo argument (%s) was not a valid " \
@@ -763,7 +967,7 @@ class MutalyzerService(ServiceBase):
             "Received request getchromName(%s %s)" % (build, acc))
 
         try:
-            assembly = Assembly.by_name_or_alias(build)
+            assembly = assembly_cache.get_assembly(build)
         except NoResultFound:
             L.addMessage(__file__, 4, "EARG", "EARG %s" % build)
             raise Fault("EARG",
@@ -806,7 +1010,7 @@ class MutalyzerService(ServiceBase):
         stats.increment_counter('position-converter/webservice')
 
         try:
-            assembly = Assembly.by_name_or_alias(build)
+            assembly = assembly_cache.get_assembly(build)
         except NoResultFound:
             O.addMessage(__file__, 4, "EARG", "EARG %s" % build)
             raise Fault("EARG",
@@ -931,7 +1135,13 @@ class MutalyzerService(ServiceBase):
 
         stats.increment_counter('name-checker/webservice')
 
-        variantchecker.check_variant(variant, O)
+        variantchecker.check_variant(
+            variant, O, outputs={variantchecker.OUTPUT_ORIGINAL,
+                                 variantchecker.OUTPUT_MUTATED,
+                                 variantchecker.OUTPUT_TRANSCRIPTS,
+                                 variantchecker.OUTPUT_PROTEINS,
+                                 variantchecker.OUTPUT_VISUALISATION,
+                                 variantchecker.OUTPUT_LEGENDS})
 
         result = MutalyzerOutput()
 
@@ -1058,224 +1268,91 @@ class MutalyzerService(ServiceBase):
                    - stop: stop position
                    - info: information about the conversion process failure
         """
-        def check_param(obj, attr=None):
-            """
-            Checks whether `attr` is present in the `obj`. Added specifically
-            for the `extras` parameter.
-            :param obj: Call parameter.
-            :param attr: Attribute to search for in obj.
-            :return:
-            """
-            if not obj:
-                return False
-            if obj and not attr:
-                return True
-            if hasattr(obj, attr) and getattr(obj, attr):
-                return True
-            else:
-                return False
-
-        def get_variant_details():
-            """
-            Extracts the variant description details from the parse tree and
-            the sequence.
-
-            Currently accepts only one variant description and three mutation
-            types ('del', 'ins', and 'subst') with their corresponding
-            locations as natural numbers only ('c.10-3_10-5del' and other
-            positions such as '*3' are not accepted). Thus, it is mainly for
-            genomic references with 'g.' coordinates and no specific annotated
-            segment.
-
-            Example of accepted variant descriptions and their output terms:
-            - input: 'NC_000014.8:g.94844865G>A'
-                - output terms:
-                    - 'reference_file': 'NC_000014.8'
-                    - 'start': '94844865'
-                    - 'stop': '94844865'
-                    - 'ref': 'G'
-                    - 'alt': 'A'
-                    - 'operation': 'subst'
-            - input: 'NC_000011.9:g.47353833_47353857del'
-                - output terms:
-                    - 'reference_file': 'NC_000011.9'
-                    - 'start': '47353833'
-                    - 'stop': '47353857'
-                    - 'ref': 'AGGGAAGCCATCCAGGCTGAGAGGG'
-                    - 'alt': '.'
-                    - 'operation': 'del'
-            - input: 'NC_000008.10:g.10480387_10480388dup'
-                - output terms:
-                    - 'reference_file': 'NC_000008.10'
-                    - 'start': '10480387'
-                    - 'stop': '10480388'
-                    - 'ref': '.'
-                    - 'alt': 'GC'
-                    - 'operation': 'dup'
-            - input: 'NC_000008.10:g.10480387_10480388insA'
-                - output terms:
-                    - 'reference_file': 'NC_000008.10'
-                    - 'start': '10480388'
-                    - 'stop': '10480388'
-                    - 'ref': '.'
-                    - 'alt': 'A'
-                    - 'operation': 'ins'
-            - input: 'NC_000014.8:g.19400000delinsGT'
-                - output terms:
-                    - 'reference_file': 'NC_000014.8'
-                    - 'stop': '19400000'
-                    - 'start': '19400000'
-                    - 'ref': 'A'
-                    - 'alt': 'GT'
-                    - 'operation': 'delins'
-
-            For 'del' variants the sequence is required.
-            For 'ins' and 'subst' variants the sequence is not required with
-            the 'ref' and 'alt' terms being obtained directly from the HGVS
-            description.
-            """
-            varDetails = VarDetails()
-            varDetails.info = []
-            output = Output(__file__)
-            grammar = Grammar(output)
-            if result.genomicDescription:
-                variant_tree = grammar.parse(result.genomicDescription)
-            else:
-                varDetails.info.append("No genomic description generated.")
-                return varDetails
-
-            # Only one variant accepted for the moment
-            if variant_tree and not variant_tree.SingleAlleleVarSet:
-                # Extract the only variant
-                variant = variant_tree.RawVar
-
-                # Should be NCBI and not LRG
-                if variant_tree.RefSeqAcc and variant_tree.Version:
-                    record_id = variant_tree.RefSeqAcc + '.' + variant_tree.Version
-                    varDetails.reference_file = record_id
-                else:
-                    varDetails.info.append("Only ncbi references with accession "
-                                           "and version are accepted.")
-                    return varDetails
-
-                # Extract the variant type
-                try:
-                    mutation_type = variant.MutationType
-                except AttributeError:
-                    varDetails.info.append("No operation (mutation) type found.")
-                    return varDetails
-
-                # Extract the the positions
-                varDetails.start = varDetails.stop = variant.StartLoc.PtLoc.Main
-                if variant.EndLoc:
-                    varDetails.stop = variant.EndLoc.PtLoc.Main
-                if abs(int(varDetails.stop) - int(varDetails.start)) > 524288:
-                    varDetails.info.append("Too long (> 524288 bases) sequence change.")
-                    return varDetails
-
-                # Extract the 'ref' and 'alt' terms
-                if mutation_type == 'subst':
-                    varDetails.ref = unicode(variant.Arg1)
-                    varDetails.alt = unicode(variant.Arg2)
-                    varDetails.operation = 'subst'
-                elif mutation_type == 'del':
-                    varDetails.ref = unicode(O.getIndexedOutput("original", 0)\
-                        [int(varDetails.start)-1:int(varDetails.stop)])
-                    varDetails.alt = '.'
-                    varDetails.operation = 'del'
-                elif mutation_type == 'dup':
-                    varDetails.ref = '.'
-                    varDetails.alt = unicode(O.getIndexedOutput("original", 0)\
-                        [int(varDetails.start)-1:int(varDetails.stop)])
-                    varDetails.operation = 'dup'
-                elif mutation_type == 'ins':
-                    varDetails.ref = '.'
-                    varDetails.alt = unicode(variant.Seq.Sequence)
-                    varDetails.operation = 'ins'
-                elif mutation_type == 'delins':
-                    varDetails.ref = unicode(O.getIndexedOutput("original", 0)\
-                        [int(varDetails.start)-1:int(varDetails.stop)])
-                    varDetails.alt = unicode(variant.Seq.Sequence)
-                    varDetails.operation = 'delins'
-                else:
-                    varDetails.info.append("Conversion not performed since "
-                                           "'%s' operation is not supported."
-                                           % mutation_type)
-                    return varDetails
-            else:
-                varDetails.info.append("Conversion not performed since multiple "
-                                       "variants are present in the description.")
-                return varDetails
-
-            return varDetails
-
-        O = Output(__file__)
-        O.addMessage(__file__, -1, "INFO",
-            "Received request runMutalyzerLight(%s)" % (variant))
-
-        stats.increment_counter('name-checker/webservice')
-
-        if not check_param(extras, 'original') and not check_param(extras,'varDetails'):
-            O.addOutput('add_original_sequence_to_output', 'not')
-        if not check_param(extras, 'mutated'):
-            O.addOutput('add_mutated_sequence_to_output', 'not')
-        variantchecker.check_variant(variant, O)
-
-        result = MutalyzerOutput()
-
-        result.referenceId = O.getIndexedOutput('reference_id', 0)
-        result.sourceId = O.getIndexedOutput('source_id', 0)
-        result.sourceAccession = O.getIndexedOutput('source_accession', 0)
-        result.sourceVersion = O.getIndexedOutput('source_version', 0)
-        result.molecule = O.getIndexedOutput('molecule', 0)
-
-        if check_param(extras, 'original'):
-            result.original = O.getIndexedOutput("original", 0)
-        if check_param(extras, 'mutated'):
-            result.mutated = O.getIndexedOutput("mutated", 0)
-
-        result.chromDescription = \
-            O.getIndexedOutput("genomicChromDescription", 0)
-        result.genomicDescription = \
-            O.getIndexedOutput("genomicDescription", 0)
+        return _run_mutalyzer_light(variant, extras)
+    #runMutalyzerLight
 
-        if check_param(extras, 'varDetails'):
-            result.varDetails = get_variant_details()
+    @srpc(Mandatory.Unicode(max_occurs='unbounded'), RequestExtras,
+          _returns=Array(MutalyzerOutput))
+    def runMutalyzerLightBulk(variants, extras) :
+        """
+        Run the Mutalyzer name checker on a list of variant descriptions.
 
-        result.transcriptDescriptions = O.getOutput("descriptions")
-        result.proteinDescriptions = O.getOutput("protDescriptions")
+        This is the synchronous alternative to a name checker batch job. At
+        most `BULK_CHECK_MAX_VARIANTS` descriptions are accepted per call.
+        Descriptions on the same reference are checked consecutively and
+        share the loaded reference, such that it is loaded only once.
 
-        if O.getIndexedOutput('hasTranscriptInfo', 0, False):
-            result.exons = []
-            for e in O.getOutput('exonInfo'):
-                exon = ExonInfo()
-                exon.gStart, exon.gStop, exon.cStart, exon.cStop = e
-                result.exons.append(exon)
+        Descriptions that could not be checked within the time budget of the
+        call (`BULK_CHECK_TIME_BUDGET` seconds) are not checked at all, their
+        result has the ETIMEOUT error and no other fields. The time budget is
+        only checked before each description, so a call can take longer than
+        the time budget by the time it takes to check one description.
 
-        result.legend = []
-        for name, id, locusTag, product, linkMethod in O.getOutput('legends'):
-            record = LegendRecord()
-            record.name = name
-            record.id = id
-            record.locusTag = locusTag
-            record.product = product
-            record.linkMethod = linkMethod
-            result.legend.append(record)
+        On error an exception is raised:
+          - detail: Human readable description of the error.
+          - faultstring: A code to indicate the type of error.
+              - EARG: Too many variant descriptions.
 
-        result.errors, result.warnings, result.summary = O.Summary()
+        @arg variants: The variant descriptions to check.
+        @type variants: list(string)
 
-        O.addMessage(__file__, -1, "INFO",
-            "Finished processing runMutalyzerLight(%s)" % (variant))
+        @arg extras: Additional fields to be included in the responses, see
+            runMutalyzerLight.
+        @type extras: RequestExtras
 
-        result.messages = []
-        for message in O.getMessages():
-            soap_message = SoapMessage()
-            soap_message.errorcode = message.code
-            soap_message.message = message.description
-            result.messages.append(soap_message)
+        @return: List of runMutalyzerLight response objects, in the order of
+            the variant descriptions.
+        """
+        variants = variants or []
 
-        return result
-    #runMutalyzerLight
+        if len(variants) > settings.BULK_CHECK_MAX_VARIANTS:
+            raise Fault('EARG',
+                        'The number of variant descriptions exceeds the '
+                        'maximum of %d.' % settings.BULK_CHECK_MAX_VARIANTS)
+
+        deadline = time.time() + settings.BULK_CHECK_TIME_BUDGET
+
+        # Indices of the descriptions, grouped by reference.
+        groups = {}
+        for i, variant in enumerate(variants):
+            groups.setdefault(util.description_reference(variant),
+                              []).append(i)
+        order = sorted(groups.values(), key=lambda group: group[0])
+
+        def timeout_result():
+            O = Output(__file__)
+            O.addMessage(__file__, 4, 'ETIMEOUT',
+                'Variant description was not checked within the time '
+                'budget of %d seconds.' % settings.BULK_CHECK_TIME_BUDGET)
+            result = MutalyzerOutput()
+            result.errors, result.warnings, result.summary = O.Summary()
+            result.messages = []
+            for message in O.getMessages():
+                soap_message = SoapMessage()
+                soap_message.errorcode = message.code
+                soap_message.message = message.description
+                result.messages.append(soap_message)
+            return result
+
+        def results():
+            # Results are produced in reference order, but returned in input
+            # order as soon as all previous results are available.
+            done = {}
+            next_index = 0
+            for group in order:
+                records = {}
+                for i in group:
+                    if time.time() < deadline:
+                        done[i] = _run_mutalyzer_light(variants[i], extras,
+                                                       records)
+                    else:
+                        done[i] = timeout_result()
+                    while next_index in done:
+                        yield done.pop(next_index)
+                        next_index += 1
+
+        return results()
+    #runMutalyzerLightBulk
 
     @srpc(Mandatory.Unicode, Mandatory.Unicode, _returns=TranscriptNameInfo)
     def getGeneAndTranscript(genomicReference, transcriptReference) :
@@ -1810,8 +1887,8 @@ class MutalyzerService(ServiceBase):
                           % (gene, build))
 
         try:
-            assembly = Assembly.by_name_or_alias(build or
-                                                 settings.DEFAULT_ASSEMBLY)
+            assembly = assembly_cache.get_assembly(build or
+                                                settings.DEFAULT_ASSEMBLY)
         except NoResultFound:
             output.addMessage(__file__, 4, "EARG", "EARG %s" % build)
             raise Fault("EARG",
@@ -26,6 +26,7 @@ import inspect
 from itertools import izip_longest
 import math
 import operator
+import re
 import sys
 import time
 
@@ -805,6 +806,26 @@ def message_info(message):
 #message_info
 
 
+def description_reference(description):
+    """
+    Get the reference part of a variant description, without parsing it.
+    For example, `NM_003002.2` for `NM_003002.2(SDHD_v001):c.274G>T` and
+    `LRG_1` for `LRG_1t1:c.1A>T`.
+
+    @arg description: Variant description.
+    @type description: unicode
+
+    @return: Reference part of the description.
+    @rtype: unicode
+    """
+    reference = description.split(':', 1)[0].split('(', 1)[0].strip()
+    match = re.match(r'LRG_\d+', reference)
+    if match:
+        return match.group(0)
+    return reference
+#description_reference
+
+
 def format_usage(usage=None, keywords={}):
     """
     Format a usage string suitable for printing to the console. Some magic
@@ -18,6 +18,7 @@ Notes about string representations:
 
 from __future__ import unicode_literals
 
+import copy
 from operator import attrgetter
 
 from Bio.Data import CodonTable
@@ -25,9 +26,10 @@ from Bio.Alphabet import IUPAC
 from Bio.Alphabet import DNAAlphabet
 from Bio.Alphabet import ProteinAlphabet
 from Bio.Alphabet import _verify_alphabet
+from sqlalchemy.orm.exc import NoResultFound
 
+from mutalyzer import assembly_cache
 from mutalyzer import util
-from mutalyzer.db.models import Assembly
 from mutalyzer.grammar import Grammar
 from mutalyzer.mutator import Mutator
 from mutalyzer.mapping import Converter
@@ -36,6 +38,33 @@ from mutalyzer import GenRecord
 from mutalyzer.nc_db import get_nc_record, get_chromosome_ids
 from datetime import datetime
 
+
+# Optional outputs of check_variant(). Callers declare which of these they
+# need, such that we don't waste time computing the others.
+#: Original (genomic) sequence ('original').
+OUTPUT_ORIGINAL = 'original'
+#: Mutated (genomic) sequence ('mutated').
+OUTPUT_MUTATED = 'mutated'
+#: Original and mutated transcript and CDS sequences of the selected
+#: transcript ('origMRNA', 'mutatedMRNA', 'origCDS', 'newCDS').
+OUTPUT_TRANSCRIPTS = 'transcripts'
+#: Original and mutated protein sequences of the selected transcript,
+#: including HTML and plaintext formatted versions ('oldProtein',
+#: 'newProtein', 'altProtein', 'altStart', 'oldProteinFancy', etc).
+OUTPUT_PROTEINS = 'proteins'
+#: Visualisation of each raw variant ('visualisation').
+OUTPUT_VISUALISATION = 'visualisation'
+#: Effects on restriction sites of each raw variant ('restrictionSites').
+OUTPUT_RESTRICTION_SITES = 'restriction-sites'
+#: Legend of transcripts and proteins in the reference ('legends').
+OUTPUT_LEGENDS = 'legends'
+
+#: All optional outputs of check_variant().
+ALL_OUTPUTS = frozenset([OUTPUT_ORIGINAL, OUTPUT_MUTATED, OUTPUT_TRANSCRIPTS,
+                         OUTPUT_PROTEINS, OUTPUT_VISUALISATION,
+                         OUTPUT_RESTRICTION_SITES, OUTPUT_LEGENDS])
+
+
 # Exceptions used (privately) in this module.
 class _VariantError(Exception): pass
 class _RawVariantError(_VariantError): pass
@@ -1372,7 +1401,7 @@ def _add_static_transcript_info(transcript, output):
     output.addOutput('transcriptReverse', transcript.CM.orientation == -1)
 
 
-def _add_transcript_info(mutator, transcript, output):
+def _add_transcript_info(mutator, transcript, output, outputs=ALL_OUTPUTS):
     """
     Add transcript-specific information (including protein prediction) to
     the {output} object.
@@ -1383,6 +1412,8 @@ def _add_transcript_info(mutator, transcript, output):
     @type transcript: Modules.GenRecord.Locus
     @arg output: The Output object.
     @type output: Modules.Output.Output
+    @arg outputs: Optional outputs to add (see check_variant).
+    @type outputs: set(unicode)
 
     @todo: Documentation.
     @todo: Don't generate the fancy HTML protein descriptions here.
@@ -1391,6 +1422,7 @@ def _add_transcript_info(mutator, transcript, output):
     # Add transcript info to output.
     if transcript.transcribe:
         output.addOutput('myTranscriptDescription', transcript.description or '=')
+    if transcript.transcribe and OUTPUT_TRANSCRIPTS in outputs:
         output.addOutput('origMRNA',
             unicode(util.splice(mutator.orig, transcript.mRNA.positionList)))
         output.addOutput('mutatedMRNA',
@@ -1459,6 +1491,10 @@ def _add_transcript_info(mutator, transcript, output):
                               'Reference protein translated from alternative '
                               'start codon %s.' % (unicode(cds_original[:3])))
 
+        # Nothing more to check, the rest is only needed for the output.
+        if not (OUTPUT_TRANSCRIPTS in outputs or OUTPUT_PROTEINS in outputs):
+            return
+
         protein_variant = cds_variant.translate(table=transcript.txTable)
 
         if protein_variant:
@@ -1471,8 +1507,12 @@ def _add_transcript_info(mutator, transcript, output):
         except ValueError:
             pass
 
-        output.addOutput('origCDS', unicode(cds_original))
-        output.addOutput("newCDS", unicode(cds_variant[:len(protein_variant) * 3]))
+        if OUTPUT_TRANSCRIPTS in outputs:
+            output.addOutput('origCDS', unicode(cds_original))
+            output.addOutput("newCDS", unicode(cds_variant[:len(protein_variant) * 3]))
+
+        if OUTPUT_PROTEINS not in outputs:
+            return
 
         # Under which name to store the variant protein sequence. Can be:
         # - 'new': Normal case.
@@ -1554,7 +1594,8 @@ def _add_transcript_info(mutator, transcript, output):
 #_add_transcript_info
 
 
-def process_variant(mutator, description, record, output):
+def process_variant(mutator, description, record, output,
+                    outputs=ALL_OUTPUTS):
     """
     @arg mutator: A Mutator instance.
     @type mutator: mutalyzer.mutator.Mutator
@@ -1564,6 +1605,8 @@ def process_variant(mutator, description, record, output):
     @type record: Modules.GenRecord.GenRecord
     @arg output: The Output object.
     @type output: Modules.Output.Output
+    @arg outputs: Optional outputs to add (see check_variant).
+    @type outputs: set(unicode)
 
     @raise _VariantError: Cannot process this variant.
 
@@ -1772,20 +1815,35 @@ def process_variant(mutator, description, record, output):
 
     # Add transcript-specific variant information.
     if transcript and record.record.geneList:
-        _add_transcript_info(mutator, transcript, output)
+        _add_transcript_info(mutator, transcript, output, outputs)
 #process_variant
 
 
-def check_variant(description, output):
+def check_variant(description, output, outputs=ALL_OUTPUTS, records=None):
     """
     Check the variant described by {description} according to the HGVS variant
     nomenclature and populate the {output} object with various information
     about the variant and its reference sequence.
 
+    Some of the information is expensive to compute and not needed by every
+    caller, so it is only added if it is declared in {outputs} (see the
+    OUTPUT_* constants in this module).
+
+    Callers checking several variants on the same reference can share the
+    loaded reference records between the checks with {records}. A record is
+    then loaded only by the first check, the others use a copy of it (the
+    record is modified during the check).
+
     @arg description: Variant description in HGVS notation.
     @type description: string
     @arg output: An output object.
     @type output: Modules.Output.Output
+    @arg outputs: Optional outputs to add (default: all of them).
+    @type outputs: set(unicode)
+    @arg records: Loaded records by record id, shared between checks. The
+        record loaded by this check is added to it (default: records are
+        not shared).
+    @type records: dict
 
     @todo: Documentation.
     @todo: Raise exceptions on failure instead of just return.
@@ -1849,7 +1907,16 @@ def check_variant(description, output):
         retrieved_record = None
 
     if retrieved_record is None:
-        retrieved_record = retriever.loadrecord(record_id)
+        if records is not None and record_id in records:
+            retrieved_record = copy.deepcopy(records[record_id])
+        else:
+            retrieved_record = retriever.loadrecord(record_id)
+            # Records stored under another id (e.g., for an accession number
+            # without version) are not shared, since loading them adds
+            # messages and batch flags.
+            if (records is not None and retrieved_record and
+                    retrieved_record.id == record_id):
+                records[record_id] = copy.deepcopy(retrieved_record)
     else:
         # To remove the download link text from the name checker page.
         filetype = 'GB_NC'
@@ -1900,38 +1967,41 @@ def check_variant(description, output):
     # Note: The GenRecord instance is carrying the sequence in .record.seq.
     #       So is the Mutator instance in .mutator.orig.
 
-    mutator = Mutator(record.record.seq, output)
+    mutator = Mutator(record.record.seq, output,
+                      visualisation=OUTPUT_VISUALISATION in outputs,
+                      restriction_sites=OUTPUT_RESTRICTION_SITES in outputs)
 
     # Todo: If processing of the variant fails, we might still want to show
     # information about the record, gene, transcript.
 
     try:
-        process_variant(mutator, parsed_description, record, output)
+        process_variant(mutator, parsed_description, record, output, outputs)
     except _VariantError:
         return
     finally:
         # The legend needs to be created after processing the variant (which
         # enriches the gene model by calling record.checkRecord), but we can
         # create it regardless of success or failure.
-        for gene in record.record.geneList:
-            for transcript in sorted(gene.transcriptList, key=attrgetter('name')):
-                if not transcript.name:
-                    continue
-                output.addOutput('legends',
-                                 ['%s_v%s' % (gene.name, transcript.name),
-                                  transcript.transcriptID, transcript.locusTag,
-                                  transcript.transcriptProduct,
-                                  transcript.linkMethod])
-                if transcript.translate:
+        if OUTPUT_LEGENDS in outputs:
+            for gene in record.record.geneList:
+                for transcript in sorted(gene.transcriptList, key=attrgetter('name')):
+                    if not transcript.name:
+                        continue
                     output.addOutput('legends',
-                                     ['%s_i%s' % (gene.name, transcript.name),
-                                      transcript.proteinID, transcript.locusTag,
-                                      transcript.proteinProduct,
+                                     ['%s_v%s' % (gene.name, transcript.name),
+                                      transcript.transcriptID, transcript.locusTag,
+                                      transcript.transcriptProduct,
                                       transcript.linkMethod])
-
-    if not output.getOutput('add_original_sequence_to_output'):
+                    if transcript.translate:
+                        output.addOutput('legends',
+                                         ['%s_i%s' % (gene.name, transcript.name),
+                                          transcript.proteinID, transcript.locusTag,
+                                          transcript.proteinProduct,
+                                          transcript.linkMethod])
+
+    if OUTPUT_ORIGINAL in outputs:
         output.addOutput('original', unicode(mutator.orig))
-    if not output.getOutput('add_mutated_sequence_to_output'):
+    if OUTPUT_MUTATED in outputs:
         output.addOutput('mutated', unicode(mutator.mutated))
 
     # Chromosomal region (only for GenBank human transcript references).
@@ -1947,7 +2017,10 @@ def check_variant(description, output):
                          for descr, first, last in raw_variants
                          for pos in (first, last)]
             # Todo: This is hard-coded to hg19...
-            assembly = Assembly.query.filter_by(alias='hg19').first()
+            try:
+                assembly = assembly_cache.get_assembly('hg19')
+            except NoResultFound:
+                assembly = None
             if assembly:
                 converter = Converter(assembly, output)
                 version = int(parsed_description.Version) if parsed_description.Version else None
@@ -1960,7 +2033,14 @@ def check_variant(description, output):
                                           util.grouper(chromosomal_positions[2]))))
                     # Example value: ('chr12', [('29+4T>C', (2323, 2323)), ('230_233del', (5342, 5345))])
 
-    # Protein.
+    # Protein. We only predict the protein for transcripts overlapping (or
+    # directly adjacent to) a mutated range, the others are unaffected.
+    record.record.index_transcripts()
+    affected_transcripts = set()
+    for first, last in mutator.mutated_ranges:
+        affected_transcripts.update(
+            record.record.overlapping_transcripts(first, last + 1))
+
     for gene in record.record.geneList:
         for transcript in gene.transcriptList:
 
@@ -1974,18 +2054,26 @@ def check_variant(description, output):
                 transcript.proteinDescription = 'p.?'
                 continue
 
-            cds_original = util.splice(mutator.orig, transcript.CDS.positionList)
-            cds_original.alphabet = IUPAC.unambiguous_dna
+            if transcript not in affected_transcripts and \
+                   record.record.cds_translatable(transcript):
+                # No need to look at the sequence. Transcripts with a CDS
+                # that cannot be translated get the warning below.
+                cds_original = None
+                cds_length = util.cds_length(transcript.CDS.positionList)
+            else:
+                cds_original = util.splice(mutator.orig, transcript.CDS.positionList)
+                cds_original.alphabet = IUPAC.unambiguous_dna
+                cds_length = len(cds_original)
 
-            cds_variant = util.__nsplice(mutator.mutated,
-                                         mutator.shift_sites(transcript.mRNA.positionList),
-                                         mutator.shift_sites(transcript.CDS.location),
-                                         transcript.CM.orientation)
-            cds_variant.alphabet = IUPAC.unambiguous_dna
+                cds_variant = util.__nsplice(mutator.mutated,
+                                             mutator.shift_sites(transcript.mRNA.positionList),
+                                             mutator.shift_sites(transcript.CDS.location),
+                                             transcript.CM.orientation)
+                cds_variant.alphabet = IUPAC.unambiguous_dna
 
-            if transcript.CM.orientation == -1:
-                cds_original = cds_original.reverse_complement()
-                cds_variant = cds_variant.reverse_complement()
+                if transcript.CM.orientation == -1:
+                    cds_original = cds_original.reverse_complement()
+                    cds_variant = cds_variant.reverse_complement()
 
             #if '*' in cds_original.translate()[:-1]:
             #    output.addMessage(__file__, 3, "ESTOP",
@@ -1996,7 +2084,9 @@ def check_variant(description, output):
             # Todo: Figure out if this is all ok, even if the CDS stop is
             # somehow removed, if the sequence is really short, etc.
 
-            if not len(cds_original) % 3:
+            if not cds_length % 3 and cds_original is None:
+                transcript.proteinDescription = 'p.(=)'
+            elif not cds_length % 3:
                 try:
                     # FIXME this is a bit of a rancid fix.
                     protein_original = cds_original.translate(table=transcript.txTable, cds=True)
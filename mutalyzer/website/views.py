@@ -5,7 +5,6 @@ Mutalyzer website views.
 
 from __future__ import unicode_literals
 
-import bz2
 import os
 import pkg_resources
 import re
@@ -15,7 +14,7 @@ import urllib
 from datetime import datetime
 from flask import Blueprint
 from flask import (abort, jsonify, make_response, redirect, render_template,
-                   request, send_from_directory, url_for)
+                   request, send_file, url_for)
 import jinja2
 from lxml import etree
 from spyne.server.http import HttpBase
@@ -24,9 +23,11 @@ from sqlalchemy.orm.exc import NoResultFound
 import extractor
 
 import mutalyzer
-from mutalyzer import (announce, backtranslator, File, ncbi, Retriever,
-                       Scheduler, stats, util, variantchecker)
+from mutalyzer import (announce, assembly_cache, backtranslator, batch_results,
+                       compression, File, ncbi, Retriever, Scheduler, stats,
+                       util, variantchecker)
 from mutalyzer.config import settings
+from mutalyzer.db import queries
 from mutalyzer.db.models import BATCH_JOB_TYPES
 from mutalyzer.db.models import Assembly, BatchJob
 from mutalyzer.grammar import Grammar
@@ -245,7 +246,13 @@ def name_checker():
                       % (description, request.remote_addr))
     stats.increment_counter('name-checker/website')
 
-    variantchecker.check_variant(description, output)
+    variantchecker.check_variant(
+        description, output, outputs={variantchecker.OUTPUT_ORIGINAL,
+                                      variantchecker.OUTPUT_MUTATED,
+                                      variantchecker.OUTPUT_PROTEINS,
+                                      variantchecker.OUTPUT_VISUALISATION,
+                                      variantchecker.OUTPUT_RESTRICTION_SITES,
+                                      variantchecker.OUTPUT_LEGENDS})
 
     errors, warnings, summary = output.Summary()
     parse_error = output.getOutput('parseError')
@@ -356,7 +363,7 @@ def bed():
 
     output = Output(__file__)
 
-    variantchecker.check_variant(description, output)
+    variantchecker.check_variant(description, output, outputs=set())
 
     raw_variants = output.getIndexedOutput('rawVariantsChromosomal', 0)
     if not raw_variants:
@@ -424,7 +431,7 @@ def position_converter():
     transcript_descriptions = None
 
     try:
-        assembly = Assembly.by_name_or_alias(assembly_name_or_alias)
+        assembly = assembly_cache.get_assembly(assembly_name_or_alias)
     except NoResultFound:
         output.addMessage(__file__, 3, 'ENOASSEMBLY',
                           'Not a valid assembly.')
@@ -645,17 +652,17 @@ def reference_loader_submit():
             assembly_name_or_alias = request.form.get('assembly_name_or_alias',
                                                       settings.DEFAULT_ASSEMBLY)
             try:
-                assembly = Assembly.by_name_or_alias(assembly_name_or_alias)
+                assembly = assembly_cache.get_assembly(assembly_name_or_alias)
             except NoResultFound:
                 raise InputException('Invalid assembly')
 
             if not chromosome_name.startswith('chr'):
                 chromosome_name = 'chr%s' % chromosome_name
 
-            chromosome = assembly.chromosomes \
-                .filter_by(name=chromosome_name) \
-                .first()
-            if not chromosome:
+            try:
+                chromosome = assembly_cache.get_chromosome(assembly,
+                                                           chromosome_name)
+            except NoResultFound:
                 raise InputException('Chromosome not available for assembly '
                                      '%s: %s' % (assembly.name, name))
 
@@ -859,7 +866,7 @@ def reference(filename):
     if not os.path.isfile(file_path):
         abort(404)
 
-    response = make_response(bz2.BZ2File(file_path, 'r').read())
+    response = make_response(compression.open_file(file_path).read())
 
     response.headers['Content-Type'] = 'text/plain; charset=utf-8'
     response.headers['Content-Disposition'] = ('attachment; filename="%s"'
@@ -919,7 +926,7 @@ def batch_jobs_submit():
 
     if job_type == 'position-converter':
         try:
-            Assembly.by_name_or_alias(assembly_name_or_alias)
+            assembly_cache.get_assembly(assembly_name_or_alias)
         except NoResultFound:
             errors.append('Not a valid assembly.')
         argument = assembly_name_or_alias
@@ -978,8 +985,7 @@ def batch_job_progress():
         # Only now, the job can be complete. But since we don't keep completed
         # jobs in the database, we can only see if it ever existed by checking
         # the result file.
-        path = os.path.join(settings.CACHE_DIR, 'batch-job-%s.txt' % result_id)
-        if os.path.isfile(path):
+        if batch_results.result_path(result_id):
             if json:
                 return jsonify(items_left=1, complete=True)
             return render_template('batch-job-progress.html',
@@ -987,7 +993,7 @@ def batch_job_progress():
         else:
             return render_template('batch-job-progress.html')
 
-    items_left = batch_job.batch_queue_items.count()
+    items_left = queries.count_batch_queue_items(batch_job)
 
     if json:
         return jsonify(items_left=items_left, complete=False)
@@ -1009,10 +1015,15 @@ def batch_job_result(result_id):
         # If the batch job exists, it is not done yet.
         abort(404)
 
-    return send_from_directory(settings.CACHE_DIR,
-                               'batch-job-%s.txt' % result_id,
-                               mimetype='text/plain; charset=utf-8',
-                               as_attachment=True)
+    try:
+        handle = batch_results.open_result(result_id)
+    except IOError:
+        abort(404)
+
+    return send_file(handle,
+                     mimetype='text/plain; charset=utf-8',
+                     as_attachment=True,
+                     attachment_filename='batch-job-%s.txt' % result_id)
 
 
 # Todo: Is this obsolete?
@@ -1050,7 +1061,8 @@ def lovd_get_gs():
                       % (mutation_name, variant_record, forward,
                          request.remote_addr))
 
-    variantchecker.check_variant(mutation_name, output)
+    variantchecker.check_variant(mutation_name, output,
+                                 outputs={variantchecker.OUTPUT_LEGENDS})
 
     output.addMessage(__file__, -1, 'INFO',
                       'Finished request getGS(%s, %s, %s)'
@@ -1152,7 +1164,7 @@ def lovd_variant_info():
                          request.remote_addr))
 
     try:
-        assembly = Assembly.by_name_or_alias(build)
+        assembly = assembly_cache.get_assembly(build)
     except NoResultFound:
         response = make_response('invalid build')
         response.headers['Content-Type'] = 'text/plain; charset=utf-8'
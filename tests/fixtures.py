@@ -5,6 +5,7 @@ Test fixtures.
 
 from __future__ import unicode_literals
 
+from collections import Counter
 import os
 import shutil
 
@@ -17,6 +18,7 @@ from mutalyzer.redisclient import client as redis
 from mutalyzer.db.models import (Assembly, Chromosome, Reference,
                                  TranscriptMapping)
 from mutalyzer import db as _db
+from mutalyzer import stats
 
 
 @pytest.fixture(autouse=True)
@@ -46,6 +48,17 @@ def output(settings):
     return Output('test')
 
 
+@pytest.fixture
+def counters(monkeypatch):
+    """
+    Counts of the incremented stat counters.
+    """
+    counts = Counter()
+    monkeypatch.setattr(stats, 'increment_counter',
+                        lambda counter: counts.update([counter]))
+    return counts
+
+
 @pytest.fixture
 def db(request, settings, database_uri):
     settings.configure({
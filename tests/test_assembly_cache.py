@@ -0,0 +1,107 @@
+"""
+Tests for the mutalyzer.assembly_cache module.
+"""
+
+
+from __future__ import unicode_literals
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm.exc import NoResultFound
+
+from mutalyzer import assembly_cache
+from mutalyzer.db.models import Assembly, Chromosome
+
+
+@pytest.fixture
+def queries(db, hg19):
+    """
+    List of SQL statements executed.
+    """
+    db.session.commit()
+    statements = []
+    def log(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(db.session.get_bind(), 'before_cursor_execute', log)
+    yield statements
+    event.remove(db.session.get_bind(), 'before_cursor_execute', log)
+
+
+def test_get_assembly(db, queries):
+    """
+    Assemblies are found by name and alias, only the first lookup queries
+    the database.
+    """
+    assembly = assembly_cache.get_assembly('GRCh37')
+    assert assembly.alias == 'hg19'
+    assert len(queries) == 1
+
+    db.session.remove()
+    assert assembly_cache.get_assembly('hg19').name == 'GRCh37'
+    assert assembly_cache.get_assembly('GRCh37') in db.session
+    assert len(queries) == 1
+
+
+def test_get_assembly_missing(db, queries):
+    """
+    Looking up a non-existing assembly raises NoResultFound.
+    """
+    with pytest.raises(NoResultFound):
+        assembly_cache.get_assembly('hg18')
+
+
+def test_get_chromosome(db, queries):
+    """
+    Chromosomes are found by name and accession number, only the first
+    lookup queries the database.
+    """
+    assembly = assembly_cache.get_assembly('hg19')
+    chromosome = assembly_cache.get_chromosome(assembly, 'chr11')
+    assert chromosome.accession == 'NC_000011.9'
+    assert chromosome.assembly is assembly
+    assert len(queries) == 2
+
+    db.session.remove()
+    assembly = assembly_cache.get_assembly('hg19')
+    chromosome = assembly_cache.get_chromosome_by_accession(assembly,
+                                                            'NC_000006.11')
+    assert chromosome.name == 'chr6'
+    assert chromosome.assembly is assembly
+    assert len(queries) == 2
+
+    with pytest.raises(NoResultFound):
+        assembly_cache.get_chromosome(assembly, 'chr42')
+
+
+def test_new_assembly(db, queries):
+    """
+    New assemblies and chromosomes are found without invalidation.
+    """
+    assembly_cache.get_assembly('hg19')
+
+    assembly = Assembly('GRCm38', 10090, 'Mus musculus', alias='mm10')
+    db.session.add(assembly)
+    db.session.add(Chromosome(assembly, 'chr1', 'NC_000067.6', 'nucleus'))
+    db.session.commit()
+
+    assembly = assembly_cache.get_assembly('mm10')
+    assert assembly.name == 'GRCm38'
+    assert assembly_cache.get_chromosome(
+        assembly, 'chr1').accession == 'NC_000067.6'
+
+
+def test_invalidate(db, queries):
+    """
+    Changes to existing assemblies are seen after invalidation.
+    """
+    assembly = assembly_cache.get_assembly('hg19')
+    assembly.alias = 'hg19-test'
+    db.session.commit()
+    db.session.remove()
+    assert assembly_cache.get_assembly('hg19').alias == 'hg19'
+
+    assembly_cache.invalidate()
+    db.session.remove()
+    with pytest.raises(NoResultFound):
+        assembly_cache.get_assembly('hg19')
+    assert assembly_cache.get_assembly('hg19-test').name == 'GRCh37'
@@ -0,0 +1,112 @@
+"""
+Tests for the mutalyzer.batch_results module.
+"""
+
+
+from __future__ import unicode_literals
+
+import os
+
+import pytest
+
+from mutalyzer import batch_results
+
+
+HEADER = ['Input', 'Status']
+
+
+def _items(start, stop):
+    return [(i, 'NM_003002.2:c.%ddel' % i, '') for i in range(start, stop)]
+
+
+def _line(item):
+    return '%s\tOK\n' % item[1]
+
+
+def _read(result_id):
+    with batch_results.open_result(result_id) as handle:
+        return handle.read().decode('utf-8')
+
+
+@pytest.mark.parametrize('compressed', [False, True])
+def test_write(monkeypatch, settings, compressed):
+    """
+    Lines are buffered and written with a header.
+    """
+    monkeypatch.setattr(settings, 'BATCH_RESULT_GZIP', compressed)
+    monkeypatch.setattr(settings, 'BATCH_RESULT_BUFFER_SIZE', 100)
+
+    items = _items(0, 10)
+    writer = batch_results.ResultWriter('test', HEADER)
+    assert writer.path.endswith('.gz') == compressed
+
+    writer.write(items[0], _line(items[0]))
+    assert os.path.getsize(writer.path) == 0
+
+    for item in items[1:]:
+        writer.write(item, _line(item))
+    assert os.path.getsize(writer.path) > 0
+
+    writer.close(complete=True)
+    assert not os.path.exists(writer.checkpoint_path)
+    assert batch_results.result_path('test') == writer.path
+    assert _read('test') == 'Input\tStatus\n' + ''.join(
+        _line(item) for item in items)
+
+
+@pytest.mark.parametrize('compressed', [False, True])
+def test_recover(monkeypatch, settings, compressed):
+    """
+    After a crash, the result file is truncated to the last checkpoint and
+    the items without a result line are recovered.
+    """
+    monkeypatch.setattr(settings, 'BATCH_RESULT_GZIP', compressed)
+
+    items = _items(0, 10)
+    claimed = []
+    writer = batch_results.ResultWriter('test', HEADER,
+                                        unwritten=lambda: claimed)
+    writer.checkpoint(items)
+    claimed.extend(items)
+
+    for item in items[:4]:
+        claimed.remove(item)
+        writer.write(item, _line(item))
+    writer.flush()
+
+    for item in items[4:6]:
+        claimed.remove(item)
+        writer.write(item, _line(item))
+    # Crash after writing the lines but before writing the checkpoint.
+    writer._handle.write(b'garbage')
+    writer._handle.flush()
+
+    assert batch_results.unwritten_items('test') == items[4:]
+
+    writer = batch_results.ResultWriter('test', HEADER)
+    assert writer.recover() == items[4:]
+
+    for item in items[4:]:
+        writer.write(item, _line(item))
+    writer.close(complete=True)
+
+    assert _read('test') == 'Input\tStatus\n' + ''.join(
+        _line(item) for item in items)
+
+
+def test_recover_without_checkpoint(settings):
+    """
+    Without a checkpoint, there is nothing to recover.
+    """
+    writer = batch_results.ResultWriter('test', HEADER)
+    assert writer.recover() == []
+    writer.close()
+
+
+def test_open_result_missing(settings):
+    """
+    Opening a missing result file fails with IOError.
+    """
+    assert batch_results.result_path('missing') is None
+    with pytest.raises(IOError):
+        batch_results.open_result('missing')
@@ -0,0 +1,116 @@
+"""
+Tests for the mutalyzer.compression module.
+"""
+
+
+from __future__ import unicode_literals
+
+import bz2
+import os
+import shutil
+
+import pytest
+
+from mutalyzer import compression
+from mutalyzer.output import Output
+from mutalyzer.parsers import genbank
+from mutalyzer.Retriever import GenBankRetriever, LRGRetriever
+
+from fixtures import with_references
+
+
+CODECS = ['bz2', 'gzip', 'none',
+          pytest.param('zstd', marks=pytest.mark.skipif(
+              compression.zstandard is None,
+              reason='zstandard package is not installed'))]
+
+
+def _data_file(name):
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data',
+                        name)
+
+
+@pytest.fixture
+def genbank_file(settings):
+    """
+    A bz2 compressed GenBank file in the cache.
+    """
+    filename = os.path.join(settings.CACHE_DIR, 'AB026906.1.gb.bz2')
+    shutil.copy(_data_file('AB026906.1.gb.bz2'), filename)
+    return filename
+
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_compress(tmpdir, codec):
+    """
+    Compressed files are read with the detected codec.
+    """
+    data = b'LOCUS       AB026906\n' * 100
+    filename = unicode(tmpdir.join('file.gb.bz2'))
+    with open(filename, 'wb') as handle:
+        handle.write(compression.get_codec(codec).compress(data))
+
+    assert compression.detect_codec(filename).name == codec
+    assert compression.open_file(filename).read() == data
+
+
+def test_get_codec_unknown():
+    """
+    Unknown codecs are refused.
+    """
+    with pytest.raises(ValueError):
+        compression.get_codec('lzma')
+
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_transcode(genbank_file, codec):
+    """
+    Files are transcoded in place.
+    """
+    with bz2.BZ2File(genbank_file) as handle:
+        data = handle.read()
+
+    assert compression.transcode(genbank_file, codec) == (codec != 'bz2')
+    assert compression.transcode(genbank_file, codec) is False
+    assert compression.detect_codec(genbank_file).name == codec
+    assert compression.open_file(genbank_file).read() == data
+
+    record = genbank.GBparser().create_record(genbank_file)
+    assert record.seq
+
+
+@pytest.mark.parametrize('codec', ['gzip', 'none'])
+def test_write_codec(db, monkeypatch, settings, codec):
+    """
+    New files are written with the `CACHE_CODEC` codec and files with other
+    codecs can still be read.
+    """
+    with bz2.BZ2File(_data_file('AB026906.1.gb.bz2')) as handle:
+        data = handle.read()
+
+    retriever = GenBankRetriever(Output(__file__))
+    first = retriever.uploadrecord(data)
+    monkeypatch.setitem(settings, 'CACHE_CODEC', codec)
+    second = retriever.uploadrecord(data.replace(b'AB026906', b'AB026907'))
+
+    assert compression.detect_codec(
+        os.path.join(settings.CACHE_DIR, '%s.gb.bz2' % first)).name == 'bz2'
+    assert compression.detect_codec(
+        os.path.join(settings.CACHE_DIR, '%s.gb.bz2' % second)).name == codec
+
+    first_record, second_record = [
+        retriever.parse_record(
+            os.path.join(settings.CACHE_DIR, '%s.gb.bz2' % accession))
+        for accession in (first, second)]
+    assert unicode(first_record.seq) == unicode(second_record.seq)
+
+
+@with_references('LRG_1')
+def test_lrg_transcoded(settings):
+    """
+    Transcoded LRG files are loaded.
+    """
+    compression.transcode(os.path.join(settings.CACHE_DIR, 'LRG_1.xml.bz2'),
+                          'gzip')
+    record = LRGRetriever(Output(__file__)).loadrecord('LRG_1')
+    assert record.id == 'LRG_1'
@@ -5,6 +5,8 @@ Tests for the mutalyzer.Crossmap module.
 
 from __future__ import unicode_literals
 
+import pytest
+
 from mutalyzer.Crossmap import Crossmap
 
 
@@ -374,3 +376,57 @@ def test_cds_is_exon_reverse():
     cds = [58661, 58762]
     cm = Crossmap(rna, cds, -1)
     assert cm._Crossmap__crossmapping == [297, 103, 102, 1, -1, -88]
+
+
+@pytest.mark.parametrize('rna,cds,orientation', [
+    ([5002, 5125, 27745, 27939, 58661, 58762, 74680, 74767, 103409, 103528,
+      119465, 119537, 144687, 144810, 148418, 149215], [27925, 74736], 1),
+    ([2000, 2797, 6405, 6528, 31678, 31750, 47687, 47806, 76448, 76535,
+      92453, 92554, 123276, 123470, 146090, 146213], [76479, 123290], -1),
+    ([5002, 5125, 27745, 27939, 58661, 58762, 74680, 74767, 103409, 103528,
+      119465, 119537, 144687, 144810, 148418, 149215], [], 1),
+    ([2000, 2797, 6405, 6528, 31678, 31750, 47687, 47806, 76448, 76535,
+      92453, 92554, 123276, 123470, 146090, 146213], [], -1),
+    ([1, 80, 81, 3719], [162, 2123], 1),
+    ([23755059, 23755214, 23777833, 23778028, 23808749, 23808851, 23824768,
+      23824856, 23853497, 23853617, 23869553, 23869626, 23894775, 23894899,
+      23898506, 23899304], [23777833, 23898680], 1),
+    ([23777833, 23778028, 23808749, 23808851, 23824768, 23824856, 23853497,
+      23853617, 23869553, 23869626, 23894775, 23894899, 23898506, 23899304],
+     [23777833, 23899304], -1),
+    ([27745, 27939, 58661, 58762, 74680, 74767], [58661, 58762], -1),
+    ([100, 200], [], 1)])
+def test_many(rna, cds, orientation):
+    """
+    The array versions of the conversions give the same results as the
+    scalar versions, including positions on and around the splice sites
+    and outside the transcript.
+    """
+    cm = Crossmap(rna, cds, orientation)
+
+    positions = [p for splice_site in rna
+                 for p in range(splice_site - 3, splice_site + 4)]
+    positions += range(rna[0] - 10, rna[-1] + 10, 97)
+    tuples = [cm.g2x(p) for p in positions]
+    assert cm.g2x_many(positions) == tuples
+    for fuzzy in (False, True):
+        assert (cm.tuple2string_many(*zip(*tuples), fuzzy=fuzzy) ==
+                [cm.tuple2string(t, fuzzy) for t in tuples])
+        assert (cm.g2c_many(positions, fuzzy) ==
+                [cm.g2c(p, fuzzy) for p in positions])
+
+    trans_start, trans_end, _ = cm.info()
+    mains = range(min(trans_start, -5) - 5, trans_end + 10)
+    offsets = [(main % 7) - 3 for main in mains]
+    assert (cm.x2g_many(mains, offsets) ==
+            [cm.x2g(main, offset) for main, offset in zip(mains, offsets)])
+
+
+def test_many_empty():
+    """
+    The array versions of the conversions accept empty input.
+    """
+    cm = Crossmap([1, 80, 81, 3719], [162, 2123], 1)
+    assert cm.g2x_many([]) == []
+    assert cm.x2g_many([], []) == []
+    assert cm.g2c_many([]) == []
@@ -0,0 +1,214 @@
+"""
+Tests for the mutalyzer.file_cache module.
+"""
+
+
+from __future__ import unicode_literals
+
+import fcntl
+import os
+
+import pytest
+
+from mutalyzer.db.models import Reference
+from mutalyzer import file_cache
+from mutalyzer.output import Output
+from mutalyzer.record_cache import cache as record_cache
+from mutalyzer.Retriever import GenBankRetriever
+
+from fixtures import with_references
+
+
+pytestmark = pytest.mark.usefixtures('db')
+
+
+class Clock(object):
+    """
+    Replacement for the `time` module with a time that only changes when
+    told to.
+    """
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(file_cache, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def cache_file(db, settings):
+    """
+    Factory for files in the cache of references with a given source.
+    """
+    def cache_file(accession, source, size, extension='gb.bz2'):
+        if source is not None:
+            db.session.add(Reference(accession, accession, source))
+            db.session.commit()
+        filename = os.path.join(settings.CACHE_DIR,
+                                '%s.%s' % (accession, extension))
+        with open(filename, 'wb') as handle:
+            handle.write(b'x' * size)
+        return filename
+
+    return cache_file
+
+
+def test_evict(settings, clock, counters, cache_file):
+    """
+    Least recently used files are evicted, except for uploads and unknown
+    references.
+    """
+    for accession, source in [('UD_1', 'upload'), ('AB000001.1', 'ncbi'),
+                              ('UD_2', None), ('UD_3', 'ncbi_slice'),
+                              ('UD_4', 'url'), ('LRG_1', 'lrg')]:
+        extension = 'xml.bz2' if source == 'lrg' else 'gb.bz2'
+        file_cache.add(cache_file(accession, source, 100, extension))
+        clock.now += 100
+
+    assert file_cache.evict(350) == ['AB000001.1.gb.bz2', 'UD_3.gb.bz2',
+                                     'UD_4.gb.bz2']
+    assert counters == {'file-cache/eviction': 3}
+    assert file_cache.report()['size'] == 300
+    assert file_cache.evict(0) == ['LRG_1.xml.bz2']
+    assert sorted(os.listdir(settings.CACHE_DIR)) == [
+        'UD_1.gb.bz2', 'UD_2.gb.bz2', 'locks']
+
+
+def test_evict_compact(clock, cache_file):
+    """
+    Compact record files are evicted, even for uploads.
+    """
+    file_cache.add(cache_file('UD_1', 'upload', 100, 'gb.rec'))
+    file_cache.add(cache_file('UD_1', None, 100))
+    clock.now += 100
+
+    assert file_cache.evict(0) == ['UD_1.gb.rec']
+
+
+def test_evict_grace(clock, cache_file):
+    """
+    Recently accessed files are not evicted.
+    """
+    first = cache_file('AB000001.1', 'ncbi', 100)
+    file_cache.add(first)
+    file_cache.add(cache_file('AB000002.1', 'ncbi', 100))
+    clock.now += file_cache.EVICTION_GRACE
+    file_cache.access(first)
+    clock.now += 1
+
+    assert file_cache.evict(0) == ['AB000002.1.gb.bz2']
+
+
+def test_add_limit(monkeypatch, settings, clock, cache_file):
+    """
+    Adding files beyond `FILE_CACHE_SIZE` evicts the least recently used
+    files.
+    """
+    monkeypatch.setitem(settings, 'FILE_CACHE_SIZE', 1000)
+
+    for i in range(10):
+        file_cache.add(cache_file('AB00000%d.1' % i, 'ncbi', 100))
+        clock.now += 100
+    assert file_cache.report()['size'] == 1000
+
+    file_cache.add(cache_file('AB000010.1', 'ncbi', 100))
+    assert file_cache.report()['size'] == 900
+    assert not os.path.exists(
+        os.path.join(settings.CACHE_DIR, 'AB000000.1.gb.bz2'))
+    assert not os.path.exists(
+        os.path.join(settings.CACHE_DIR, 'AB000001.1.gb.bz2'))
+
+
+def test_add_concurrent(monkeypatch, settings, cache_file):
+    """
+    Adding a file while another process adds the same file counts its size
+    once.
+    """
+    filename = cache_file('AB000001.1', 'ncbi', 100)
+
+    # Add the file again right after reading its previous size.
+    hget = file_cache.redis.hget
+    concurrent = [filename]
+    def racing_hget(*args, **kwargs):
+        value = hget(*args, **kwargs)
+        if concurrent:
+            file_cache.add(concurrent.pop())
+        return value
+    monkeypatch.setattr(file_cache.redis, 'hget', racing_hget)
+
+    file_cache.add(filename)
+    assert int(file_cache.redis.get(file_cache.TOTAL_KEY)) == 100
+
+
+def test_scan(settings, clock, cache_file):
+    """
+    Scanning the cache directory adds untracked files and forgets missing
+    files.
+    """
+    file_cache.add(cache_file('AB000001.1', 'ncbi', 100))
+    cache_file('AB000002.1', 'ncbi', 200)
+    cache_file('UD_1', 'upload', 300)
+    cache_file('batch-job-1', None, 400, 'txt')
+    os.remove(os.path.join(settings.CACHE_DIR, 'AB000001.1.gb.bz2'))
+
+    assert file_cache.scan() == (2, 1)
+    assert file_cache.report() == {'files': 2,
+                                   'size': 500,
+                                   'pinned_files': 1,
+                                   'pinned_size': 300,
+                                   'oldest_access': os.path.getmtime(
+                                       os.path.join(settings.CACHE_DIR,
+                                                    'AB000002.1.gb.bz2'))}
+
+
+def test_clean_locks(settings):
+    """
+    Unused lock files are removed, except for the permanent lock files.
+    """
+    directory = os.path.join(settings.CACHE_DIR, 'locks')
+    os.mkdir(directory)
+    for name in ('AB000001.1.lock', 'slice-NC_000001.10%3A1%3A2.lock',
+                 'AB000002.1.lock', 'batch-processor.lock',
+                 'file-cache.lock'):
+        open(os.path.join(directory, name), 'w').close()
+
+    with open(os.path.join(directory, 'AB000002.1.lock')) as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        assert file_cache.clean_locks() == 2
+
+    assert sorted(os.listdir(directory)) == [
+        'AB000002.1.lock', 'batch-processor.lock', 'file-cache.lock']
+
+
+@with_references('NM_003002.2')
+def test_retriever(settings, counters):
+    """
+    Reference files and compact record files used by the retriever are
+    tracked.
+    """
+    def file_cache_counters():
+        return {counter: count for counter, count in counters.items()
+                if counter.startswith('file-cache/')}
+
+    retriever = GenBankRetriever(Output(__file__))
+    assert retriever.loadrecord('NM_003002.2')
+    assert file_cache_counters() == {'file-cache/hit': 1}
+    assert file_cache.report()['files'] == 2
+
+    # The compact record file is enough to load the record.
+    os.remove(os.path.join(settings.CACHE_DIR, 'NM_003002.2.gb.bz2'))
+    record_cache.invalidate()
+    assert retriever.loadrecord('NM_003002.2')
+    assert file_cache_counters() == {'file-cache/hit': 1}
+
+    os.remove(os.path.join(settings.CACHE_DIR, 'NM_003002.2.gb.rec'))
+    record_cache.invalidate()
+    assert retriever.loadrecord('NM_003002.2') is None
+    assert file_cache_counters() == {'file-cache/hit': 1,
+                                     'file-cache/miss': 1}
@@ -0,0 +1,170 @@
+"""
+Tests for the mutalyzer.log module.
+"""
+
+
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import threading
+
+import pytest
+
+from mutalyzer import log
+from mutalyzer.output import Output
+
+
+def _read(path):
+    with io.open(path, encoding='utf-8') as handle:
+        return handle.read().splitlines()
+
+
+@pytest.mark.parametrize('queue_size', [0, 10])
+def test_output_log(monkeypatch, settings, queue_size):
+    """
+    Messages of sufficient level are written to the log file.
+    """
+    monkeypatch.setattr(settings, 'LOG_QUEUE_SIZE', queue_size)
+    monkeypatch.setattr(log, 'sink', log.LogSink())
+
+    output = Output('test')
+    output.addMessage('test', -1, 'INFO', 'Received variant')
+    output.addMessage('test', 2, 'WTEST', 'Not logged')
+    output.addMessage('test', 3, 'ETEST', 'Logged error')
+    log.sink.flush()
+
+    lines = _read(settings.LOG_FILE)
+    assert len(lines) == 2
+    assert lines[0].endswith(' test (test) INFO: : Received variant')
+    assert lines[1].endswith(' test (test) ETEST: Error: Logged error')
+
+
+def test_output_log_json(monkeypatch, settings):
+    """
+    Structured log messages include the request id.
+    """
+    monkeypatch.setattr(settings, 'LOG_FORMAT', 'json')
+    monkeypatch.setattr(log, 'sink', log.LogSink())
+
+    outputs = Output('test'), Output('test')
+    for output in outputs:
+        output.addMessage('test', -1, 'INFO', 'Received variant')
+    log.sink.flush()
+
+    records = [json.loads(line) for line in _read(settings.LOG_FILE)]
+    assert [record['request'] for record in records] == [
+        output.request_id for output in outputs]
+    assert records[0]['code'] == 'INFO'
+    assert records[0]['message'] == 'Received variant'
+
+
+def test_drop(monkeypatch, settings):
+    """
+    Messages are dropped if the queue is full, and the number of dropped
+    messages is logged.
+    """
+    monkeypatch.setattr(settings, 'LOG_QUEUE_SIZE', 2)
+    sink = log.LogSink()
+
+    entered = threading.Event()
+    release = threading.Event()
+    write = sink._write
+    def blocking_write(records):
+        entered.set()
+        release.wait()
+        write(records)
+    monkeypatch.setattr(sink, '_write', blocking_write)
+
+    def emit(message):
+        sink.emit(request=None, instance='test', origin='test',
+                  code='INFO', level='Log', message=message)
+
+    emit('first')
+    entered.wait()
+    for i in range(5):
+        emit('message %d' % i)
+    release.set()
+    sink.flush()
+    emit('last')
+    sink.flush()
+
+    lines = _read(settings.LOG_FILE)
+    assert [line.split(': ')[-1] for line in lines] == [
+        'first', 'message 0', 'message 1', 'Dropped 3 log messages', 'last']
+
+
+def test_rotate(monkeypatch, settings):
+    """
+    The log file is rotated when it exceeds the maximum size.
+    """
+    monkeypatch.setattr(settings, 'LOG_QUEUE_SIZE', 0)
+    monkeypatch.setattr(settings, 'LOG_MAX_BYTES', 200)
+    monkeypatch.setattr(settings, 'LOG_BACKUP_COUNT', 2)
+    sink = log.LogSink()
+
+    for i in range(20):
+        sink.emit(request=None, instance='test', origin='test', code='INFO',
+                  level='Log', message='message %d' % i)
+
+    assert os.path.getsize(settings.LOG_FILE) < 200
+    assert os.path.isfile(settings.LOG_FILE + '.1')
+    assert os.path.isfile(settings.LOG_FILE + '.2')
+    assert not os.path.exists(settings.LOG_FILE + '.3')
+
+    # The most recent messages are kept, in order.
+    numbers = [int(line.split(' ')[-1])
+               for suffix in ('.2', '.1', '')
+               for line in _read(settings.LOG_FILE + suffix)]
+    assert numbers == range(20 - len(numbers), 20)
+
+
+def test_fork(monkeypatch, settings):
+    """
+    In a forked process, the sink does not use the lock inherited from the
+    parent process.
+    """
+    monkeypatch.setattr(settings, 'LOG_QUEUE_SIZE', 10)
+    sink = log.LogSink()
+    sink.emit(request=None, instance='test', origin='test', code='INFO',
+              level='Log', message='parent')
+    sink.flush()
+
+    # Simulate a fork while the writer thread holds the lock.
+    sink._lock.acquire()
+    monkeypatch.setattr(log.os, 'getpid', lambda: -1)
+
+    emitted = threading.Thread(target=sink.emit, kwargs={
+        'request': None, 'instance': 'test', 'origin': 'test',
+        'code': 'INFO', 'level': 'Log', 'message': 'child'})
+    emitted.start()
+    emitted.join(5)
+    assert not emitted.is_alive()
+    sink.flush()
+
+    lines = _read(settings.LOG_FILE)
+    assert [line.split(': ')[-1] for line in lines] == ['parent', 'child']
+
+
+def test_write_error(monkeypatch, settings):
+    """
+    An unexpected error while writing does not stop the writer thread.
+    """
+    monkeypatch.setattr(settings, 'LOG_QUEUE_SIZE', 10)
+    sink = log.LogSink()
+
+    format_record = log.format_record
+    def failing_format_record(record):
+        if record['message'] == 'failing':
+            raise ValueError('failing record')
+        return format_record(record)
+    monkeypatch.setattr(log, 'format_record', failing_format_record)
+
+    for message in 'failing', 'last':
+        sink.emit(request=None, instance='test', origin='test',
+                  code='INFO', level='Log', message=message)
+        sink.flush()
+
+    lines = _read(settings.LOG_FILE)
+    assert [line.split(': ')[-1] for line in lines] == ['last']
@@ -0,0 +1,72 @@
+"""
+Tests for the mutalyzer.lookup_cache module.
+"""
+
+
+from __future__ import unicode_literals
+
+from mutalyzer.db.models import Reference, TranscriptMapping
+from mutalyzer import lookup_cache
+from mutalyzer import mapping_index
+
+from fixtures import with_references
+
+
+@with_references('NM_003002.2')
+def test_get_reference(db, counters):
+    """
+    References are cached and the cache is used after changes only after
+    invalidation.
+    """
+    checksum = Reference.query.filter_by(
+        accession='NM_003002.2').one().checksum
+    db.session.remove()
+
+    reference = lookup_cache.get_reference('NM_003002.2')
+    assert reference.checksum == checksum
+    assert reference in db.session
+
+    Reference.query.filter_by(accession='NM_003002.2').update(
+        {'checksum': 'changed'})
+    db.session.commit()
+    db.session.remove()
+    assert lookup_cache.get_reference('NM_003002.2').checksum == checksum
+
+    lookup_cache.invalidate_reference('NM_003002.2')
+    db.session.remove()
+    assert lookup_cache.get_reference('NM_003002.2').checksum == 'changed'
+
+    assert counters == {'reference-lookup/hit': 1,
+                        'reference-lookup/miss': 2}
+
+
+def test_get_reference_missing(db):
+    """
+    Unknown references are not cached.
+    """
+    assert lookup_cache.get_reference('AB026906.1') is None
+
+    db.session.add(Reference('AB026906.1', 'checksum', 'ncbi'))
+    db.session.commit()
+    assert lookup_cache.get_reference('AB026906.1').checksum == 'checksum'
+
+
+def test_get_transcript_versions(db, hg19, hg19_transcript_mappings,
+                                 counters):
+    """
+    Transcript versions are cached until the transcript mappings are
+    invalidated.
+    """
+    assert lookup_cache.get_transcript_versions(hg19, 'NM_003002') == [2]
+    assert lookup_cache.get_transcript_versions(hg19, 'NM_000000') == []
+
+    TranscriptMapping.query.filter_by(accession='NM_003002').update(
+        {'version': 3})
+    db.session.commit()
+    assert lookup_cache.get_transcript_versions(hg19, 'NM_003002') == [2]
+
+    mapping_index.invalidate()
+    assert lookup_cache.get_transcript_versions(hg19, 'NM_003002') == [3]
+
+    assert counters == {'transcript-versions/hit': 1,
+                        'transcript-versions/miss': 3}
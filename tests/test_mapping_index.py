@@ -0,0 +1,71 @@
+"""
+Tests for the mutalyzer.mapping_index module.
+"""
+
+
+from __future__ import unicode_literals
+
+import pytest
+
+from mutalyzer.db.models import TranscriptMapping
+from mutalyzer import mapping_index
+
+
+pytestmark = pytest.mark.usefixtures('hg19_transcript_mappings')
+
+
+@pytest.fixture
+def chr11(hg19):
+    return hg19.chromosomes.filter_by(name='chr11').one()
+
+
+def test_overlapping(chr11):
+    """
+    Overlapping mappings are found and ordered by position.
+    """
+    index = mapping_index.get_index(chr11)
+    assert [m.accession for m in index.overlapping(111957500, 111957600)] \
+        == ['NM_012459', 'NR_028383', 'NM_003002']
+    assert [m.accession for m in index.overlapping(111966518, 111966518)] \
+        == ['NM_003002']
+    assert index.overlapping(111966519, 111970000) == []
+
+
+def test_contained(chr11):
+    """
+    Contained mappings are found and ordered by position.
+    """
+    index = mapping_index.get_index(chr11)
+    assert [m.accession for m in index.contained(111955000, 111960000)] \
+        == ['NM_012459', 'NR_028383']
+    assert index.contained(111955525, 111966517) == []
+
+
+def test_by_gene(chr11):
+    """
+    Mappings are found by gene.
+    """
+    index = mapping_index.get_index(chr11)
+    mappings = index.by_gene('SDHD')
+    assert [m.reference for m in mappings] == ['NM_003002.2']
+    assert mappings[0].cds == (111957632, 111965694)
+    assert mappings[0].crossmap is mappings[0].crossmap
+    assert index.by_gene('UNKNOWN') == []
+
+
+def test_invalidate(db, chr11):
+    """
+    The index is reloaded after invalidation.
+    """
+    index = mapping_index.get_index(chr11)
+    assert mapping_index.get_index(chr11) is index
+
+    db.session.add(TranscriptMapping(
+        chr11, 'refseq', 'NM_000000', 'TEST', 'forward', 111970000,
+        111971000, [111970000], [111971000], 'ncbi', version=1))
+    db.session.commit()
+    assert index.by_gene('TEST') == []
+
+    mapping_index.invalidate()
+    index = mapping_index.get_index(chr11)
+    assert [m.reference for m in index.by_gene('TEST')] == ['NM_000000.1']
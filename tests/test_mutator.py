@@ -1294,3 +1294,38 @@ def test_adjecent_ins_inv_2(mutator):
     mutator.insertion(2, 'G')
     mutator.inversion(2, 2)
     assert unicode(mutator.mutated) == unicode(Seq('AAGCGATCG'))
+
+
+@pytest.mark.parametrize('length', [200])
+def test_mutated_slices(length, sequence, mutator):
+    """
+    Reading (parts of) the mutated sequence after a series of mutations
+    should give the same result as rebuilding the sequence for every
+    mutation.
+    """
+    mutated = unicode(sequence)
+    shifts = {}
+    for start, stop, ins in [(180, 190, ''), (150, 150, 'TTAGG'),
+                             (100, 101, 'C'), (60, 70, 'GA'),
+                             (20, 20, 'ACGTACGT')]:
+        if start == stop:
+            mutator.insertion(start, ins)
+        else:
+            mutator.delins(start + 1, stop, ins)
+        correct = 1 if start == stop else 0
+        new_start = start + 1 + sum(s for p, s in shifts.items()
+                                    if p <= start + 1) - 1
+        new_stop = stop + correct + sum(s for p, s in shifts.items()
+                                        if p <= stop + correct) - correct
+        mutated = mutated[:new_start] + ins + mutated[new_stop:]
+        shifts[stop + 1] = shifts.get(stop + 1, 0) + start - stop + len(ins)
+
+    assert unicode(mutator.mutated) == mutated
+    assert len(mutator.mutated) == len(mutated)
+    for i in range(0, length + 1, 7):
+        assert mutator.shift(i) == i + sum(s for p, s in shifts.items()
+                                           if p <= i)
+    for i in range(0, len(mutated), 7):
+        assert unicode(mutator.mutated[i:i + 30]) == mutated[i:i + 30]
+        assert mutator.mutated[i] == mutated[i]
+    assert unicode(mutator.mutated[-15:]) == mutated[-15:]
@@ -5,6 +5,11 @@ Tests for the mutalyzer.ncbi module.
 
 from __future__ import unicode_literals
 
+import BaseHTTPServer
+import io
+import threading
+import urlparse
+
 import Bio.Entrez
 import pytest
 
@@ -411,3 +416,191 @@ def test_protein_to_transcript_cache(accession, version, match_version,
     reverse = [(redis.get(key) or None, key.split(':')[-1])
                for key in redis.keys('ncbi:protein-to-transcript:*')]
     assert sorted(reverse) == sorted(expected_reverse)
+
+
+class EntrezHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Local stand-in for the Entrez esearch, esummary, and elink utilities.
+    Records are numbered from 1, in the order of the `records` attribute of
+    the server.
+    """
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        parameters = urlparse.parse_qs(self.rfile.read(length))
+        utility = self.path.split('/')[-1].split('.')[0]
+        self.server.requests.append(utility)
+
+        if self.server.fail:
+            self.send_response(500)
+            self.end_headers()
+            return
+
+        records = self.server.records
+        if utility == 'esearch':
+            terms = parameters['term'][0].split(' OR ')
+            ids = [str(gi) for gi, record in enumerate(records, 1)
+                   if record in terms or record.split('.')[0] in terms]
+            body = '<eSearchResult><IdList>%s</IdList></eSearchResult>' % \
+                ''.join('<Id>%s</Id>' % gi for gi in ids)
+        elif utility == 'esummary':
+            body = '<eSummaryResult>%s</eSummaryResult>' % ''.join(
+                '<DocSum><Id>%s</Id><Item Name="AccessionVersion" '
+                'Type="String">%s</Item></DocSum>' % (gi, records[int(gi) - 1])
+                for gi in parameters['id'][0].split(','))
+        else:
+            linksets = []
+            for gi in parameters['id']:
+                target = self.server.links.get(records[int(gi) - 1])
+                link = ''
+                if target:
+                    link = ('<LinkSetDb><LinkName>nuccore_protein</LinkName>'
+                            '<Link><Id>%d</Id></Link></LinkSetDb>' %
+                            (records.index(target) + 1))
+                linksets.append('<LinkSet><IdList><Id>%s</Id></IdList>%s'
+                                '</LinkSet>' % (gi, link))
+            body = '<eLinkResult>%s</eLinkResult>' % ''.join(linksets)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', len(body))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def entrez_server(monkeypatch, settings):
+    """
+    Local stand-in for the Entrez service with some transcript-protein
+    links.
+    """
+    server = BaseHTTPServer.HTTPServer(('localhost', 0), EntrezHandler)
+    server.records = ['NM_11111.1', 'NM_11111.2', 'NM_22222.2', 'NM_33333.4',
+                      'NM_33333.5', 'NP_11111.2', 'NP_33333.5']
+    server.links = {'NM_11111.2': 'NP_11111.2', 'NM_33333.5': 'NP_33333.5'}
+    server.requests = []
+    server.fail = False
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    monkeypatch.setitem(settings, 'ENTREZ_URL',
+                        'http://localhost:%d/eutils' % server.server_port)
+    monkeypatch.setitem(settings, 'ENTREZ_API_KEY', 'test')
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_transcripts_to_proteins(entrez_server):
+    """
+    Get proteins for transcripts in a fixed number of requests.
+    """
+    transcripts = [('NM_11111', 2), ('NM_11111', 1), ('NM_22222', 2),
+                   ('NM_33333', None), ('NM_44444', 1)]
+    expected = {('NM_11111', 2): ('NP_11111', 2),
+                ('NM_11111', 1): None,
+                ('NM_22222', 2): None,
+                ('NM_33333', None): ('NP_33333', None),
+                ('NM_44444', 1): None}
+
+    assert ncbi.transcripts_to_proteins(transcripts) == expected
+    assert entrez_server.requests == ['esearch', 'esummary', 'elink',
+                                      'esummary']
+
+    # Links are now in the cache, also for single lookups.
+    assert ncbi.transcripts_to_proteins(transcripts) == expected
+    assert ncbi.transcript_to_protein('NM_11111', 2) == ('NP_11111', 2)
+    assert ncbi.protein_to_transcript('NP_33333') == ('NM_33333', None)
+    with pytest.raises(ncbi.NoLinkError):
+        ncbi.transcript_to_protein('NM_22222', 2)
+    assert len(entrez_server.requests) == 4
+
+
+def test_transcripts_to_proteins_match_version(entrez_server):
+    """
+    Links without matching version are found if `match_version` is `False`.
+    """
+    transcripts = [('NM_11111', 1), ('NM_33333', 4), ('NM_33333', 6)]
+    assert ncbi.transcripts_to_proteins(transcripts,
+                                        match_version=False) == {
+        ('NM_11111', 1): ('NP_11111', None),
+        ('NM_33333', 4): ('NP_33333', None),
+        ('NM_33333', 6): ('NP_33333', None)}
+    assert len(entrez_server.requests) == 7
+
+
+def test_transcripts_to_proteins_error(entrez_server):
+    """
+    Links cannot be found on service errors, this is not cached.
+    """
+    entrez_server.fail = True
+    assert ncbi.transcripts_to_proteins([('NM_11111', 2)]) == {
+        ('NM_11111', 2): None}
+
+    entrez_server.fail = False
+    assert ncbi.transcripts_to_proteins([('NM_11111', 2)]) == {
+        ('NM_11111', 2): ('NP_11111', 2)}
+
+
+def _docsum_response(*records):
+    """
+    Entrez efetch result for dbSNP records given as `(uid, docsum)` tuples.
+    """
+    return io.BytesIO(
+        ('<?xml version="1.0" ?>\n'
+         '<ExchangeSet xmlns="https://www.ncbi.nlm.nih.gov/SNP/docsum">%s'
+         '</ExchangeSet>' % ''.join(
+             '<DocumentSummary uid="%s"><SNP_ID>%s</SNP_ID>'
+             '<DOCSUM>%s</DOCSUM></DocumentSummary>' % (uid, uid, docsum)
+             for uid, docsum in records)).encode('utf-8'))
+
+
+def test_cache_rsids(monkeypatch, output):
+    """
+    Retrieve dbSNP records in bulk.
+    """
+    requests = []
+
+    def mock_efetch(db=None, id=None, retmode=None):
+        requests.append(id)
+        return _docsum_response(
+            ('11', 'HGVS=NM_003002.3:c.204C>T,NM_003002.4:c.204C>T|SEQ=[C/T]'),
+            ('12', 'SEQ=[C/T]'))
+
+    monkeypatch.setattr(Bio.Entrez, 'efetch', mock_efetch)
+    assert ncbi.cache_rsids(['rs11', 'rs12', 'rs13', 'rs11', 'r14']) == 2
+    assert requests == ['11,12,13']
+
+    def mock_efetch(db=None, id=None, retmode=None):
+        requests.append(id)
+        return _docsum_response()
+
+    monkeypatch.setattr(Bio.Entrez, 'efetch', mock_efetch)
+    assert ncbi.cache_rsids(['rs11', 'rs12', 'rs13']) == 0
+    assert requests == ['11,12,13', '13']
+
+    assert ncbi.rsid_to_descriptions('rs11', output) == [
+        'NM_003002.3:c.204C>T', 'NM_003002.4:c.204C>T']
+    assert ncbi.rsid_to_descriptions('rs12', output) == []
+    assert requests == ['11,12,13', '13']
+
+    # Not found in bulk, the single lookup reports and caches this.
+    assert ncbi.rsid_to_descriptions('rs13', output) == []
+    assert ncbi.rsid_to_descriptions('rs13', output) == []
+    assert requests == ['11,12,13', '13', '13']
+    assert [message.code for message in output.getMessages()] == [
+        'EENTREZ', 'EENTREZ']
+
+
+def test_cache_rsids_error(monkeypatch):
+    """
+    Errors in bulk retrieval of dbSNP records are not cached.
+    """
+    monkeypatch.setattr(Bio.Entrez, 'efetch', lambda **kwargs: io.BytesIO(
+        b'<ExchangeSet><DocumentSummary'))
+    assert ncbi.cache_rsids(['rs11']) == 0
+    assert redis.keys('ncbi:rsid-to-descriptions:*') == []
@@ -5,11 +5,15 @@ Tests for the mutalyzer.parsers.genbank module.
 
 from __future__ import unicode_literals
 
+import bz2
+import codecs
 import os
 
+from Bio import SeqIO
 import pytest
 
-from mutalyzer.parsers.genbank import GBparser
+from mutalyzer.parsers.genbank import FEATURES, GBparser
+from mutalyzer.parsers.genbank_reader import read_record
 
 from fixtures import with_references
 
@@ -153,3 +157,38 @@ def test_mrna_and_cds_addition_to_genes(settings, references, parser):
            [None]
     assert [t.proteinID for t in record.geneList[1].transcriptList] == \
            ['NP_000454.1']
+
+
+@pytest.mark.parametrize('filename', [
+    'AB026906.1.gb.bz2', 'NG_008939.1.gb.bz2', 'NM_004006.2.gb.bz2',
+    'NP_064445.1.gb.bz2', 'UD_139015208095.gb.bz2'])
+def test_read_record(filename):
+    """
+    The streaming reader gives the same record as BioPython, only including
+    the features and qualifiers used by the parser.
+    """
+    path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data',
+                        filename)
+
+    def read(reader):
+        with bz2.BZ2File(path) as handle:
+            return reader(codecs.getreader('utf-8')(handle))
+
+    expected = read(lambda handle: SeqIO.read(handle, 'genbank'))
+    record = read(lambda handle: read_record(handle, FEATURES))
+
+    assert record.id == expected.id
+    assert record.annotations == expected.annotations
+    assert record.seq.alphabet == expected.seq.alphabet
+    assert unicode(record.seq) == unicode(expected.seq)
+
+    expected_features = [feature for feature in expected.features
+                         if feature.type in FEATURES]
+    assert len(record.features) == len(expected_features)
+    for feature, expected_feature in zip(record.features, expected_features):
+        assert feature.type == expected_feature.type
+        assert feature.location == expected_feature.location
+        qualifiers = FEATURES[feature.type]
+        assert feature.qualifiers == {
+            key: value for key, value in expected_feature.qualifiers.items()
+            if qualifiers is None or key in qualifiers}
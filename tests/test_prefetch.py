@@ -0,0 +1,143 @@
+"""
+Tests for the mutalyzer.prefetch module.
+"""
+
+
+from __future__ import unicode_literals
+
+import threading
+
+import pytest
+
+from mutalyzer import prefetch
+from mutalyzer import Retriever
+from mutalyzer.Scheduler import Scheduler
+
+from fixtures import with_references
+
+
+pytestmark = pytest.mark.usefixtures('db')
+
+
+@pytest.fixture
+def fetched(monkeypatch):
+    """
+    Record fetches by the retrievers instead of downloading.
+    """
+    fetched = []
+
+    def fetch(self, name):
+        fetched.append(name)
+        return None
+
+    monkeypatch.setattr(Retriever.GenBankRetriever, 'fetch', fetch)
+    monkeypatch.setattr(Retriever.LRGRetriever, 'fetch', fetch)
+    return fetched
+
+
+def test_job_references():
+    """
+    Distinct references are found, chromosomal references and invalid
+    descriptions are skipped.
+    """
+    assert prefetch.job_references([
+        'NM_003002.2:c.274G>T',
+        'NM_003002.2(SDHD_v001):c.274del',
+        'NM_003002:c.274G>T',
+        'LRG_1t1:c.266G>T',
+        'LRG_1:g.7T>C',
+        'NC_000011.9:g.111959693G>T',
+        'NG_012337.1(TIMM8B_v001):c.12del',
+        'NM_004006.2:c.274G>',
+        'not a description']) == [
+            ('GB', 'NG_012337.1'), ('GB', 'NM_003002'),
+            ('GB', 'NM_003002.2'), ('LRG', 'LRG_1')]
+
+
+@with_references('NM_003002.2')
+def test_prefetcher(monkeypatch, settings, fetched):
+    """
+    References added to the prefetcher are retrieved in the background, once
+    while waiting and only if they are not in the cache.
+    """
+    monkeypatch.setattr(settings, 'BATCH_PREFETCH_THREADS', 1)
+    prefetcher = prefetch.Prefetcher()
+
+    # Keep the only thread busy while adding the references.
+    started = threading.Event()
+    proceed = threading.Event()
+    def block():
+        started.set()
+        proceed.wait()
+    prefetcher._pool.apply_async(block)
+    started.wait()
+
+    prefetcher.add([('GB', 'NM_003002.2'), ('GB', 'NM_004006.2')])
+    prefetcher.add([('GB', 'NM_004006.2'), ('LRG', 'LRG_2')])
+    proceed.set()
+    prefetcher.join()
+    assert sorted(fetched) == ['LRG_2', 'NM_004006.2']
+
+
+def test_prefetcher_retry(monkeypatch, settings, fetched):
+    """
+    References that could not be retrieved are retrieved again if they are
+    added again.
+    """
+    monkeypatch.setattr(settings, 'BATCH_PREFETCH_THREADS', 1)
+    prefetcher = prefetch.Prefetcher()
+    prefetcher.add([('GB', 'NM_004006.2')])
+    prefetcher._pool.apply(lambda: None)
+    prefetcher.add([('GB', 'NM_004006.2')])
+    prefetcher.join()
+    assert fetched == ['NM_004006.2', 'NM_004006.2']
+
+
+@with_references('NM_003002.2')
+def test_prefetcher_job(monkeypatch, settings, fetched):
+    """
+    The references of the descriptions of a job are retrieved in the
+    background.
+    """
+    monkeypatch.setattr(settings, 'BATCH_PREFETCH_THREADS', 2)
+    prefetcher = prefetch.Prefetcher()
+    prefetcher.add_job(['NM_003002.2:c.274G>T', 'NM_004006.2:c.3del',
+                        'LRG_2:g.7del', 'not a description'])
+    prefetcher.join()
+    assert sorted(fetched) == ['LRG_2', 'NM_004006.2']
+
+
+def test_prefetcher_stopped(monkeypatch, settings, fetched):
+    """
+    Added references are skipped after the prefetcher is stopped.
+    """
+    monkeypatch.setattr(settings, 'BATCH_PREFETCH_THREADS', 2)
+    prefetcher = prefetch.Prefetcher()
+    prefetcher._stopped.set()
+    prefetcher.add([('GB', 'NM_004006.2')])
+    prefetcher.stop()
+    assert fetched == []
+
+
+def test_process_job(monkeypatch, settings):
+    """
+    References are prefetched for name checker jobs when the batch processor
+    starts processing them.
+    """
+    monkeypatch.setattr(settings, 'BATCH_PREFETCH_THREADS', 2)
+    added = []
+    monkeypatch.setattr(prefetch.Prefetcher, 'add_job',
+                        lambda self, descriptions: added.append(descriptions))
+    monkeypatch.setattr(Scheduler, '_processItem',
+                        lambda self, batch_job, item, flags: ('\n', []))
+
+    scheduler = Scheduler()
+    scheduler.addJob('test@test.test', ['NM_003002.2:c.274G>T', '~!',
+                                        'LRG_1t1:c.266G>T'], 1,
+                     'name-checker')
+    scheduler.addJob('test@test.test', ['NM_003002.2:c.274G>T'], 1,
+                     'syntax-checker')
+    assert added == []
+
+    scheduler.process()
+    assert added == [['NM_003002.2:c.274G>T', ' ', 'LRG_1t1:c.266G>T']]
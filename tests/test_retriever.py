@@ -0,0 +1,444 @@
+"""
+Tests for the mutalyzer.Retriever module.
+"""
+
+
+from __future__ import unicode_literals
+
+import bz2
+import os
+import random
+import threading
+import time
+
+from Bio.Seq import Seq
+import pytest
+
+from mutalyzer.db.models import Reference
+from mutalyzer import dbgb
+from mutalyzer import file_cache
+from mutalyzer.GenRecord import PList
+from mutalyzer.dbgb.models import Reference as GbReference, Transcript
+from mutalyzer import lookup_cache
+from mutalyzer import Retriever
+from mutalyzer.parsers import compact
+from mutalyzer.parsers import genbank
+from mutalyzer.record_cache import cache as record_cache
+from mutalyzer.output import Output
+from mutalyzer.Retriever import GenBankRetriever
+from mutalyzer.sequence import MappedSequence
+
+from fixtures import with_references
+
+
+@pytest.fixture
+def retriever(output):
+    return GenBankRetriever(output)
+
+
+@pytest.fixture
+def count_parses(monkeypatch):
+    """
+    Count the number of calls to `GBparser.create_record`.
+    """
+    counter = {'parses': 0}
+    create_record = genbank.GBparser.create_record
+    def counting_create_record(self, filename):
+        counter['parses'] += 1
+        return create_record(self, filename)
+    monkeypatch.setattr(genbank.GBparser, 'create_record',
+                        counting_create_record)
+    return counter
+
+
+@with_references('NM_003002.2')
+def test_loadrecord_cached(retriever, count_parses):
+    """
+    Loading the same record twice should parse the reference file only once
+    and return distinct copies.
+    """
+    first = retriever.loadrecord('NM_003002.2')
+    second = retriever.loadrecord('NM_003002.2')
+    assert count_parses['parses'] == 1
+    assert first is not second
+    assert first.seq is second.seq
+    assert first.listGenes() == second.listGenes()
+
+    # Modifying a loaded record does not affect the cache.
+    first.geneList[0].transcriptList = []
+    third = retriever.loadrecord('NM_003002.2')
+    assert third.geneList[0].transcriptList
+
+
+@with_references('NM_003002.2')
+def test_loadrecord_checksum_changed(db, retriever, count_parses):
+    """
+    A changed reference checksum should invalidate the cached record.
+    """
+    retriever.loadrecord('NM_003002.2')
+    Reference.query.filter_by(accession='NM_003002.2').update(
+        {'checksum': '0' * 32})
+    db.session.commit()
+    lookup_cache.invalidate_reference('NM_003002.2')
+    retriever.loadrecord('NM_003002.2')
+    assert count_parses['parses'] == 2
+
+
+@with_references('NM_003002.2')
+def test_loadrecord_cache_disabled(monkeypatch, settings, retriever,
+                                   count_parses):
+    """
+    Records are not cached if the cache size is zero.
+    """
+    monkeypatch.setattr(settings, 'RECORD_CACHE_SIZE', 0)
+    retriever.loadrecord('NM_003002.2')
+    os.unlink(os.path.join(settings.CACHE_DIR, 'NM_003002.2.gb.rec'))
+    retriever.loadrecord('NM_003002.2')
+    assert count_parses['parses'] == 2
+    assert len(record_cache) == 0
+
+
+@with_references('NM_003002.2', 'NM_004006.2')
+def test_loadrecord_cache_eviction(monkeypatch, settings, retriever,
+                                   count_parses):
+    """
+    The least recently used record is evicted if the cache is full.
+    """
+    monkeypatch.setattr(settings, 'RECORD_CACHE_SIZE', 1)
+    retriever.loadrecord('NM_003002.2')
+    retriever.loadrecord('NM_004006.2')
+    record_cache.invalidate('NM_004006.2')
+    assert len(record_cache) == 0
+    retriever.loadrecord('NM_004006.2')
+    retriever.loadrecord('NM_003002.2')
+    assert len(record_cache) == 1
+    assert count_parses['parses'] == 2
+
+
+@with_references('NM_003002.2', 'NG_012337.1', 'AB026906.1')
+def test_compact_record(settings, references, retriever, count_parses):
+    """
+    Records loaded from a compact record file should be identical to the
+    parsed records.
+    """
+    for reference in references:
+        parsed = retriever.loadrecord(reference.accession)
+        record_cache.invalidate()
+        loaded = retriever.loadrecord(reference.accession)
+        assert loaded is not parsed
+        assert isinstance(loaded.seq, MappedSequence)
+        assert unicode(loaded.seq) == unicode(parsed.seq)
+        assert type(loaded.seq.alphabet) == type(parsed.seq.alphabet)
+        assert compact._serialize(loaded) == compact._serialize(parsed)
+    assert count_parses['parses'] == len(references)
+
+
+def test_compact_serialize_tuples():
+    """
+    Tuples in a record structure are restored as tuples.
+    """
+    plist = PList()
+    plist.location = (10, 20)
+    plist.positionList = [(1, 2), [3, 4]]
+    restored = compact._deserialize(compact._serialize(plist))
+    assert restored.location == (10, 20)
+    assert restored.positionList == [(1, 2), [3, 4]]
+    assert type(restored.positionList[1]) == list
+
+
+@with_references('NM_003002.2')
+def test_compact_record_stale(settings, retriever):
+    """
+    A compact record file for another checksum should not be used.
+    """
+    filename = os.path.join(settings.CACHE_DIR, 'NM_003002.2.gb.rec')
+    record = retriever.loadrecord('NM_003002.2')
+    assert compact.create_record(filename).listGenes() == record.listGenes()
+    assert compact.create_record(filename).seq._mapping is \
+        compact.create_record(filename).seq._mapping
+    assert compact.create_record(filename, '0' * 32) is None
+
+    with open(filename, 'r+b') as handle:
+        handle.write(b'garbage')
+    assert compact.create_record(filename) is None
+
+
+@with_references('NM_003002.2', 'NM_004006.2')
+def test_build_compact_record(settings, references, retriever):
+    """
+    Compact record files are built for references without an up to date
+    compact record file.
+    """
+    assert retriever.build_compact_record(references[0])
+    assert not retriever.build_compact_record(references[0])
+    assert retriever.build_compact_record(references[0], force=True)
+    assert retriever.build_compact_record(references[1])
+    assert os.path.isfile(
+        os.path.join(settings.CACHE_DIR, 'NM_004006.2.gb.rec'))
+
+
+@pytest.fixture
+def genbank_data():
+    """
+    Raw data of a GenBank file.
+    """
+    path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data',
+                        'AB026906.1.gb.bz2')
+    with bz2.BZ2File(path) as handle:
+        return handle.read()
+
+
+def test_write_loadrecord(db, monkeypatch, settings, retriever,
+                          count_parses, genbank_data):
+    """
+    A record written by the retriever while loading it is not parsed again.
+    """
+    def fetch(self, name):
+        self.write(genbank_data, name, 0)
+        return self._update_db_md5(genbank_data, name, 'ncbi')
+
+    monkeypatch.setattr(GenBankRetriever, '_fetch', fetch)
+
+    record = retriever.loadrecord('AB026906.1')
+    assert count_parses['parses'] == 0
+    assert retriever._written_records is None
+
+    reference = Reference.query.filter_by(accession='AB026906.1').one()
+    parsed = retriever.parse_record(
+        os.path.join(settings.CACHE_DIR, 'AB026906.1.gb.bz2'), reference)
+    assert record.id == parsed.id == 'AB026906.1'
+    assert unicode(record.seq) == unicode(parsed.seq)
+    assert compact._serialize(record) == compact._serialize(parsed)
+
+
+def test_write_not_kept(db, retriever, count_parses, genbank_data):
+    """
+    A record written by the retriever outside of loading is not kept.
+    """
+    ud = retriever.uploadrecord(genbank_data)
+    assert retriever._written_records is None
+
+    retriever.loadrecord(ud)
+    assert count_parses['parses'] == 1
+
+
+def test_write_encoding(db, settings, retriever, genbank_data):
+    """
+    Files that are not UTF-8 encoded are written UTF-8 encoded.
+    """
+    ud = retriever.uploadrecord(
+        genbank_data.replace(b'/product="', b'/product="caf\xe9 ', 1))
+    with bz2.BZ2File(os.path.join(settings.CACHE_DIR,
+                                  '%s.gb.bz2' % ud)) as handle:
+        assert '/product="caf\xe9 ' in handle.read().decode('utf-8')
+
+    record = retriever.loadrecord(ud)
+    assert record.geneList[0].transcriptList[0].proteinProduct.startswith(
+        'caf\xe9 ')
+
+
+@pytest.mark.parametrize('accession', ['AB026906.1', 'AB026906'])
+def test_fetch_single_flight(db, monkeypatch, settings, genbank_data,
+                             accession):
+    """
+    Concurrent fetches of the same record download it only once, also if
+    the accession number has no version.
+    """
+    downloads = []
+
+    def fetch(self, name):
+        downloads.append(name)
+        time.sleep(0.1)
+        name = self.write(genbank_data, name, 1)
+        return self._update_db_md5(genbank_data, name, 'ncbi')
+
+    monkeypatch.setattr(GenBankRetriever, '_fetch', fetch)
+
+    filenames = []
+
+    def run():
+        try:
+            filenames.append(
+                GenBankRetriever(Output(__file__)).fetch(accession))
+        finally:
+            db.session.remove()
+
+    threads = [threading.Thread(target=run) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert downloads == [accession]
+    assert filenames == [os.path.join(settings.CACHE_DIR,
+                                      'AB026906.1.gb.bz2')] * 3
+    assert not [name for name in os.listdir(settings.CACHE_DIR)
+                if name.endswith('.tmp')]
+
+
+def test_lock_file(settings, retriever):
+    """
+    Lock files are in the locks directory, whatever the name.
+    """
+    directory = os.path.join(settings.CACHE_DIR, 'locks')
+    assert retriever._lock_file('AB026906.1') == os.path.join(
+        directory, 'AB026906.1.lock')
+    assert retriever._lock_file('slice-NC_000001.10:1:2:forward') == \
+        os.path.join(directory, 'slice-NC_000001.10%3A1%3A2%3Aforward.lock')
+    assert retriever._lock_file('../AB026906.1') == os.path.join(
+        directory, '..%2FAB026906.1.lock')
+    assert os.path.dirname(retriever._lock_file('x' * 300)) == directory
+
+
+def test_lock_removed(monkeypatch, settings, retriever):
+    """
+    A lock file that is removed while waiting for it is locked again.
+    """
+    locked = []
+    flock = Retriever.fcntl.flock
+    def removing_flock(handle, operation):
+        if operation == fcntl.LOCK_EX:
+            locked.append(os.fstat(handle.fileno()).st_ino)
+            if len(locked) == 1:
+                # Another process removes the lock file after we opened it.
+                assert file_cache.clean_locks() == 1
+        flock(handle, operation)
+
+    class fcntl(object):
+        LOCK_EX = Retriever.fcntl.LOCK_EX
+        LOCK_UN = Retriever.fcntl.LOCK_UN
+        flock = staticmethod(removing_flock)
+    monkeypatch.setattr(Retriever, 'fcntl', fcntl)
+
+    with retriever._lock('AB026906.1') as handle:
+        assert os.fstat(handle.fileno()).st_ino == os.stat(
+            retriever._lock_file('AB026906.1')).st_ino
+    assert len(locked) == 2
+
+
+@pytest.fixture
+def nc_store(request, monkeypatch, settings, tmpdir):
+    """
+    Chromosome NC_000099.1 of 2000 bases in the gbparser database and the
+    sequence store, with one transcript of gene TST1 on the reverse strand
+    and one of gene TST2 on the forward strand.
+    """
+    settings.configure({'DATABASE_GB_URI': 'sqlite://'})
+    request.addfinalizer(dbgb.session.remove)
+
+    monkeypatch.setitem(settings, 'SEQ_PATH', unicode(tmpdir) + '/')
+    sequence = ''.join(random.Random(42).choice('ACGT') for _ in range(2000))
+    tmpdir.join('checksum.sequence').write(sequence)
+
+    reference = GbReference('NC_000099', '1', 'checksum', 'checksum', 'ncbi',
+                            '01-JAN-2016', 2000, 'genomic DNA', '1')
+    dbgb.session.add(reference)
+    dbgb.session.commit()
+    for (gene, strand, transcript_start, transcript_stop, cds_start,
+         cds_stop, exons_start, exons_stop) in [
+            ('TST1', '-', 501, 900, 550, 800, '501,701', '600,900'),
+            ('TST2', '+', 1900, 1990, 1910, 1980, '1900', '1990')]:
+        transcript = Transcript(
+            'NM_%s' % gene, '1', 'NP_%s' % gene, '1', gene, None, strand,
+            transcript_start, transcript_stop, cds_start, cds_stop,
+            '%s mRNA' % gene, '%s protein' % gene, exons_start, exons_stop,
+            None, '1', None, None, 'mRNA')
+        transcript.reference_id = reference.id
+        dbgb.session.add(transcript)
+    dbgb.session.commit()
+
+    return sequence
+
+
+@pytest.mark.parametrize('orientation,exons,cds', [
+    (1, [101, 200, 301, 500], [150, 200, 301, 400]),
+    (2, [1051, 1250, 1351, 1450], [1151, 1250, 1351, 1401])])
+def test_retrieveslice_local(db, monkeypatch, nc_store, retriever,
+                             orientation, exons, cds):
+    """
+    Slices of chromosomes in the sequence store are created locally with
+    the transcripts in the slice. Transcripts that are partially in the slice
+    are clipped, like in the slices from the NCBI.
+    """
+    def efetch(*args, **kwargs):
+        raise AssertionError('Entrez efetch should not be used')
+    monkeypatch.setattr(Retriever.Entrez, 'efetch', efetch)
+
+    ud = retriever.retrieveslice('NC_000099.1', 401, 1950, orientation)
+
+    with bz2.BZ2File(retriever._name_to_file(ud)) as handle:
+        data = handle.read().decode('utf-8')
+    if orientation == 1:
+        assert '     mRNA            1500..>1550\n' in data
+        assert '     CDS             1510..>1550\n' in data
+    else:
+        assert '     mRNA            complement(<1..51)\n' in data
+        assert '     CDS             complement(<1..41)\n' in data
+
+    record = retriever.loadrecord(ud)
+
+    sequence = nc_store[400:1950]
+    if orientation == 2:
+        sequence = unicode(Seq(sequence).reverse_complement())
+    assert unicode(record.seq) == sequence
+    assert record.chromOffset == [401, 1950][orientation - 1]
+
+    assert [gene.name for gene in record.geneList] == ['TST1']
+    gene = record.geneList[0]
+    assert gene.orientation == [-1, 1][orientation - 1]
+    transcript = gene.transcriptList[0]
+    assert transcript.transcriptID == 'NM_TST1.1'
+    assert transcript.proteinID == 'NP_TST1.1'
+    assert transcript.mRNA.positionList == exons
+    assert transcript.CDS.positionList == cds
+
+    assert Reference.query.filter_by(accession=ud).one().source_data == \
+        'NC_000099.1:401:1950:%s' % ['forward', 'reverse'][orientation - 1]
+
+
+def test_retrieveslice_local_codon_start(db, monkeypatch, nc_store,
+                                         retriever):
+    """
+    The reading frame of a CDS in a local slice is kept if the start of the
+    CDS is clipped.
+    """
+    ud = retriever.retrieveslice('NC_000099.1', 1915, 2000, 1)
+
+    with bz2.BZ2File(retriever._name_to_file(ud)) as handle:
+        data = handle.read().decode('utf-8')
+    assert ('     CDS             <1..66\n'
+            '                     /gene="TST2"\n'
+            '                     /codon_start=2\n') in data
+
+
+def test_retrieveslice_not_local(db, monkeypatch, nc_store, retriever):
+    """
+    Slices of chromosomes not in the sequence store are fetched from the
+    NCBI.
+    """
+    fetched = []
+    def efetch(*args, **kwargs):
+        fetched.append(kwargs['id'])
+        raise IOError('No network')
+    monkeypatch.setattr(Retriever.Entrez, 'efetch', efetch)
+
+    assert retriever.retrieveslice('NC_000098.1', 401, 1950, 1) is None
+    assert fetched == ['NC_000098.1']
+
+
+def test_retrieveslice_local_error(db, monkeypatch, nc_store, retriever):
+    """
+    Slices that cannot be created locally are fetched from the NCBI.
+    """
+    def open_sequence(*args, **kwargs):
+        raise ValueError('Corrupt sequence')
+    monkeypatch.setattr(Retriever.nc_db, 'open_sequence', open_sequence)
+
+    fetched = []
+    def efetch(*args, **kwargs):
+        fetched.append(kwargs['id'])
+        raise IOError('No network')
+    monkeypatch.setattr(Retriever.Entrez, 'efetch', efetch)
+
+    assert retriever.retrieveslice('NC_000099.1', 401, 1950, 1) is None
+    assert fetched == ['NC_000099.1']
@@ -6,8 +6,11 @@ Tests for the mutalyzer.Scheduler module.
 from __future__ import unicode_literals
 
 import bz2
+import multiprocessing.dummy
 import os
 import io
+import threading
+import time
 
 import pytest
 import httplib
@@ -15,9 +18,11 @@ from Bio import Entrez
 from mock import patch
 
 from mutalyzer.config import settings
+from mutalyzer.db import queries
 from mutalyzer.db.models import BatchJob
 from mutalyzer import File
 from mutalyzer import output
+from mutalyzer import Retriever
 from mutalyzer import Scheduler
 
 from fixtures import with_references
@@ -210,10 +215,13 @@ def test_name_checker():
     _batch_job_plain_text(variants, expected, 'name-checker')
 
 
-def test_name_checker_altered():
+def test_name_checker_altered(monkeypatch):
     """
     Name checker job with altered entries.
     """
+    # The version warning is only given if NM_000059 is not prefetched.
+    monkeypatch.setattr(settings, 'BATCH_PREFETCH_THREADS', 0)
+
     variants = ['NM_000059:c.670dup',
                 'NM_000059:c.670G>T',
                 'NM_000059.3:c.670G>T']
@@ -288,10 +296,13 @@ def test_name_checker_altered():
         _batch_job_plain_text(variants, expected, 'name-checker')
 
 
-def test_name_checker_altered_long_entry():
+def test_name_checker_altered_long_entry(monkeypatch):
     """
     Name checker job with altered entries but that have one longer than 190 chars.
     """
+    # The version warning is only given if NM_000059 is not prefetched.
+    monkeypatch.setattr(settings, 'BATCH_PREFETCH_THREADS', 0)
+
     variants = ['NM_000059:c.670dup',
                 'NM_000059:c.3609_3788AAGTAATATTCCAACAAGTGGTGCCATAGGAAAAAGCAC'
                 'CCTGGTTCCCTTGGACACTCCATCTCCAGCCACATCATTGGAGGCATCAGAAGGGGGACT'
@@ -376,10 +387,14 @@ def test_name_checker_altered_long_entry():
 
 
 @with_references('NM_000059.3')
-def test_name_checker_skipped():
+@pytest.mark.parametrize('claim_size', [1, 100])
+def test_name_checker_skipped(monkeypatch, claim_size):
     """
-    Name checker job with skipped entries.
+    Name checker job with skipped entries, with the entries to skip either
+    claimed or still in the database.
     """
+    monkeypatch.setattr(settings, 'BATCH_CLAIM_SIZE', claim_size)
+
     variants = ['NM_1234567890.3:c.670G>T',
                 'NM_1234567890.3:c.570G>T',
                 'NM_000059.3:c.670G>T']
@@ -540,3 +555,277 @@ def test_windows_1252_input():
                  'OK']]
 
     _batch_job(batch_file, expected, 'syntax-checker')
+
+
+def test_workers_output_order(monkeypatch):
+    """
+    With multiple workers, results are written in input order even if items
+    finish out of order.
+    """
+    # We use a thread pool, worker processes cannot share the in-memory
+    # database.
+    monkeypatch.setattr(Scheduler.Scheduler, '_createPool',
+                        lambda self: multiprocessing.dummy.Pool(3))
+
+    # The grammar is not thread-safe, so we only run the sleeps
+    # concurrently.
+    lock = threading.Lock()
+    process_syntax_check = Scheduler.Scheduler._processSyntaxCheck
+    def slow_process_syntax_check(self, batch_job, cmd, flags):
+        # Earlier items take longer.
+        time.sleep(0.01 * (10 - int(cmd.split('.')[-1].split('_')[0])))
+        with lock:
+            return process_syntax_check(self, batch_job, cmd, flags)
+    monkeypatch.setattr(Scheduler.Scheduler, '_processSyntaxCheck',
+                        slow_process_syntax_check)
+
+    file_instance = File.File(output.Output('test'))
+    scheduler = Scheduler.Scheduler(workers=3)
+
+    result_ids = []
+    for email in 'a@test.test', 'b@test.test':
+        variants = ['AB026906.1:c.%d_%ddel' % (i, i + 1) for i in range(10)]
+        batch_file = io.BytesIO(('\n'.join(variants) + '\n').encode('utf-8'))
+        job, columns = file_instance.parseBatchFile(batch_file)
+        result_ids.append(scheduler.addJob(email, job, columns,
+                                           'syntax-checker'))
+
+    scheduler.process()
+
+    assert BatchJob.query.count() == 0
+
+    for result_id in result_ids:
+        filename = 'batch-job-%s.txt' % result_id
+        result = io.open(os.path.join(settings.CACHE_DIR, filename),
+                         encoding='utf-8')
+        next(result)  # Header.
+        assert [line.strip().split('\t') for line in result] == [
+            ['AB026906.1:c.%d_%ddel' % (i, i + 1), 'OK'] for i in range(10)]
+
+
+def test_stop_restores_claimed_items(monkeypatch):
+    """
+    Claimed items that are not processed when the scheduler is stopped are
+    put back in the queue in their original order.
+    """
+    file_instance = File.File(output.Output('test'))
+    scheduler = Scheduler.Scheduler()
+
+    process_syntax_check = Scheduler.Scheduler._processSyntaxCheck
+    def stopping_process_syntax_check(self, batch_job, cmd, flags):
+        scheduler.stop()
+        return process_syntax_check(self, batch_job, cmd, flags)
+    monkeypatch.setattr(Scheduler.Scheduler, '_processSyntaxCheck',
+                        stopping_process_syntax_check)
+
+    variants = ['AB026906.1:c.%d_%ddel' % (i, i + 1) for i in range(10)]
+    batch_file = io.BytesIO(('\n'.join(variants) + '\n').encode('utf-8'))
+    job, columns = file_instance.parseBatchFile(batch_file)
+    result_id = scheduler.addJob('test@test.test', job, columns,
+                                 'syntax-checker')
+    batch_job = BatchJob.query.filter_by(result_id=result_id).one()
+
+    scheduler.process()
+    assert [item.item for item in batch_job.batch_queue_items] == \
+        variants[1:]
+
+    monkeypatch.undo()
+    Scheduler.Scheduler().process()
+    assert BatchJob.query.count() == 0
+
+    filename = 'batch-job-%s.txt' % result_id
+    result = io.open(os.path.join(settings.CACHE_DIR, filename),
+                     encoding='utf-8')
+    next(result)  # Header.
+    assert [line.strip().split('\t') for line in result] == [
+        [variant, 'OK'] for variant in variants]
+
+
+def test_count_claimed_items(monkeypatch):
+    """
+    Claimed items without a written result are counted as items left.
+    """
+    file_instance = File.File(output.Output('test'))
+    scheduler = Scheduler.Scheduler()
+
+    counts = []
+    process_syntax_check = Scheduler.Scheduler._processSyntaxCheck
+    def counting_process_syntax_check(self, batch_job, cmd, flags):
+        counts.append(queries.count_batch_queue_items(
+            BatchJob.query.get(batch_job.id)))
+        scheduler.stop()
+        return process_syntax_check(self, batch_job, cmd, flags)
+    monkeypatch.setattr(Scheduler.Scheduler, '_processSyntaxCheck',
+                        counting_process_syntax_check)
+
+    variants = ['AB026906.1:c.%d_%ddel' % (i, i + 1) for i in range(10)]
+    batch_file = io.BytesIO(('\n'.join(variants) + '\n').encode('utf-8'))
+    job, columns = file_instance.parseBatchFile(batch_file)
+    result_id = scheduler.addJob('test@test.test', job, columns,
+                                 'syntax-checker')
+    batch_job = BatchJob.query.filter_by(result_id=result_id).one()
+
+    scheduler.process()
+    assert counts == [10]
+    assert queries.count_batch_queue_items(batch_job) == 9
+
+
+def test_name_checker_grouped_by_reference(monkeypatch):
+    """
+    Name checker items are processed grouped by reference, while the results
+    are written in input order.
+    """
+    processed = []
+    def process_name_batch(self, batch_job, cmd, flags):
+        processed.append(cmd)
+        return '%s\tOK\n' % cmd, []
+    monkeypatch.setattr(Scheduler.Scheduler, '_processNameBatch',
+                        process_name_batch)
+
+    variants = ['NM_003002.2:c.274G>T',
+                'NM_004006.2(DMD_v001):c.3G>T',
+                'LRG_1t1:c.266G>T',
+                'NM_003002.2(SDHD_v001):c.5del',
+                'LRG_1:g.7del',
+                'NM_004006.2:c.100del',
+                'NM_003002.2:c.6del']
+    expected = [[variant, 'OK'] for variant in variants]
+    _batch_job_plain_text(variants, expected, 'name-checker')
+
+    assert processed == [variants[i] for i in (0, 3, 6, 1, 5, 2, 4)]
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_unexpected_error(monkeypatch, workers):
+    """
+    An item that raises an exception gets an error line, the other items are
+    processed as usual.
+    """
+    monkeypatch.setattr(Scheduler.Scheduler, '_createPool',
+                        lambda self: multiprocessing.dummy.Pool(3))
+
+    # The grammar is not thread-safe.
+    lock = threading.Lock()
+    process_syntax_check = Scheduler.Scheduler._processSyntaxCheck
+    def failing_process_syntax_check(self, batch_job, cmd, flags):
+        if cmd == 'AB026906.1:c.5_6del':
+            raise ValueError('failing item')
+        with lock:
+            return process_syntax_check(self, batch_job, cmd, flags)
+    monkeypatch.setattr(Scheduler.Scheduler, '_processSyntaxCheck',
+                        failing_process_syntax_check)
+
+    file_instance = File.File(output.Output('test'))
+    scheduler = Scheduler.Scheduler(workers=workers)
+
+    variants = ['AB026906.1:c.%d_%ddel' % (i, i + 1) for i in range(10)]
+    batch_file = io.BytesIO(('\n'.join(variants) + '\n').encode('utf-8'))
+    job, columns = file_instance.parseBatchFile(batch_file)
+    result_id = scheduler.addJob('test@test.test', job, columns,
+                                 'syntax-checker')
+
+    scheduler.process()
+    assert BatchJob.query.count() == 0
+
+    filename = 'batch-job-%s.txt' % result_id
+    result = io.open(os.path.join(settings.CACHE_DIR, filename),
+                     encoding='utf-8')
+    next(result)  # Header.
+    assert [line.strip().split('\t') for line in result] == [
+        [variant, '(Scheduler): Unexpected error occurred, dev-team notified'
+         if variant == 'AB026906.1:c.5_6del' else 'OK']
+        for variant in variants]
+
+
+def test_processor_lock():
+    """
+    Only one batch processor can hold the lock.
+    """
+    with Scheduler.processor_lock() as locked:
+        assert locked
+        with Scheduler.processor_lock() as other_locked:
+            assert not other_locked
+    with Scheduler.processor_lock() as locked:
+        assert locked
+
+
+def test_workers_flags(monkeypatch):
+    """
+    With multiple workers, items in progress when an earlier item sets flags
+    are processed again with these flags.
+    """
+    monkeypatch.setattr(Scheduler.Scheduler, '_createPool',
+                        lambda self: multiprocessing.dummy.Pool(3))
+
+    def process_name_batch(self, batch_job, cmd, flags):
+        if cmd == 'NM_000059:c.670dup':
+            # Make sure the other items are in progress.
+            time.sleep(0.1)
+            return '%s\t%s\n' % (cmd, flags), [
+                ('A1', ('NM_000059', 'NM_000059.3', 'NM_000059.'))]
+        return '%s\t%s\n' % (cmd, flags), []
+    monkeypatch.setattr(Scheduler.Scheduler, '_processNameBatch',
+                        process_name_batch)
+
+    file_instance = File.File(output.Output('test'))
+    scheduler = Scheduler.Scheduler(workers=3)
+
+    variants = ['NM_000059:c.670dup',
+                'NM_000059:c.670G>T',
+                'NM_000059.3:c.670G>T',
+                'NM_000059:c.671del']
+    batch_file = io.BytesIO(('\n'.join(variants) + '\n').encode('utf-8'))
+    job, columns = file_instance.parseBatchFile(batch_file)
+    result_id = scheduler.addJob('test@test.test', job, columns,
+                                 'name-checker')
+
+    scheduler.process()
+
+    filename = 'batch-job-%s.txt' % result_id
+    result = io.open(os.path.join(settings.CACHE_DIR, filename),
+                     encoding='utf-8')
+    next(result)  # Header.
+    assert [line.rstrip('\n').split('\t') for line in result] == [
+        ['NM_000059:c.670dup', ''],
+        ['NM_000059.3:c.670G>T', 'A1'],
+        ['NM_000059.3:c.670G>T', ''],
+        ['NM_000059.3:c.671del', 'A1']]
+
+
+@with_references('NM_003002.2')
+def test_name_checker_group_loads_record_once(monkeypatch):
+    """
+    Name checker items on the same reference are processed together in one
+    worker, which loads the reference only once.
+    """
+    monkeypatch.setattr(Scheduler.Scheduler, '_createPool',
+                        lambda self: multiprocessing.dummy.Pool(3))
+
+    loaded = []
+    loadrecord = Retriever.GenBankRetriever.loadrecord
+    def recording_loadrecord(self, accession):
+        loaded.append(accession)
+        return loadrecord(self, accession)
+    monkeypatch.setattr(Retriever.GenBankRetriever, 'loadrecord',
+                        recording_loadrecord)
+
+    file_instance = File.File(output.Output('test'))
+    scheduler = Scheduler.Scheduler(workers=3)
+
+    variants = ['NM_003002.2:c.274G>T',
+                'NM_003002.2(SDHD_v001):c.5del',
+                'NM_003002.2:c.274G>A']
+    batch_file = io.BytesIO(('\n'.join(variants) + '\n').encode('utf-8'))
+    job, columns = file_instance.parseBatchFile(batch_file)
+    result_id = scheduler.addJob('test@test.test', job, columns,
+                                 'name-checker')
+
+    scheduler.process()
+    assert loaded == ['NM_003002.2']
+
+    filename = 'batch-job-%s.txt' % result_id
+    result = io.open(os.path.join(settings.CACHE_DIR, filename),
+                     encoding='utf-8')
+    next(result)  # Header.
+    assert [line.split('\t')[:2] for line in result] == [
+        [variant, ''] for variant in variants]
@@ -0,0 +1,123 @@
+"""
+Tests for the mutalyzer.sequence module.
+"""
+
+
+from __future__ import unicode_literals
+
+import copy
+import os
+
+from Bio.Seq import Seq
+import pytest
+
+from mutalyzer import sequence
+from mutalyzer.mutator import Mutator
+from mutalyzer import util
+
+
+SEQUENCE = 'ATGCATGCAAGGTTCCAATTGGCCAAATTTGGGCCC'
+
+
+@pytest.fixture
+def sequence_file(tmpdir):
+    path = tmpdir.join('sequence')
+    path.write(SEQUENCE + '\n')
+    yield unicode(path)
+    sequence.close_sequences()
+
+
+def test_open_sequence(sequence_file):
+    """
+    A mapped sequence behaves like the sequence itself.
+    """
+    mapped = sequence.open_sequence(sequence_file, len(SEQUENCE))
+    assert len(mapped) == len(SEQUENCE)
+    assert unicode(mapped) == SEQUENCE
+    assert mapped[3] == SEQUENCE[3]
+    assert mapped[-1] == SEQUENCE[-1]
+    assert isinstance(mapped[5:12], Seq)
+    assert unicode(mapped[5:12]) == SEQUENCE[5:12]
+    assert unicode(mapped[-5:]) == SEQUENCE[-5:]
+    assert unicode(mapped[12:5]) == ''
+    assert unicode(mapped[::3]) == SEQUENCE[::3]
+    assert unicode(mapped.reverse_complement()) == \
+        util.reverse_complement(SEQUENCE)
+    assert unicode(mapped[:0] + mapped[2:6] + 'AA') == SEQUENCE[2:6] + 'AA'
+    with pytest.raises(IndexError):
+        mapped[len(SEQUENCE)]
+
+
+def test_open_sequence_shared(sequence_file):
+    """
+    Sequences from the same file share a mapping and are not copied.
+    """
+    first = sequence.open_sequence(sequence_file)
+    second = sequence.open_sequence(sequence_file, 10)
+    assert first._mapping is second._mapping
+    assert len(first) == len(SEQUENCE) + 1
+    assert unicode(second) == SEQUENCE[:10]
+    assert copy.deepcopy(first) is first
+
+
+def test_open_sequence_replaced(sequence_file):
+    """
+    A replaced file is mapped again, sequences from the old file still work.
+    """
+    first = sequence.open_sequence(sequence_file, 10)
+    replacement = sequence_file + '.new'
+    with open(replacement, 'w') as handle:
+        handle.write(SEQUENCE[::-1])
+    os.rename(replacement, sequence_file)
+
+    second = sequence.open_sequence(sequence_file, 10)
+    assert first._mapping is not second._mapping
+    assert unicode(first) == SEQUENCE[:10]
+    assert unicode(second) == SEQUENCE[::-1][:10]
+    assert sequence.open_sequence(sequence_file)._mapping is second._mapping
+
+
+def test_open_sequence_missing(tmpdir):
+    """
+    Opening a missing or empty file fails with IOError.
+    """
+    with pytest.raises(IOError):
+        sequence.open_sequence(unicode(tmpdir.join('missing')))
+    path = tmpdir.join('empty')
+    path.write('')
+    with pytest.raises(IOError):
+        sequence.open_sequence(unicode(path))
+
+
+def test_mutator_splice(output, sequence_file):
+    """
+    Splicing and mutating a mapped sequence gives the same results as for an
+    ordinary sequence.
+    """
+    mapped = Mutator(sequence.open_sequence(sequence_file, len(SEQUENCE)),
+                     output)
+    ordinary = Mutator(Seq(SEQUENCE), output)
+    for mutator in mapped, ordinary:
+        mutator.deletion(5, 7)
+        mutator.insertion(20, 'TTT')
+    assert unicode(mapped.mutated) == unicode(ordinary.mutated)
+    assert unicode(util.splice(mapped.orig, [2, 8, 15, 30])) == \
+        unicode(util.splice(ordinary.orig, [2, 8, 15, 30]))
+
+
+@pytest.mark.parametrize('start,stop,insertion', [
+    (3, 8, 'GG'), (5, 5, 'TTT'), (0, 0, 'A'), (10, 4, 'C'), (-3, 40, ''),
+    (30, 50, 'AC')])
+def test_edited_sequence_replace(start, stop, insertion):
+    """
+    Replacing a range in an edited sequence is equivalent to rebuilding the
+    sequence from slices.
+    """
+    edited = sequence.EditedSequence(Seq(SEQUENCE)).replace(12, 20, 'CCC')
+    expected = SEQUENCE[:12] + 'CCC' + SEQUENCE[20:]
+    edited = edited.replace(start, stop, insertion)
+    expected = expected[:start] + insertion + expected[stop:]
+    assert unicode(edited) == expected
+    assert len(edited) == len(expected)
+    assert unicode(edited[2:25]) == expected[2:25]
+    assert ''.join(edited[i] for i in range(len(edited))) == expected
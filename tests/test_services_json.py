@@ -12,10 +12,13 @@ from spyne.server.null import NullServer
 
 import mutalyzer
 from mutalyzer import announce
+from mutalyzer import Retriever
 from mutalyzer.config import settings
 from mutalyzer import Scheduler
 from mutalyzer.services.json import application
 
+from fixtures import with_references
+
 
 # Todo: We currently have no way of testing POST requests to the JSON API. We
 #     had some tests for this, but they were removed with the new setup [1].
@@ -348,3 +351,66 @@ def test_transcript_order(api):
 
     acc = result_GL['chromosome_accession']
     assert result_NC[0][:len(acc)] == acc
+
+
+@with_references('NM_003002.2', 'NG_012772.1')
+def test_runmutalyzerlightbulk(monkeypatch, api):
+    """
+    Running runMutalyzerLightBulk should return the results in the order of
+    the variant descriptions, regardless of their reference, and load each
+    reference only once.
+    """
+    loaded = []
+    loadrecord = Retriever.GenBankRetriever.loadrecord
+    def mock_loadrecord(self, identifier, *args, **kwargs):
+        loaded.append(identifier)
+        return loadrecord(self, identifier, *args, **kwargs)
+    monkeypatch.setattr(Retriever.GenBankRetriever, 'loadrecord',
+                        mock_loadrecord)
+
+    checked = []
+    check_variant = Scheduler.variantchecker.check_variant
+    def mock_check_variant(description, *args, **kwargs):
+        checked.append(description)
+        return check_variant(description, *args, **kwargs)
+    monkeypatch.setattr(Scheduler.variantchecker, 'check_variant',
+                        mock_check_variant)
+
+    variants = ['NM_003002.2:c.274G>T',
+                'NG_012772.1(NM_000059.3):c.120A>G',
+                'NM_003002.2:c.273del']
+    r = api('runMutalyzerLightBulk', variants=variants)
+
+    assert checked == [variants[0], variants[2], variants[1]]
+    assert loaded == ['NM_003002.2', 'NG_012772.1']
+    assert [result['genomicDescription'] for result in r] == [
+        'NM_003002.2:n.335G>T', 'NG_012772.1:g.8650A>G',
+        'NM_003002.2:n.335del']
+    assert [result['errors'] for result in r] == [0, 0, 0]
+
+
+def test_runmutalyzerlightbulk_time_budget(monkeypatch, api):
+    """
+    Running runMutalyzerLightBulk without time budget should not check any
+    variant descriptions.
+    """
+    monkeypatch.setattr(settings, 'BULK_CHECK_TIME_BUDGET', 0)
+
+    r = api('runMutalyzerLightBulk',
+            variants=['NM_003002.2:c.274G>T', 'NM_003002.2:c.273del'])
+    assert len(r) == 2
+    for result in r:
+        assert result['errors'] == 1
+        assert result['messages'][0]['errorcode'] == 'ETIMEOUT'
+
+
+def test_runmutalyzerlightbulk_too_many(monkeypatch, api):
+    """
+    Running runMutalyzerLightBulk with too many variant descriptions should
+    raise an exception.
+    """
+    monkeypatch.setattr(settings, 'BULK_CHECK_MAX_VARIANTS', 1)
+
+    with pytest.raises(Fault):
+        api('runMutalyzerLightBulk',
+            variants=['NM_003002.2:c.274G>T', 'NM_003002.2:c.273del'])
@@ -7,6 +7,10 @@ from __future__ import unicode_literals
 
 import pytest
 
+from mutalyzer.output import Output
+from mutalyzer.Retriever import GenBankRetriever
+from mutalyzer import util
+from mutalyzer import variantchecker
 from mutalyzer.variantchecker import check_variant
 
 from fixtures import with_references
@@ -2422,3 +2426,103 @@ def test_ex_multiple_operations(output, checker):
     errorcount, warncount, summary = output.Summary()
     assert errorcount == 0
     assert output.getOutput('gDescription')[0] == u'g.[4823del;2954_4952del]'
+
+
+@with_references('AL449423.14')
+def test_declared_outputs(output):
+    """
+    Optional outputs are only added if they are declared.
+    """
+    check_variant('AL449423.14(CDKN2A_v001):c.161_163del', output,
+                  outputs={variantchecker.OUTPUT_ORIGINAL,
+                           variantchecker.OUTPUT_LEGENDS})
+    assert (output.getIndexedOutput('genomicDescription', 0) ==
+            'AL449423.14:g.61937_61939del')
+    assert 'AL449423.14(CDKN2A_i001):p.(Met54_Gly55delinsSer)' \
+           in output.getOutput('protDescriptions')
+    assert output.getOutput('original')
+    assert output.getOutput('legends')
+    for name in ('mutated', 'origMRNA', 'origCDS', 'oldProtein', 'newProtein',
+                 'visualisation', 'restrictionSites'):
+        assert not output.getOutput(name)
+
+
+@with_references('AL449423.14')
+def test_unaffected_transcripts(output, monkeypatch):
+    """
+    Transcripts not overlapping the variant get p.(=), translating their CDS
+    only once per record.
+    """
+    translated = []
+    splice = util.splice
+    def recording_splice(s, splice_sites):
+        translated.append(splice_sites)
+        return splice(s, splice_sites)
+    monkeypatch.setattr(util, 'splice', recording_splice)
+
+    check_variant('AL449423.14(CDKN2A_v001):c.161_163del', output)
+    protein_descriptions = output.getOutput('protDescriptions')
+    assert 'AL449423.14(CDKN2A_i001):p.(Met54_Gly55delinsSer)' \
+        in protein_descriptions
+    assert 'AL449423.14(CDKN2B_i001):p.(=)' in protein_descriptions
+    assert 'AL449423.14(CDKN2B_i002):p.(=)' in protein_descriptions
+
+    del translated[:]
+    check_variant('AL449423.14(CDKN2A_v001):c.161_163del', Output('test'))
+
+    # The variant is at g.61937_61939, CDKN2B is far away.
+    assert translated
+    assert all(min(sites) < 61940 and max(sites) > 61936
+               for sites in translated)
+
+
+def _genbank_record(sequence, features):
+    """
+    A minimal GenBank record with the given features (as tuples of gene
+    name and CDS range).
+    """
+    lines = ['LOCUS       TEST001                  %d bp    DNA     linear   '
+             'PRI 01-JAN-2000' % len(sequence),
+             'DEFINITION  Test record.',
+             'ACCESSION   TEST001',
+             'VERSION     TEST001.1',
+             'SOURCE      Homo sapiens (human)',
+             '  ORGANISM  Homo sapiens',
+             'FEATURES             Location/Qualifiers',
+             '     source          1..%d' % len(sequence),
+             '                     /organism="Homo sapiens"',
+             '                     /mol_type="genomic DNA"']
+    for gene, (start, stop) in features:
+        lines.extend(['     gene            %d..%d' % (start, stop),
+                      '                     /gene="%s"' % gene,
+                      '     CDS             %d..%d' % (start, stop),
+                      '                     /gene="%s"' % gene,
+                      '                     /codon_start=1',
+                      '                     /protein_id="%s.1"' % gene])
+    lines.append('ORIGIN')
+    for i in range(0, len(sequence), 60):
+        lines.append('%9d %s' % (i + 1, ' '.join(
+            sequence[j:j + 10] for j in range(i, min(i + 60, len(sequence)),
+                                              10))))
+    lines.append('//')
+    return ('\n'.join(lines) + '\n').encode('ascii')
+
+
+@pytest.mark.usefixtures('db')
+def test_unaffected_transcript_not_translatable(output):
+    """
+    Transcripts not overlapping the variant whose CDS cannot be translated
+    get p.? and a warning.
+    """
+    # The CDS of BBB has an internal stop codon.
+    sequence = ('c' * 10 + 'atggccgcctaa' + 'c' * 78 +
+                'atgtaggcctaa' + 'c' * 88)
+    ud = GenBankRetriever(output).uploadrecord(
+        _genbank_record(sequence, [('AAA', (11, 22)), ('BBB', (101, 112))]))
+
+    check_variant('%s(AAA_v001):c.4G>T' % ud, output)
+    protein_descriptions = output.getOutput('protDescriptions')
+    assert '%s(AAA_i001):p.(Ala2Ser)' % ud in protein_descriptions
+    assert '%s(BBB_i001):p.?' % ud in protein_descriptions
+    assert [message.code for message in output.getMessages()
+            if message.code.startswith('WTRANS')] == ['WTRANS_OTHER']